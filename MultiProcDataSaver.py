@@ -5,13 +5,21 @@ from multiprocessing import Event, Process, Queue, current_process
 from sqlalchemy import exc
 
 from .database_settings import DatabaseConfiguration
-from .xeniaAlchemy import xeniaAlchemy
+from .xenia_metrics import XeniaMetrics
+from .xenia_monitor import SensorLatencyTracker
+from .xenia_qc import StreamingQC
+from .xeniaAlchemy import MULTI_OBS_VALUE_COLUMNS, xeniaAlchemy
 
 logger = logging.getLogger(__name__)
 
+# How often, in records, the saver loop checks whether a stats line is due.
+STATS_CHECK_RECORDS = 1000
+
 
 class MultiProcessDataSaver(Process):
-    def __init__(self, database_configuration: DatabaseConfiguration, records_before_commit):
+    def __init__(self, database_configuration: DatabaseConfiguration, records_before_commit, bulk_insert=False,
+                 metrics_log_interval=None, stats_log_interval=60, qc_limits=None, qc_window_size=30,
+                 latency_flush_interval=None):
         Process.__init__(self)
         self.logger = logger
         self.data_queue = Queue()
@@ -19,6 +27,99 @@ class MultiProcessDataSaver(Process):
         self.database_configuration = database_configuration
         self._database_connection = None
         self._records_before_commit = records_before_commit
+        # When True, records are buffered and written records_before_commit at a time with
+        # xeniaAlchemy.add_multi_obs_bulk(), which also computes the_geom in the INSERT.
+        self._bulk_insert = bulk_insert
+        # When set, the process collects xenia_metrics statistics(method timings, queries, rows written and
+        # queue depth) and logs a summary line every metrics_log_interval seconds.
+        self._metrics_log_interval = metrics_log_interval
+        # Seconds between the INFO progress lines(records saved, rate and queue depth) logged from the loop.
+        self._stats_log_interval = stats_log_interval
+        # Optional xenia_qc.QCLimitsTable, records of sensors with limits get qc_flag/qc_level set by a
+        # xenia_qc.StreamingQC stage, from a rolling window of qc_window_size values per sensor, before they
+        # are written.
+        self._qc_limits = qc_limits
+        self._qc_window_size = qc_window_size
+        # When set, a xenia_monitor.SensorLatencyTracker follows the newest m_date, arrival time and gaps of
+        # every sensor saved and upserts them into sensor_latency every latency_flush_interval seconds.
+        self._latency_flush_interval = latency_flush_interval
+
+    def _write_bulk(self, db, records):
+        """
+        Writes the records with add_multi_obs_bulk(). Returns the (sensor_id, m_date) of the records written.
+        """
+        try:
+            db.add_multi_obs_bulk(records)
+            return [(data_rec.sensor_id, data_rec.m_date) for data_rec in records]
+        # A duplicate fails the whole batch, so fall back to adding the records one at a time.
+        except exc.IntegrityError:
+            logger.error(f"Duplicate record in batch of {len(records)}, saving records individually.")
+            written_records = []
+            for data_rec in records:
+                try:
+                    db.add_multi_obs_bulk([data_rec])
+                    written_records.append((data_rec.sensor_id, data_rec.m_date))
+                except exc.IntegrityError:
+                    logger.error(f"Duplicate sensor id: {data_rec.sensor_id} Datetime: {data_rec.m_date}")
+                except Exception as e:
+                    db.session.rollback()
+                    logger.exception(e)
+            return written_records
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(e)
+            return []
+
+    def _write_orm(self, db, records):
+        """
+        Commits the records added to the session. Returns the (sensor_id, m_date) of the records written.
+        """
+        # Read before committing, the commit expires the records and reading them afterwards is a query each.
+        record_keys = [(data_rec.sensor_id, data_rec.m_date) for data_rec in records]
+        try:
+            db.session.commit()
+            return record_keys
+        # A duplicate rolls back every pending record, so add them again one at a time.
+        except exc.IntegrityError:
+            db.session.rollback()
+            logger.error(f"Duplicate record in batch of {len(records)}, saving records individually.")
+            written_records = []
+            for data_rec, record_key in zip(records, record_keys):
+                try:
+                    db.session.add(data_rec)
+                    db.session.commit()
+                    written_records.append(record_key)
+                except exc.IntegrityError:
+                    db.session.rollback()
+                    logger.error(f"Duplicate sensor id: {data_rec.sensor_id} Datetime: {data_rec.m_date}")
+                except Exception as e:
+                    db.session.rollback()
+                    logger.exception(e)
+            return written_records
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(e)
+            return []
+
+    def _latency_commit_point(self, db, latency, written_records):
+        # Only records that made it into the database are observed, a rolled back batch leaves the latency
+        # and gap state untouched.
+        for sensor_id, m_date in written_records:
+            latency.observe(sensor_id, m_date)
+        latency.commit_point(db)
+
+    def _log_stats(self, rec_count, last_rec_count, elapsed, interval_elapsed, metrics):
+        try:
+            queue_size = self.data_queue.qsize()
+        # We get this exception under OSX.
+        except NotImplementedError:
+            queue_size = None
+        if metrics is not None and queue_size is not None:
+            metrics.set_gauge('saver_queue_depth', queue_size)
+        logger.info("%s saved %d records in %.1f seconds, %.1f records/sec over the last %.1f seconds. "
+                    "Approximate records in DB queue: %s", current_process().name, rec_count, elapsed,
+                    (rec_count - last_rec_count) / interval_elapsed if interval_elapsed else 0.0, interval_elapsed,
+                    queue_size)
 
     def run(self):
         logger = logging.getLogger(__name__)
@@ -26,8 +127,14 @@ class MultiProcessDataSaver(Process):
             logger.info(f"{current_process()} data saver started.")
             process_data = True
             db = xeniaAlchemy()
+            metrics = None
+            if self._metrics_log_interval:
+                metrics = XeniaMetrics()
+                metrics.start_periodic_log(self._metrics_log_interval, logger)
             connection_string = self.database_configuration.get_connection_string()
-            if (db.connect_db(connection_string, False)):
+            if (db.connect_db(connection_string, False, metrics=metrics,
+                              sqlite_pragmas=self.database_configuration.sqlite_pragmas,
+                              spatialite=self.database_configuration.spatialite)):
                 logger.info(f"Successfully connect to DB: {self.database_configuration.database_name}")
             else:
                 logger.error(f"Unable to connect to DB: {self.database_configuration.database_name}. Terminating process.")
@@ -36,42 +143,87 @@ class MultiProcessDataSaver(Process):
             if db is not None:
                 start_time = time.time()
                 rec_count = 0
+                bulk_records = []
+                # Records added to the session since the last commit of the ORM path.
+                orm_records = []
+                # Checked once, per record debug logging is skipped entirely unless DEBUG is enabled.
+                debug_enabled = logger.isEnabledFor(logging.DEBUG)
+                # The clock is only read every STATS_CHECK_RECORDS records to decide if a stats line is due.
+                last_stats_time = time.monotonic()
+                last_stats_count = 0
+                qc = StreamingQC(self._qc_limits, self._qc_window_size) if self._qc_limits else None
+                latency = None
+                if process_data and self._latency_flush_interval is not None:
+                    latency = SensorLatencyTracker(flush_interval=self._latency_flush_interval)
+                    latency.load(db)
                 while process_data:
                     data_rec = self.data_queue.get()
                     if data_rec is not None:
                         try:
-                            db.session.add(data_rec)
-                            if (rec_count % self._records_before_commit) == 0:
-                                db.session.commit()
-
-                            val = ""
-                            if data_rec.m_value is not None:
-                                val = "%f" % (data_rec.m_value)
-                            logger.debug(
-                                f"Adding record Sensor: {data_rec.sensor_id} Datetime: {data_rec.m_date} Value: {val}")
-
-                            if ((rec_count % 10) == 0):
-                                try:
-                                    logger.debug(f"Approximate record count in DB queue: {self.data_queue.qsize()}")
-                                # We get this exception under OSX.
-                                except NotImplementedError:
-                                    pass
-
-                                rec_count += 1
-                        # Trying to add record that already exists.
-                        except exc.IntegrityError:
-                            logger.error(f"Duplicate sensor id: {data_rec.sensor_id} Datetime: {data_rec.m_date}")
-                            db.session.rollback()
+                            rec_count += 1
+                            if qc is not None:
+                                qc.apply(data_rec)
+                            if self._bulk_insert:
+                                bulk_records.append(data_rec)
+                                if len(bulk_records) >= self._records_before_commit:
+                                    try:
+                                        written_records = self._write_bulk(db, bulk_records)
+                                    # Written or not the batch is done with, it must not carry into the next one.
+                                    finally:
+                                        bulk_records = []
+                                    if latency is not None:
+                                        self._latency_commit_point(db, latency, written_records)
+                            else:
+                                db.session.add(data_rec)
+                                orm_records.append(data_rec)
+                                if len(orm_records) >= self._records_before_commit:
+                                    written_records = self._write_orm(db, orm_records)
+                                    orm_records = []
+                                    if metrics is not None:
+                                        metrics.add_rows_written(len(written_records), 'MultiProcessDataSaver')
+                                    if latency is not None:
+                                        self._latency_commit_point(db, latency, written_records)
+
+                            if debug_enabled:
+                                logger.debug("Adding record Sensor: %s Datetime: %s Values: %s",
+                                             data_rec.sensor_id, data_rec.m_date,
+                                             [getattr(data_rec, column_name) for column_name in MULTI_OBS_VALUE_COLUMNS
+                                              if getattr(data_rec, column_name) is not None])
+
+                            if self._stats_log_interval and (rec_count % STATS_CHECK_RECORDS) == 0:
+                                now = time.monotonic()
+                                if now - last_stats_time >= self._stats_log_interval:
+                                    self._log_stats(rec_count, last_stats_count, time.time() - start_time,
+                                                    now - last_stats_time, metrics)
+                                    last_stats_time = now
+                                    last_stats_count = rec_count
                         except Exception as e:
                             db.session.rollback()
                             logger.exception(e)
+                            if orm_records:
+                                logger.error(f"Discarded {len(orm_records)} uncommitted records.")
+                                orm_records = []
 
                     else:
                         process_data = False
-                        db.session.commit()
+                        written_records = []
+                        if bulk_records:
+                            written_records = self._write_bulk(db, bulk_records)
+                        if orm_records:
+                            written_records = self._write_orm(db, orm_records)
+                            orm_records = []
+                            if metrics is not None:
+                                metrics.add_rows_written(len(written_records), 'MultiProcessDataSaver')
+                        if latency is not None:
+                            self._latency_commit_point(db, latency, written_records)
+                            latency.flush(db)
 
                 db.disconnect()
-                logger.debug(f"{current_process().name} completed in {time.time() - start_time} seconds.")
+                logger.info("%s completed, saved %d records in %.1f seconds.", current_process().name, rec_count,
+                            time.time() - start_time)
+                if metrics is not None:
+                    metrics.stop_periodic_log()
+                    logger.info(f"{current_process().name} stats: {metrics.summary_line()}")
 
         except Exception as e:
             logger.exception(e)
@@ -1,9 +1,24 @@
 import logging.config
+import sys
+from array import array
 
-from sqlalchemy import CHAR, Column, DateTime, Float, ForeignKey, Integer, String
+from geoalchemy2 import Geometry
+from sqlalchemy import (
+    CHAR,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Integer,
+    LargeBinary,
+    String,
+    UniqueConstraint,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, REAL
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from geoalchemy2 import Geometry
+from sqlalchemy.types import TypeDecorator
+
 logger = logging.getLogger(__name__)
 
 Base = declarative_base()
@@ -254,6 +269,8 @@ class multi_obs(Base):
     d_label_theta = Column(Integer)
     d_top_of_hour = Column(Integer)
     d_report_hour = Column(DateTime(timezone=False))
+    # Seconds covered by an aggregate row written by xenia_retention, NULL for raw observations.
+    aggregate_period = Column(Integer)
     # the_geom         = GeometryColumn(Point(2))
     the_geom = Column(Geometry('Point'))
 
@@ -288,7 +305,8 @@ class multi_obs(Base):
                  metadata_id=None,
                  d_label_theta=None,
                  d_top_of_hour=None,
-                 d_report_hour=None
+                 d_report_hour=None,
+                 aggregate_period=None
                  ):
         super().__init__()
         self.row_id = row_id
@@ -319,6 +337,7 @@ class multi_obs(Base):
         self.d_label_theta = d_label_theta
         self.d_top_of_hour = d_top_of_hour
         self.d_report_hour = d_report_hour
+        self.aggregate_period = aggregate_period
 
 
 class platform_status(Base):
@@ -373,3 +392,93 @@ class timestamp_lkp(Base):
     pass_timestamp = Column(DateTime(timezone=False))
     filepath = Column(String(200))
 
+
+
+class sync_state(Base):
+    __tablename__ = 'sync_state'
+    row_id = Column(Integer, primary_key=True)
+    row_entry_date = Column(DateTime(timezone=False))
+    row_update_date = Column(DateTime(timezone=False))
+    # Identifies the source database, e.g. the collector's platform or host name.
+    source_name = Column(String(100), unique=True, nullable=False)
+    # High-water mark: the last source multi_obs.row_id copied to this database.
+    last_row_id = Column(Integer, nullable=False, default=0)
+    last_m_date = Column(DateTime(timezone=False))
+    rows_synced = Column(Integer, nullable=False, default=0)
+
+
+class sensor_latency(Base):
+    __tablename__ = 'sensor_latency'
+    row_id = Column(Integer, primary_key=True)
+    row_update_date = Column(DateTime(timezone=False))
+    sensor_id = Column(Integer, ForeignKey(sensor.row_id), unique=True, nullable=False)
+    # Newest observation time seen for the sensor and when it arrived.
+    last_m_date = Column(DateTime(timezone=False))
+    last_arrival_date = Column(DateTime(timezone=False))
+    # Seconds between last_m_date and its arrival.
+    last_latency = Column(Float)
+    # Gaps longer than the monitor's threshold of sensor.report_interval, the latest one's bounds.
+    gap_count = Column(Integer, nullable=False, default=0)
+    last_gap_start = Column(DateTime(timezone=False))
+    last_gap_end = Column(DateTime(timezone=False))
+
+    sensor = relationship(sensor)
+
+
+class FloatArray(TypeDecorator):
+    """
+    A list of floats stored as a PostgreSQL real[] or, on other databases, packed little-endian float32 bytes.
+    Values are single precision on both.
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(ARRAY(REAL))
+        return dialect.type_descriptor(LargeBinary())
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name == 'postgresql':
+            return value
+        packed = array('f', value)
+        if sys.byteorder == 'big':
+            packed.byteswap()
+        return packed.tobytes()
+
+    def process_result_value(self, value, dialect):
+        if value is None or dialect.name == 'postgresql':
+            return value
+        packed = array('f')
+        packed.frombytes(value)
+        if sys.byteorder == 'big':
+            packed.byteswap()
+        return packed.tolist()
+
+
+class multi_obs_array(Base):
+    """
+    Array valued observations, an ADCP profile or a wave spectrum, one row per sensor and m_date instead of a
+    multi_obs row per bin.
+    """
+    __tablename__ = 'multi_obs_array'
+    __table_args__ = (UniqueConstraint('sensor_id', 'm_date', name='uq_multi_obs_array_sensor_id_m_date'),)
+    row_id = Column(Integer, primary_key=True)
+    row_entry_date = Column(DateTime(timezone=False))
+    platform_handle = Column(String(100))
+    sensor_id = Column(Integer, ForeignKey(sensor.row_id), nullable=False)
+    m_type_id = Column(Integer, ForeignKey(m_type.row_id))
+    m_date = Column(DateTime(timezone=False), nullable=False)
+    m_lon = Column(Float)
+    m_lat = Column(Float)
+    num_values = Column(Integer, nullable=False)
+    # One value per bin.
+    m_values = Column(FloatArray, nullable=False)
+    # The bin coordinate, depths of a profile or frequencies of a spectrum. NULL when the bins are
+    # regular: bin i is at bin_start + i * bin_size.
+    bin_values = Column(FloatArray)
+    bin_start = Column(Float)
+    bin_size = Column(Float)
+    qc_level = Column(Integer)
+
+    sensor = relationship(sensor)
@@ -0,0 +1,50 @@
+"""
+Xenia observations database.
+
+The public classes are importable from the package, but each module is only imported on first access(PEP 562),
+so a tool that only needs DatabaseConfiguration doesn't pay for SQLAlchemy, geoalchemy2 and the table models.
+"""
+import importlib
+
+# Public name -> module it lives in. The xeniaAlchemy class isn't listed since the submodule of the same name
+# replaces the package attribute when it's imported, use "from .xeniaAlchemy import xeniaAlchemy".
+_LAZY_ATTRIBUTES = {
+    'DatabaseConfiguration': 'database_settings',
+    'MultiProcessDataSaver': 'MultiProcDataSaver',
+    'ObsMap': 'xenia_obs_map',
+    'JSONObsMap': 'xenia_obs_map',
+    'PlatformObsMap': 'xenia_obs_map',
+    'ObsMapCache': 'xenia_obs_map_cache',
+    'PlatformSpatialIndex': 'xenia_platform_index',
+    'XeniaMetrics': 'xenia_metrics',
+    'SlowQueryRecorder': 'xenia_slow_query',
+    'MultiObsSync': 'xenia_sync',
+    'MultiObsExporter': 'xenia_export',
+    'MultiObsImporter': 'xenia_import',
+    'MultiObsArchive': 'xenia_archive',
+    'RetentionEngine': 'xenia_retention',
+    'RetentionPolicy': 'xenia_retention',
+    'QCEngine': 'xenia_qc',
+    'QCLimits': 'xenia_qc',
+    'QCLimitsTable': 'xenia_qc',
+    'StreamingQC': 'xenia_qc',
+    'SensorLatencyTracker': 'xenia_monitor',
+    'SensorHealthMonitor': 'xenia_monitor',
+    'CurrentStatusView': 'xenia_status',
+}
+
+__all__ = sorted(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    # Cache on the package so later lookups don't go through __getattr__.
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,57 @@
+"""Spatial indexes on platform and multi_obs the_geom
+
+Revision ID: 3f9c2d7a1b64
+Revises: 8833a581b384
+Create Date: 2026-10-19 09:12:40.118204
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9c2d7a1b64'
+down_revision: Union[str, Sequence[str], None] = '8833a581b384'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Same names geoalchemy2 uses when it creates the indexes from the models.
+SPATIAL_INDEXES = (
+    ('idx_platform_the_geom', 'platform'),
+    ('idx_multi_obs_the_geom', 'multi_obs'),
+)
+
+
+def _has_spatialite(bind) -> bool:
+    try:
+        bind.execute(sa.text("SELECT spatialite_version()"))
+        return True
+    except sa.exc.OperationalError:
+        return False
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        for index_name, table_name in SPATIAL_INDEXES:
+            op.create_index(index_name, table_name, ['the_geom'], unique=False,
+                            postgresql_using='gist', if_not_exists=True)
+    elif bind.dialect.name == 'sqlite' and _has_spatialite(bind):
+        # SpatiaLite keeps its R-tree in a virtual table, CreateSpatialIndex is a no-op if it already exists.
+        for _, table_name in SPATIAL_INDEXES:
+            op.execute("SELECT CreateSpatialIndex('%s', 'the_geom')" % (table_name))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        for index_name, table_name in SPATIAL_INDEXES:
+            op.drop_index(index_name, table_name=table_name, postgresql_using='gist', if_exists=True)
+    elif bind.dialect.name == 'sqlite' and _has_spatialite(bind):
+        for _, table_name in SPATIAL_INDEXES:
+            op.execute("SELECT DisableSpatialIndex('%s', 'the_geom')" % (table_name))
+            op.execute("DROP TABLE IF EXISTS idx_%s_the_geom" % (table_name))
@@ -0,0 +1,42 @@
+"""sync_state high-water marks and the multi_obs sensor_id, m_date index
+
+Revision ID: 5b8e41c0d2f7
+Revises: 3f9c2d7a1b64
+Create Date: 2026-10-19 14:03:27.530611
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '5b8e41c0d2f7'
+down_revision: Union[str, Sequence[str], None] = '3f9c2d7a1b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('sync_state',
+    sa.Column('row_id', sa.Integer(), nullable=False),
+    sa.Column('row_entry_date', sa.DateTime(timezone=False), nullable=True),
+    sa.Column('row_update_date', sa.DateTime(timezone=False), nullable=True),
+    sa.Column('source_name', sa.String(length=100), nullable=False),
+    sa.Column('last_row_id', sa.Integer(), nullable=False),
+    sa.Column('last_m_date', sa.DateTime(timezone=False), nullable=True),
+    sa.Column('rows_synced', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('row_id'),
+    sa.UniqueConstraint('source_name')
+    )
+    # The sync skips rows the central database already has with a NOT EXISTS probe on these columns.
+    op.create_index('ix_multi_obs_sensor_id_m_date', 'multi_obs', ['sensor_id', 'm_date'], unique=False,
+                    if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_multi_obs_sensor_id_m_date', table_name='multi_obs', if_exists=True)
+    op.drop_table('sync_state')
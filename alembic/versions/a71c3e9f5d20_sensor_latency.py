@@ -0,0 +1,41 @@
+"""sensor_latency, last observation and arrival time per sensor
+
+Revision ID: a71c3e9f5d20
+Revises: 5b8e41c0d2f7
+Create Date: 2026-10-19 16:41:09.284517
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'a71c3e9f5d20'
+down_revision: Union[str, Sequence[str], None] = '5b8e41c0d2f7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('sensor_latency',
+    sa.Column('row_id', sa.Integer(), nullable=False),
+    sa.Column('row_update_date', sa.DateTime(timezone=False), nullable=True),
+    sa.Column('sensor_id', sa.Integer(), nullable=False),
+    sa.Column('last_m_date', sa.DateTime(timezone=False), nullable=True),
+    sa.Column('last_arrival_date', sa.DateTime(timezone=False), nullable=True),
+    sa.Column('last_latency', sa.Float(), nullable=True),
+    sa.Column('gap_count', sa.Integer(), nullable=False),
+    sa.Column('last_gap_start', sa.DateTime(timezone=False), nullable=True),
+    sa.Column('last_gap_end', sa.DateTime(timezone=False), nullable=True),
+    sa.ForeignKeyConstraint(['sensor_id'], ['sensor.row_id'], ),
+    sa.PrimaryKeyConstraint('row_id'),
+    sa.UniqueConstraint('sensor_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('sensor_latency')
@@ -0,0 +1,37 @@
+"""platform_status and sensor_status current status indexes
+
+Revision ID: b4d2e8f6a913
+Revises: a71c3e9f5d20
+Create Date: 2026-10-19 16:48:05.274913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4d2e8f6a913'
+down_revision: Union[str, Sequence[str], None] = 'a71c3e9f5d20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The current status of an entity is its latest row by begin_date, these cover that lookup for one entity and
+# the per entity ranking of the bulk reads.
+STATUS_INDEXES = (
+    ('ix_platform_status_platform_id_begin_date', 'platform_status', ['platform_id', 'begin_date']),
+    ('ix_platform_status_platform_handle_begin_date', 'platform_status', ['platform_handle', 'begin_date']),
+    ('ix_sensor_status_sensor_id_begin_date', 'sensor_status', ['sensor_id', 'begin_date']),
+    ('ix_sensor_status_platform_id', 'sensor_status', ['platform_id']),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for index_name, table_name, columns in STATUS_INDEXES:
+        op.create_index(index_name, table_name, columns, unique=False, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for index_name, table_name, _ in STATUS_INDEXES:
+        op.drop_index(index_name, table_name=table_name, if_exists=True)
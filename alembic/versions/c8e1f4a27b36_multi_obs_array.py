@@ -0,0 +1,51 @@
+"""multi_obs_array, array valued observations(profiles, spectra)
+
+Revision ID: c8e1f4a27b36
+Revises: b4d2e8f6a913
+Create Date: 2026-10-19 17:26:51.903348
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'c8e1f4a27b36'
+down_revision: Union[str, Sequence[str], None] = 'b4d2e8f6a913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# XeniaTables.FloatArray: real[] on PostgreSQL, packed float32 bytes elsewhere.
+FLOAT_ARRAY = sa.LargeBinary().with_variant(postgresql.ARRAY(sa.REAL()), 'postgresql')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('multi_obs_array',
+    sa.Column('row_id', sa.Integer(), nullable=False),
+    sa.Column('row_entry_date', sa.DateTime(timezone=False), nullable=True),
+    sa.Column('platform_handle', sa.String(length=100), nullable=True),
+    sa.Column('sensor_id', sa.Integer(), nullable=False),
+    sa.Column('m_type_id', sa.Integer(), nullable=True),
+    sa.Column('m_date', sa.DateTime(timezone=False), nullable=False),
+    sa.Column('m_lon', sa.Float(), nullable=True),
+    sa.Column('m_lat', sa.Float(), nullable=True),
+    sa.Column('num_values', sa.Integer(), nullable=False),
+    sa.Column('m_values', FLOAT_ARRAY, nullable=False),
+    sa.Column('bin_values', FLOAT_ARRAY, nullable=True),
+    sa.Column('bin_start', sa.Float(), nullable=True),
+    sa.Column('bin_size', sa.Float(), nullable=True),
+    sa.Column('qc_level', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['m_type_id'], ['m_type.row_id'], ),
+    sa.ForeignKeyConstraint(['sensor_id'], ['sensor.row_id'], ),
+    sa.PrimaryKeyConstraint('row_id'),
+    sa.UniqueConstraint('sensor_id', 'm_date', name='uq_multi_obs_array_sensor_id_m_date')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('multi_obs_array')
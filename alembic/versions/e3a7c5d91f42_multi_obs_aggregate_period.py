@@ -0,0 +1,29 @@
+"""multi_obs.aggregate_period, marks the aggregates written by the retention job
+
+Revision ID: e3a7c5d91f42
+Revises: c8e1f4a27b36
+Create Date: 2026-10-19 18:02:14.507361
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3a7c5d91f42'
+down_revision: Union[str, Sequence[str], None] = 'c8e1f4a27b36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Nullable without a default, PostgreSQL adds it without rewriting multi_obs.
+    op.add_column('multi_obs', sa.Column('aggregate_period', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('multi_obs', 'aggregate_period')
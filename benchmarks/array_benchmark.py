@@ -0,0 +1,194 @@
+"""
+Benchmark of array valued observations(profiles, spectra) stored in multi_obs_array against the same data
+stored as one multi_obs row per bin, m_z holding the bin coordinate.
+
+For profiles x bins values it times:
+  write - add_multi_obs_array_bulk() against add_multi_obs_bulk(), batch_size profiles per call.
+  read  - get_multi_obs_arrays() against get_multi_obs() over the whole series and over one day windows.
+  size  - bytes of each table including its indexes: dbstat on SQLite(when the SQLite build has it),
+          pg_total_relation_size() on PostgreSQL.
+Against a database other than the default temporary SQLite file the rows of the benchmark sensor are deleted
+when it finishes.
+
+Run from the directory containing the package:
+    python -m ObservationsDatabase.benchmarks.array_benchmark --profiles 2000 --bins 100
+    python -m ObservationsDatabase.benchmarks.array_benchmark --db-url postgresql://bench@localhost/xenia_bench
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+import sqlalchemy
+from sqlalchemy import create_engine, text
+
+from ..xeniaAlchemy import xeniaAlchemy
+from .synthetic import create_schema, seed_metadata, temporary_sqlite_url
+
+START_DATE = datetime(2024, 1, 1)
+
+TABLES = ('multi_obs_array', 'multi_obs')
+
+
+def generate_profiles(sensor_info, profile_count, bin_count, interval_minutes, bin_start, bin_size, seed):
+    """
+    Returns the multi_obs_array records and the equivalent per bin multi_obs records.
+    """
+    random_gen = random.Random(seed)
+    sensor_id, m_type_id, platform_handle, longitude, latitude = sensor_info
+    array_records = []
+    bin_records = []
+    for ndx in range(profile_count):
+        m_date = START_DATE + timedelta(minutes=interval_minutes * ndx)
+        values = [round(random_gen.gauss(0.5, 0.2), 3) for _ in range(bin_count)]
+        array_records.append(dict(platform_handle=platform_handle, sensor_id=sensor_id, m_type_id=m_type_id,
+                                  m_date=m_date, m_lon=longitude, m_lat=latitude, m_values=values,
+                                  bin_start=bin_start, bin_size=bin_size))
+        bin_records.extend(dict(row_entry_date=datetime.now(), platform_handle=platform_handle, sensor_id=sensor_id,
+                                m_type_id=m_type_id, m_date=m_date, m_lon=longitude, m_lat=latitude,
+                                m_z=bin_start + bin_ndx * bin_size, m_value=value)
+                           for bin_ndx, value in enumerate(values))
+    return array_records, bin_records
+
+
+def time_writes(db, method, records, batch_size):
+    start_time = time.perf_counter()
+    for ndx in range(0, len(records), batch_size):
+        method(records[ndx:ndx + batch_size])
+    return round(time.perf_counter() - start_time, 3)
+
+
+def time_reads(method, call_args):
+    # The first call warms the connection and the statement cache.
+    method(*call_args[0])
+    timings = []
+    for args in call_args:
+        start_time = time.perf_counter()
+        rows = method(*args)
+        timings.append(time.perf_counter() - start_time)
+    return {'p50_ms': round(statistics.median(timings) * 1000, 3), 'rows_last_call': len(rows)}
+
+
+def table_sizes(db_url):
+    """
+    Bytes per table including its indexes, None where the database can't report it.
+    """
+    engine = create_engine(db_url)
+    sizes = {}
+    try:
+        with engine.connect() as connection:
+            if engine.dialect.name == 'postgresql':
+                for table_name in TABLES:
+                    sizes[table_name] = connection.execute(text("SELECT pg_total_relation_size(:table_name)"),
+                                                           {'table_name': table_name}).scalar()
+            elif engine.dialect.name == 'sqlite':
+                try:
+                    rows = connection.execute(text(
+                        "SELECT m.tbl_name, SUM(d.pgsize) FROM dbstat d JOIN sqlite_master m ON m.name = d.name "
+                        "GROUP BY m.tbl_name")).all()
+                    sizes = {table_name: size for table_name, size in rows if table_name in TABLES}
+                except sqlalchemy.exc.OperationalError:
+                    print("This SQLite build has no dbstat, sizes are not reported.", file=sys.stderr)
+    finally:
+        engine.dispose()
+    return {table_name: sizes.get(table_name) for table_name in TABLES}
+
+
+def delete_rows(db_url, sensor_id):
+    engine = create_engine(db_url)
+    try:
+        with engine.begin() as connection:
+            for table_name in TABLES:
+                connection.execute(text(f"DELETE FROM {table_name} WHERE sensor_id = :sensor_id"),
+                                   {'sensor_id': sensor_id})
+    finally:
+        engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="multi_obs_array against per bin multi_obs rows benchmark.")
+    parser.add_argument("--db-url", default=None, help="SQLAlchemy URL, defaults to a temporary SQLite file.")
+    parser.add_argument("--profiles", type=int, default=2000)
+    parser.add_argument("--bins", type=int, default=100)
+    parser.add_argument("--interval-minutes", type=int, default=10, help="Minutes between profiles.")
+    parser.add_argument("--batch-size", type=int, default=100, help="Profiles per bulk write call.")
+    parser.add_argument("--read-iterations", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="Write the JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    temporary_database = None
+    db_url = args.db_url
+    if db_url is None:
+        temporary_database = temporary_sqlite_url(prefix='xenia_array_bench_')
+        db_url = temporary_database
+
+    db = xeniaAlchemy()
+    try:
+        create_schema(db_url)
+        sensor_info = seed_metadata(db_url, 1, 1, seed=args.seed)[0]
+        array_records, bin_records = generate_profiles(sensor_info, args.profiles, args.bins, args.interval_minutes,
+                                                       2.0, 0.5, args.seed)
+        if not db.connect_db(db_url, False):
+            return 1
+        writes = {
+            'multi_obs_array': time_writes(db, db.add_multi_obs_array_bulk, array_records, args.batch_size),
+            'multi_obs': time_writes(db, db.add_multi_obs_bulk, bin_records, args.batch_size * args.bins),
+        }
+
+        sensor_ids = [sensor_info[0]]
+        end_date = START_DATE + timedelta(minutes=args.interval_minutes * args.profiles)
+        random_gen = random.Random(args.seed)
+        day_count = max(1, (end_date - START_DATE).days)
+        day_windows = []
+        for _ in range(args.read_iterations):
+            window_start = START_DATE + timedelta(days=random_gen.randrange(day_count))
+            day_windows.append((sensor_ids, window_start, window_start + timedelta(days=1)))
+        series = [(sensor_ids, START_DATE, end_date)] * args.read_iterations
+        reads = {
+            'multi_obs_array': {'series': time_reads(db.get_multi_obs_arrays, series),
+                                'window_1_day': time_reads(db.get_multi_obs_arrays, day_windows)},
+            'multi_obs': {'series': time_reads(db.get_multi_obs, series),
+                          'window_1_day': time_reads(db.get_multi_obs, day_windows)},
+        }
+        db.disconnect()
+        sizes = table_sizes(db_url)
+        if temporary_database is None:
+            delete_rows(db_url, sensor_info[0])
+    finally:
+        if temporary_database is not None and os.path.exists(temporary_database[len('sqlite:///'):]):
+            os.remove(temporary_database[len('sqlite:///'):])
+
+    print("%-16s %10s %14s %14s %14s" % ("table", "write s", "series p50 ms", "1 day p50 ms", "bytes"),
+          file=sys.stderr)
+    for table_name in TABLES:
+        print("%-16s %10.3f %14.3f %14.3f %14s" % (table_name, writes[table_name],
+                                                   reads[table_name]['series']['p50_ms'],
+                                                   reads[table_name]['window_1_day']['p50_ms'], sizes[table_name]),
+              file=sys.stderr)
+    output = {
+        'benchmark': 'array',
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'sqlalchemy': sqlalchemy.__version__,
+        'dialect': sqlalchemy.engine.make_url(db_url).get_backend_name(),
+        'parameters': {'profiles': args.profiles, 'bins': args.bins, 'interval_minutes': args.interval_minutes,
+                       'batch_size': args.batch_size, 'read_iterations': args.read_iterations},
+        'write_seconds': writes,
+        'reads': reads,
+        'table_bytes': sizes
+    }
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(output, output_file, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
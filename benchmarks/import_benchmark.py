@@ -0,0 +1,90 @@
+"""
+Cold start benchmark for importing the package.
+
+Every import statement runs in a fresh interpreter, as a cron job or CLI tool would, and is repeated to report
+the median and best wall time. Each result also records whether SQLAlchemy, geoalchemy2 and multiprocessing
+ended up loaded, which is what the lazy package structure is meant to avoid for the light entry points.
+
+Run from the directory containing the package:
+    python -m ObservationsDatabase.benchmarks.import_benchmark --repeat 10
+    python -m ObservationsDatabase.benchmarks.import_benchmark --statement "from {package} import XeniaMetrics"
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+PACKAGE = __package__.rsplit('.', 1)[0]
+PACKAGE_PARENT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# {package} is replaced with the package name.
+DEFAULT_STATEMENTS = (
+    "import {package}",
+    "from {package} import DatabaseConfiguration",
+    "from {package}.xenia_obs_map import PlatformObsMap",
+    "from {package} import XeniaMetrics",
+    "from {package}.xeniaAlchemy import xeniaAlchemy",
+    "from {package}.MultiProcDataSaver import MultiProcessDataSaver",
+)
+
+HEAVY_MODULES = ('sqlalchemy', 'sqlalchemy.orm', 'geoalchemy2', 'multiprocessing')
+
+PROBE = """
+import sys, time
+start_time = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start_time
+print(elapsed, ",".join(name for name in {heavy_modules!r} if name in sys.modules))
+"""
+
+
+def time_import(statement, repeat):
+    timings = []
+    loaded_modules = None
+    probe = PROBE.format(statement=statement, heavy_modules=HEAVY_MODULES)
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", probe], cwd=PACKAGE_PARENT, check=True, capture_output=True,
+                                text=True).stdout.split()
+        timings.append(float(output[0]))
+        loaded_modules = output[1].split(',') if len(output) > 1 else []
+    return {
+        'statement': statement,
+        'median_ms': round(statistics.median(timings) * 1000, 2),
+        'best_ms': round(min(timings) * 1000, 2),
+        'loaded': loaded_modules
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Xenia package import time benchmark.")
+    parser.add_argument("--repeat", type=int, default=7, help="Fresh interpreters per statement.")
+    parser.add_argument("--statement", action="append", default=None,
+                        help="Import statement to time, may be repeated. {package} is the package name.")
+    parser.add_argument("--output", default=None, help="Write the JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    results = []
+    for statement in (args.statement or DEFAULT_STATEMENTS):
+        result = time_import(statement.format(package=PACKAGE), args.repeat)
+        print(f"{result['median_ms']:9.1f} ms  {result['statement']:65} {','.join(result['loaded'])}", file=sys.stderr)
+        results.append(result)
+
+    report = {
+        'benchmark': 'import',
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'parameters': {'repeat': args.repeat},
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""
+Ingest benchmark for the xeniaAlchemy write paths and MultiProcessDataSaver.
+
+Generates synthetic platforms, sensors and multi_obs streams and measures records/sec, p50/p99 commit
+latency and peak memory across batch sizes, worker counts and write backends:
+  orm  - session.add() per record, commit every batch (the original saver path).
+  bulk - xeniaAlchemy.add_multi_obs_bulk() per batch.
+Every configuration runs in its own process so peak RSS is per configuration. With the default temporary
+SQLite database each configuration also gets a fresh database file. Against another database, e.g. a
+local PostgreSQL stand-in, the rows written for the 'bench' organization are deleted after every run.
+
+A configuration that raises, or whose savers write fewer records than they were fed, is reported with an
+error and the benchmark exits with status 1.
+
+Run from the directory containing the package:
+    python -m ObservationsDatabase.benchmarks.ingest_benchmark --records 20000 --output ingest.json
+    python -m ObservationsDatabase.benchmarks.ingest_benchmark --db-url postgresql://bench@localhost/xenia_bench
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform as host_platform
+import resource
+import sys
+import time
+from datetime import datetime
+
+import sqlalchemy
+
+from ..MultiProcDataSaver import MultiProcessDataSaver
+from ..xeniaAlchemy import xeniaAlchemy
+from .synthetic import (
+    count_observations,
+    create_schema,
+    database_configuration,
+    delete_observations,
+    generate_observations,
+    seed_metadata,
+    temporary_sqlite_url,
+)
+
+START_DATE = datetime(2024, 1, 1)
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    ordered = sorted(values)
+    ndx = min(len(ordered) - 1, int(round((percent / 100.0) * (len(ordered) - 1))))
+    return ordered[ndx]
+
+
+def max_rss_kb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    max_rss = resource.getrusage(who).ru_maxrss
+    return max_rss // 1024 if sys.platform == 'darwin' else max_rss
+
+
+def prepare_database(db_url, args):
+    create_schema(db_url)
+    return seed_metadata(db_url, args.platforms, args.sensors)
+
+
+def run_write_path(db_url, sensors, backend, batch_size, record_count):
+    """
+    Writes record_count observations through xeniaAlchemy in the current process, timing every commit.
+    """
+    db = xeniaAlchemy()
+    if not db.connect_db(db_url, False):
+        raise RuntimeError(f"Unable to connect to: {db_url}")
+    commit_latencies = []
+    written_count = 0
+    records = generate_observations(sensors, START_DATE, record_count)
+    start_time = time.perf_counter()
+    try:
+        batch = []
+        for rec in records:
+            batch.append(rec)
+            if len(batch) == batch_size:
+                commit_latencies.append(_write_batch(db, backend, batch))
+                written_count += len(batch)
+                batch = []
+        if batch:
+            commit_latencies.append(_write_batch(db, backend, batch))
+            written_count += len(batch)
+    finally:
+        elapsed = time.perf_counter() - start_time
+        db.disconnect()
+    return {
+        'records': written_count,
+        'seconds': round(elapsed, 4),
+        'records_per_sec': round(written_count / elapsed, 1) if elapsed else None,
+        'commit_p50_ms': round(percentile(commit_latencies, 50) * 1000, 3),
+        'commit_p99_ms': round(percentile(commit_latencies, 99) * 1000, 3),
+        'max_rss_kb': max_rss_kb()
+    }
+
+
+def _write_batch(db, backend, batch):
+    start_time = time.perf_counter()
+    if backend == 'orm':
+        db.session.add_all(batch)
+        db.session.commit()
+    else:
+        db.add_multi_obs_bulk(batch)
+    return time.perf_counter() - start_time
+
+
+def run_saver(db_url, sensors, backend, batch_size, record_count, workers):
+    """
+    Feeds record_count observations round-robin to workers MultiProcessDataSaver processes and times
+    until they have all committed and exited.
+    """
+    savers = [MultiProcessDataSaver(database_configuration(db_url), batch_size, bulk_insert=(backend == 'bulk'))
+              for _ in range(workers)]
+    start_time = time.perf_counter()
+    for saver in savers:
+        saver.start()
+    for ndx, rec in enumerate(generate_observations(sensors, START_DATE, record_count)):
+        savers[ndx % workers].data_queue.put(rec)
+    for saver in savers:
+        saver.data_queue.put(None)
+    for saver in savers:
+        saver.join()
+    elapsed = time.perf_counter() - start_time
+    # The savers log and drop records they fail to write, so count what actually landed.
+    written_count = count_observations(db_url)
+    result = {
+        'records': written_count,
+        'seconds': round(elapsed, 4),
+        'records_per_sec': round(written_count / elapsed, 1) if elapsed else None,
+        'commit_p50_ms': None,
+        'commit_p99_ms': None,
+        'max_rss_kb': max(max_rss_kb(), max_rss_kb(resource.RUSAGE_CHILDREN)),
+        'exit_codes': [saver.exitcode for saver in savers]
+    }
+    if written_count != record_count:
+        result['error'] = f"Only {written_count} of {record_count} records were written."
+    return result
+
+
+def _run_configuration(result_queue, suite, db_url, args, backend, batch_size, workers):
+    try:
+        sensors = prepare_database(db_url, args)
+        if suite == 'write_path':
+            result = run_write_path(db_url, sensors, backend, batch_size, args.records)
+        else:
+            result = run_saver(db_url, sensors, backend, batch_size, args.records, workers)
+    except Exception as e:
+        result = {'error': f"{type(e).__name__}: {e}"}
+    result_queue.put(result)
+
+
+def run_configuration(suite, args, backend, batch_size, workers):
+    db_url = args.db_url if args.db_url else temporary_sqlite_url()
+    result_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_configuration,
+                                      args=(result_queue, suite, db_url, args, backend, batch_size, workers))
+    process.start()
+    result = result_queue.get()
+    process.join()
+    if args.db_url:
+        delete_observations(db_url)
+    elif not args.keep_database:
+        os.remove(db_url[len('sqlite:///'):])
+    result.update({'suite': suite, 'dialect': sqlalchemy.engine.make_url(db_url).get_backend_name(),
+                   'backend': backend, 'batch_size': batch_size, 'workers': workers})
+    return result
+
+
+def int_list(value):
+    return [int(part) for part in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Xenia ingest benchmark.")
+    parser.add_argument("--db-url", default=None,
+                        help="SQLAlchemy URL of the benchmark database. Defaults to a temporary SQLite file.")
+    parser.add_argument("--platforms", type=int, default=20)
+    parser.add_argument("--sensors", type=int, default=8, help="Sensors per platform, up to 8.")
+    parser.add_argument("--records", type=int, default=20000, help="Records written per configuration.")
+    parser.add_argument("--batch-sizes", type=int_list, default=[1, 100, 1000])
+    parser.add_argument("--workers", type=int_list, default=[1, 2, 4], help="Saver process counts.")
+    parser.add_argument("--backends", default="orm,bulk")
+    parser.add_argument("--suites", default="write_path,saver")
+    parser.add_argument("--keep-database", action="store_true", help="Keep the temporary SQLite files.")
+    parser.add_argument("--output", default=None, help="Write the JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    results = []
+    for suite in args.suites.split(','):
+        for backend in args.backends.split(','):
+            for batch_size in args.batch_sizes:
+                for workers in (args.workers if suite == 'saver' else [1]):
+                    result = run_configuration(suite, args, backend, batch_size, workers)
+                    summary = result['error'] if 'error' in result else f"{result['records_per_sec']} rec/s"
+                    print(f"{suite:10} {backend:5} batch={batch_size:<6} workers={workers:<3} {summary}",
+                          file=sys.stderr)
+                    results.append(result)
+
+    report = {
+        'benchmark': 'ingest',
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'sqlalchemy': sqlalchemy.__version__,
+        'host': host_platform.node(),
+        'parameters': {'platforms': args.platforms, 'sensors': args.sensors, 'records': args.records},
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 1 if any('error' in result for result in results) else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
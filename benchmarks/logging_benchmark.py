@@ -0,0 +1,142 @@
+"""
+Logging overhead benchmark for the MultiProcessDataSaver hot loop.
+
+Replays the per record logging work of the saver loop, without the database writes, for:
+  legacy  - the original loop body: "%f" formatting of m_value and an f-string debug message for every
+            record, qsize() every 10 records.
+  current - the loop body in MultiProcessDataSaver.run(): a debug message only when DEBUG was enabled at
+            startup, lazily formatted, and a clock check every STATS_CHECK_RECORDS records for the periodic
+            stats line that samples qsize().
+Each variant runs with the saver logger at INFO(the production setting) and at DEBUG with a NullHandler, and
+reports ns/record and the projected share of a core at --target-rate records/sec. A second table compares
+%-formatted and lazily formatted debug calls as used by the xeniaAlchemy methods.
+
+Run from the directory containing the package:
+    python -m ObservationsDatabase.benchmarks.logging_benchmark --records 200000
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from datetime import datetime
+from multiprocessing import Queue
+
+from ..MultiProcDataSaver import STATS_CHECK_RECORDS
+from .synthetic import generate_observations
+
+# (sensor_id, m_type_id, platform_handle, longitude, latitude), no database is needed.
+BENCH_SENSORS = [(sensor_id, 1, f"bench.platform{sensor_id}.buoy", -79.0, 32.0) for sensor_id in range(1, 41)]
+
+
+def legacy_loop(records, logger, data_queue):
+    rec_count = 0
+    for data_rec in records:
+        rec_count += 1
+        val = ""
+        if data_rec.m_value is not None:
+            val = "%f" % (data_rec.m_value)
+        logger.debug(
+            f"Adding record Sensor: {data_rec.sensor_id} Datetime: {data_rec.m_date} Value: {val}")
+        if ((rec_count % 10) == 0):
+            try:
+                logger.debug(f"Approximate record count in DB queue: {data_queue.qsize()}")
+            except NotImplementedError:
+                pass
+    return rec_count
+
+
+def current_loop(records, logger, data_queue, stats_log_interval=60):
+    rec_count = 0
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
+    last_stats_time = time.monotonic()
+    for data_rec in records:
+        rec_count += 1
+        if debug_enabled:
+            logger.debug("Adding record Sensor: %s Datetime: %s Value: %s",
+                         data_rec.sensor_id, data_rec.m_date, data_rec.m_value)
+        if stats_log_interval and (rec_count % STATS_CHECK_RECORDS) == 0:
+            now = time.monotonic()
+            if now - last_stats_time >= stats_log_interval:
+                try:
+                    queue_size = data_queue.qsize()
+                except NotImplementedError:
+                    queue_size = None
+                logger.info("Saved %d records. Approximate records in DB queue: %s", rec_count, queue_size)
+                last_stats_time = now
+    return rec_count
+
+
+def eager_debug(records, logger):
+    for data_rec in records:
+        logger.debug("Adding sensor: %s(%s) sOrder: %d on platform: %d" % (
+            data_rec.platform_handle, data_rec.m_type_id, 1, data_rec.sensor_id))
+
+
+def lazy_debug(records, logger):
+    for data_rec in records:
+        logger.debug("Adding sensor: %s(%s) sOrder: %d on platform: %d",
+                     data_rec.platform_handle, data_rec.m_type_id, 1, data_rec.sensor_id)
+
+
+def time_per_record(function, records, repeat):
+    best = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function(records)
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None or elapsed < best else best
+    return best / len(records) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Xenia saver logging overhead benchmark.")
+    parser.add_argument("--records", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per variant, the fastest is reported.")
+    parser.add_argument("--target-rate", type=int, default=50000, help="Records/sec used for the CPU projection.")
+    parser.add_argument("--output", default=None, help="Write the JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    records = list(generate_observations(BENCH_SENSORS, datetime(2024, 1, 1), args.records))
+    logger = logging.getLogger('xenia_logging_benchmark')
+    logger.propagate = False
+    logger.addHandler(logging.NullHandler())
+    data_queue = Queue()
+
+    results = []
+    for level_name in ('INFO', 'DEBUG'):
+        logger.setLevel(getattr(logging, level_name))
+        variants = (
+            ('saver_loop', 'legacy', lambda recs: legacy_loop(recs, logger, data_queue)),
+            ('saver_loop', 'current', lambda recs: current_loop(recs, logger, data_queue)),
+            ('debug_call', 'percent_format', lambda recs: eager_debug(recs, logger)),
+            ('debug_call', 'lazy_args', lambda recs: lazy_debug(recs, logger)),
+        )
+        for group, variant, function in variants:
+            ns_per_record = time_per_record(function, records, args.repeat)
+            results.append({
+                'group': group,
+                'variant': variant,
+                'level': level_name,
+                'ns_per_record': round(ns_per_record, 1),
+                'cpu_percent_at_target_rate': round(ns_per_record * args.target_rate / 1e7, 2)
+            })
+            print(f"{group:11} {variant:15} {level_name:6} {ns_per_record:10.1f} ns/record "
+                  f"{results[-1]['cpu_percent_at_target_rate']:6.2f}% CPU at {args.target_rate} rec/s", file=sys.stderr)
+
+    report = {
+        'benchmark': 'logging',
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'parameters': {'records': args.records, 'repeat': args.repeat, 'target_rate': args.target_rate},
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
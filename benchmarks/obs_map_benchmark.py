@@ -0,0 +1,156 @@
+"""
+Micro-benchmark for ObsMap: memory per map entry and attribute access time.
+
+Compares the slotted ObsMap against the previous property/__dict__ implementation,
+which is kept here only as a reference point.
+
+Run from the directory containing the package:
+    python -m ObservationsDatabase.benchmarks.obs_map_benchmark --entries 100000
+"""
+import argparse
+import json
+import sys
+import timeit
+import tracemalloc
+
+from ..xenia_obs_map import ObsMap
+
+
+class LegacyObsMap:
+    def __init__(self):
+        self.__target_obs = None
+        self.__target_uom = None
+        self.__source_obs = None
+        self.__source_uom = None
+        self.__source_index = None
+        self.__s_order = 1
+        self.__sensor_id = None
+        self.__m_type_id = None
+
+    @property
+    def target_obs(self):
+        return self.__target_obs
+
+    @target_obs.setter
+    def target_obs(self, target_obs):
+        self.__target_obs = target_obs
+
+    @property
+    def target_uom(self):
+        return self.__target_uom
+
+    @target_uom.setter
+    def target_uom(self, target_uom):
+        self.__target_uom = target_uom
+
+    @property
+    def source_obs(self):
+        return self.__source_obs
+
+    @source_obs.setter
+    def source_obs(self, source_obs):
+        self.__source_obs = source_obs
+
+    @property
+    def source_uom(self):
+        return self.__source_uom
+
+    @source_uom.setter
+    def source_uom(self, source_uom):
+        self.__source_uom = source_uom
+
+    @property
+    def s_order(self):
+        return self.__s_order
+
+    @s_order.setter
+    def s_order(self, s_order):
+        self.__s_order = s_order
+
+    @property
+    def source_index(self):
+        return self.__source_index
+
+    @source_index.setter
+    def source_index(self, source_index):
+        self.__source_index = source_index
+
+    @property
+    def sensor_id(self):
+        return self.__sensor_id
+
+    @sensor_id.setter
+    def sensor_id(self, sensor_id):
+        self.__sensor_id = sensor_id
+
+    @property
+    def m_type_id(self):
+        return self.__m_type_id
+
+    @m_type_id.setter
+    def m_type_id(self, m_type_id):
+        self.__m_type_id = m_type_id
+
+
+def build_entries(obs_map_class, count):
+    entries = []
+    for ndx in range(count):
+        rec = obs_map_class()
+        rec.target_obs = 'water_temperature'
+        rec.target_uom = 'celsius'
+        rec.source_obs = 'WTMP'
+        rec.s_order = 1
+        rec.sensor_id = ndx
+        rec.m_type_id = 5
+        entries.append(rec)
+    return entries
+
+
+def measure_memory(obs_map_class, count):
+    tracemalloc.start()
+    snapshot_start = tracemalloc.take_snapshot()
+    entries = build_entries(obs_map_class, count)
+    snapshot_end = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = snapshot_end.compare_to(snapshot_start, 'filename')
+    total_bytes = sum(stat.size_diff for stat in stats)
+    # Don't charge the list holding the entries to the entries themselves.
+    total_bytes -= sys.getsizeof(entries)
+    return total_bytes / count
+
+
+def measure_access(obs_map_class, iterations):
+    rec = build_entries(obs_map_class, 1)[0]
+    read_time = timeit.timeit(lambda: (rec.sensor_id, rec.m_type_id, rec.target_obs, rec.s_order),
+                              number=iterations)
+    write_time = timeit.timeit(lambda: setattr(rec, 'sensor_id', 10), number=iterations)
+    # Four attribute reads per call.
+    return (read_time / (iterations * 4)) * 1e9, (write_time / iterations) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ObsMap memory and attribute access benchmark.")
+    parser.add_argument("--entries", type=int, default=100000, help="Number of map entries to build.")
+    parser.add_argument("--iterations", type=int, default=1000000, help="Attribute access iterations.")
+    parser.add_argument("--json", action="store_true", help="Emit results as JSON.")
+    args = parser.parse_args()
+
+    results = {}
+    for name, obs_map_class in (('legacy', LegacyObsMap), ('slotted', ObsMap)):
+        read_ns, write_ns = measure_access(obs_map_class, args.iterations)
+        results[name] = {
+            'bytes_per_entry': round(measure_memory(obs_map_class, args.entries), 1),
+            'read_ns': round(read_ns, 1),
+            'write_ns': round(write_ns, 1)
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("%-8s %16s %10s %10s" % ("impl", "bytes/entry", "read ns", "write ns"))
+        for name, result in results.items():
+            print("%-8s %16.1f %10.1f %10.1f" % (name, result['bytes_per_entry'], result['read_ns'], result['write_ns']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+"""
+Query benchmark for metadata lookups and multi_obs time window reads.
+
+Seeds a synthetic database at a configurable scale(platforms x sensors x years) and times:
+  lookups  - sensorExists, mTypeExists and platformExists. "cold" is the first call on a fresh connection
+             (empty SQLAlchemy compiled cache and connection), "warm" is the distribution of repeated calls.
+  reads    - get_multi_obs() one day and seven day windows for a single sensor.
+  rollups  - get_multi_obs_rollup() hourly for one sensor over 30 days, daily for a platform over a year.
+Every group is timed without, then with, the proposed indexes in PROPOSED_INDEXES. The benchmark creates
+and drops those indexes itself; existing indexes are left alone. Pass --db-url more than once, e.g. a
+temporary SQLite file and a local PostgreSQL stand-in, to compare dialects in one report.
+
+Run from the directory containing the package:
+    python -m ObservationsDatabase.benchmarks.query_benchmark --platforms 10 --sensors 4 --years 1
+    python -m ObservationsDatabase.benchmarks.query_benchmark --db-url sqlite:////tmp/q.db \\
+        --db-url postgresql://bench@localhost/xenia_bench --output query.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import sqlalchemy
+from sqlalchemy import create_engine, text
+
+from ..xeniaAlchemy import xeniaAlchemy
+from .synthetic import (
+    BENCH_OBSERVATIONS,
+    count_observations,
+    create_schema,
+    generate_observations,
+    seed_metadata,
+    temporary_sqlite_url,
+)
+
+START_DATE = datetime(2020, 1, 1)
+
+# Indexes proposed for the lookup joins and the time window reads.
+PROPOSED_INDEXES = (
+    ('ix_multi_obs_sensor_id_m_date', 'multi_obs', 'sensor_id, m_date'),
+    ('ix_platform_platform_handle', 'platform', 'platform_handle'),
+    ('ix_sensor_platform_id', 'sensor', 'platform_id, s_order'),
+    ('ix_obs_type_standard_name', 'obs_type', 'standard_name'),
+    ('ix_uom_type_standard_name', 'uom_type', 'standard_name'),
+)
+
+
+def set_proposed_indexes(db_url, create):
+    engine = create_engine(db_url)
+    try:
+        with engine.begin() as connection:
+            for index_name, table_name, columns in PROPOSED_INDEXES:
+                if create:
+                    connection.execute(text(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({columns})"))
+                else:
+                    connection.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+            connection.execute(text("ANALYZE"))
+    finally:
+        engine.dispose()
+
+
+def seed_database(db_url, args):
+    create_schema(db_url)
+    sensors = seed_metadata(db_url, args.platforms, args.sensors)
+    obs_per_sensor = int(args.years * 365 * 24 * 60 / args.interval_minutes)
+    record_count = obs_per_sensor * len(sensors)
+    if count_observations(db_url) >= record_count:
+        return sensors, record_count
+
+    db = xeniaAlchemy()
+    db.connect_db(db_url, False)
+    try:
+        batch = []
+        for rec in generate_observations(sensors, START_DATE, record_count, args.interval_minutes * 60, as_dicts=True):
+            batch.append(rec)
+            if len(batch) == 10000:
+                db.add_multi_obs_bulk(batch)
+                batch = []
+        db.add_multi_obs_bulk(batch)
+    finally:
+        db.disconnect()
+    return sensors, record_count
+
+
+def summarize(timings):
+    ordered = sorted(timings)
+    return {
+        'calls': len(ordered),
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 4),
+        'p99_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 4),
+        'max_ms': round(ordered[-1] * 1000, 4)
+    }
+
+
+def time_calls(call_args, method, iterations):
+    timings = []
+    for ndx in range(iterations):
+        args = call_args[ndx % len(call_args)]
+        start_time = time.perf_counter()
+        method(*args)
+        timings.append(time.perf_counter() - start_time)
+    return timings
+
+
+def benchmark_lookups(db_url, sensors, iterations, random_gen):
+    platform_handles = sorted(set(sensor_info[2] for sensor_info in sensors))
+    sensors_per_platform = len(sensors) // len(platform_handles)
+    obs_uoms = BENCH_OBSERVATIONS[:sensors_per_platform]
+    lookups = {
+        'sensorExists': ('sensorExists',
+                         [(obs, uom, random_gen.choice(platform_handles), 1) for obs, uom in obs_uoms for _ in range(4)]),
+        'mTypeExists': ('mTypeExists', [(obs, uom) for obs, uom in obs_uoms]),
+        'platformExists': ('platformExists', [(platform_handle,) for platform_handle in platform_handles])
+    }
+    results = {}
+    for name, (method_name, call_args) in lookups.items():
+        # Cold: first call on a brand new connection.
+        db = xeniaAlchemy()
+        db.connect_db(db_url, False)
+        try:
+            method = getattr(db, method_name)
+            cold = time_calls(call_args[:1], method, 1)[0]
+            warm = time_calls(call_args, method, iterations)
+        finally:
+            db.disconnect()
+        results[name] = {'cold_ms': round(cold * 1000, 4), 'warm': summarize(warm)}
+    return results
+
+
+def benchmark_reads(db_url, sensors, args, random_gen):
+    end_date = START_DATE + timedelta(days=int(args.years * 365))
+    sensor_ids = [sensor_info[0] for sensor_info in sensors]
+    platform_sensors = {}
+    for sensor_info in sensors:
+        platform_sensors.setdefault(sensor_info[2], []).append(sensor_info[0])
+
+    def window(days):
+        latest_start = max(0, (end_date - START_DATE).days - days)
+        window_start = START_DATE + timedelta(days=random_gen.randint(0, latest_start))
+        return window_start, window_start + timedelta(days=days)
+
+    queries = {
+        'window_1_day': ('get_multi_obs', lambda: ([random_gen.choice(sensor_ids)],) + window(1)),
+        'window_7_day': ('get_multi_obs', lambda: ([random_gen.choice(sensor_ids)],) + window(7)),
+        'rollup_hourly_30_day': ('get_multi_obs_rollup',
+                                 lambda: ([random_gen.choice(sensor_ids)],) + window(30) + ('hour',)),
+        'rollup_daily_platform_year': ('get_multi_obs_rollup',
+                                       lambda: (random_gen.choice(list(platform_sensors.values())),) +
+                                       window(365) + ('day',))
+    }
+    results = {}
+    db = xeniaAlchemy()
+    db.connect_db(db_url, False)
+    try:
+        for name, (method_name, make_args) in queries.items():
+            method = getattr(db, method_name)
+            call_args = [make_args() for _ in range(args.read_iterations)]
+            # Warm up the connection and statement cache so only the query itself is measured.
+            method(*call_args[0])
+            timings = time_calls(call_args, method, args.read_iterations)
+            results[name] = summarize(timings)
+            results[name]['rows_last_call'] = len(method(*call_args[-1]))
+    finally:
+        db.disconnect()
+    return results
+
+
+def run_dialect(db_url, args):
+    random_gen = random.Random(args.seed)
+    seed_start = time.perf_counter()
+    sensors, record_count = seed_database(db_url, args)
+    seed_seconds = time.perf_counter() - seed_start
+
+    results = {}
+    for indexed in (False, True):
+        set_proposed_indexes(db_url, indexed)
+        label = 'with_indexes' if indexed else 'without_indexes'
+        results[label] = {
+            'lookups': benchmark_lookups(db_url, sensors, args.lookup_iterations, random_gen),
+            'reads': benchmark_reads(db_url, sensors, args, random_gen)
+        }
+    if not args.keep_indexes:
+        set_proposed_indexes(db_url, False)
+    return {
+        'dialect': sqlalchemy.engine.make_url(db_url).get_backend_name(),
+        'multi_obs_rows': record_count,
+        'seed_seconds': round(seed_seconds, 2),
+        'results': results
+    }
+
+
+def print_comparison(reports):
+    print("%-28s %-16s %-10s %12s %12s" % ("query", "indexes", "dialect", "p50 ms", "p99 ms"), file=sys.stderr)
+    for report in reports:
+        for label, groups in report['results'].items():
+            for group_name, group in groups.items():
+                for name, result in group.items():
+                    stats = result['warm'] if group_name == 'lookups' else result
+                    print("%-28s %-16s %-10s %12.3f %12.3f" % (name, label, report['dialect'],
+                                                               stats['p50_ms'], stats['p99_ms']), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Xenia metadata lookup and time window read benchmark.")
+    parser.add_argument("--db-url", action="append", default=None,
+                        help="SQLAlchemy URL to benchmark, may be repeated. Defaults to a temporary SQLite file.")
+    parser.add_argument("--platforms", type=int, default=10)
+    parser.add_argument("--sensors", type=int, default=4, help="Sensors per platform, up to 8.")
+    parser.add_argument("--years", type=float, default=1.0, help="Years of observations per sensor.")
+    parser.add_argument("--interval-minutes", type=int, default=60, help="Minutes between observations.")
+    parser.add_argument("--lookup-iterations", type=int, default=500)
+    parser.add_argument("--read-iterations", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep-indexes", action="store_true", help="Leave the proposed indexes in place.")
+    parser.add_argument("--output", default=None, help="Write the JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    temporary_database = None
+    db_urls = args.db_url
+    if not db_urls:
+        temporary_database = temporary_sqlite_url(prefix='xenia_query_bench_')
+        db_urls = [temporary_database]
+
+    try:
+        reports = [run_dialect(db_url, args) for db_url in db_urls]
+    finally:
+        if temporary_database is not None and os.path.exists(temporary_database[len('sqlite:///'):]):
+            os.remove(temporary_database[len('sqlite:///'):])
+
+    print_comparison(reports)
+    output = {
+        'benchmark': 'query',
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'sqlalchemy': sqlalchemy.__version__,
+        'parameters': {'platforms': args.platforms, 'sensors': args.sensors, 'years': args.years,
+                       'interval_minutes': args.interval_minutes},
+        'dialects': reports
+    }
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(output, output_file, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+
+
+if __name__ == '__main__':
+    main()
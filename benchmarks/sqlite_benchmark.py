@@ -0,0 +1,200 @@
+"""
+SQLite profile benchmark for edge collectors.
+
+Compares SQLite opened with its defaults(rollback journal, synchronous FULL) against the xenia_sqlite tuning
+profile(WAL, synchronous NORMAL, busy_timeout, larger cache, mmap) on a fresh database file per profile:
+  ingest     - single process add_multi_obs_bulk() throughput and p50/p99 commit latency.
+  concurrent - one writer process committing --batch-size records at a time, as MultiProcessDataSaver does,
+               while --readers processes run one day get_multi_obs() reads, for --seconds. Reports reads/sec,
+               writer commits/sec, p99 commit latency and the number of reads and writes that failed with
+               "database is locked".
+
+Run from the directory containing the package:
+    python -m ObservationsDatabase.benchmarks.sqlite_benchmark --records 50000 --readers 4 --seconds 10
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import exc
+
+from ..xenia_sqlite import DEFAULT_SQLITE_PRAGMAS
+from ..xeniaAlchemy import xeniaAlchemy
+from .synthetic import (
+    create_schema,
+    generate_observations,
+    seed_metadata,
+    temporary_sqlite_url,
+)
+
+START_DATE = datetime(2024, 1, 1)
+
+# Profile name -> sqlite_pragmas for connect_db, {} leaves SQLite at its defaults.
+PROFILES = {
+    'default': {},
+    'tuned': DEFAULT_SQLITE_PRAGMAS,
+}
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round((percent / 100.0) * (len(ordered) - 1))))]
+
+
+def connect(db_url, pragmas):
+    db = xeniaAlchemy()
+    if not db.connect_db(db_url, False, sqlite_pragmas=pragmas):
+        raise RuntimeError(f"Unable to connect to: {db_url}")
+    return db
+
+
+def run_ingest(db_url, pragmas, sensors, record_count, batch_size):
+    db = connect(db_url, pragmas)
+    commit_latencies = []
+    batch = []
+    start_time = time.perf_counter()
+    try:
+        for rec in generate_observations(sensors, START_DATE, record_count, as_dicts=True):
+            batch.append(rec)
+            if len(batch) == batch_size:
+                batch_start = time.perf_counter()
+                db.add_multi_obs_bulk(batch)
+                commit_latencies.append(time.perf_counter() - batch_start)
+                batch = []
+        if batch:
+            db.add_multi_obs_bulk(batch)
+    finally:
+        elapsed = time.perf_counter() - start_time
+        db.disconnect()
+    return {
+        'records': record_count,
+        'records_per_sec': round(record_count / elapsed, 1),
+        'commit_p50_ms': round(percentile(commit_latencies, 50) * 1000, 3),
+        'commit_p99_ms': round(percentile(commit_latencies, 99) * 1000, 3)
+    }
+
+
+def _writer(result_queue, stop_event, db_url, pragmas, sensors, batch_size, first_date):
+    db = connect(db_url, pragmas)
+    commit_latencies = []
+    locked_count = 0
+    records = generate_observations(sensors, first_date, 10 ** 9, as_dicts=True, seed=2)
+    try:
+        while not stop_event.is_set():
+            batch = [next(records) for _ in range(batch_size)]
+            batch_start = time.perf_counter()
+            try:
+                db.add_multi_obs_bulk(batch)
+                commit_latencies.append(time.perf_counter() - batch_start)
+            except exc.OperationalError:
+                db.session.rollback()
+                locked_count += 1
+    finally:
+        db.disconnect()
+    result_queue.put(('writer', len(commit_latencies), locked_count, commit_latencies))
+
+
+def _reader(result_queue, stop_event, db_url, pragmas, sensors, ndx):
+    db = connect(db_url, pragmas)
+    read_count = 0
+    failed_count = 0
+    try:
+        while not stop_event.is_set():
+            sensor_id = sensors[(ndx + read_count) % len(sensors)][0]
+            window_start = START_DATE + timedelta(days=read_count % 7)
+            if db.get_multi_obs([sensor_id], window_start, window_start + timedelta(days=1)) is None:
+                failed_count += 1
+            else:
+                read_count += 1
+    finally:
+        db.disconnect()
+    result_queue.put(('reader', read_count, failed_count, None))
+
+
+def run_concurrent(db_url, pragmas, sensors, readers, batch_size, seconds, first_date):
+    result_queue = multiprocessing.Queue()
+    stop_event = multiprocessing.Event()
+    processes = [multiprocessing.Process(target=_writer, args=(result_queue, stop_event, db_url, pragmas, sensors,
+                                                               batch_size, first_date))]
+    processes.extend(multiprocessing.Process(target=_reader, args=(result_queue, stop_event, db_url, pragmas,
+                                                                   sensors, ndx))
+                     for ndx in range(readers))
+    for process in processes:
+        process.start()
+    time.sleep(seconds)
+    stop_event.set()
+    results = [result_queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    writer_result = next(result for result in results if result[0] == 'writer')
+    reader_results = [result for result in results if result[0] == 'reader']
+    return {
+        'readers': readers,
+        'reads_per_sec': round(sum(result[1] for result in reader_results) / seconds, 1),
+        'failed_reads': sum(result[2] for result in reader_results),
+        'commits_per_sec': round(writer_result[1] / seconds, 1),
+        'failed_commits': writer_result[2],
+        'commit_p99_ms': round(percentile(writer_result[3], 99) * 1000, 3) if writer_result[3] else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Xenia SQLite profile benchmark.")
+    parser.add_argument("--platforms", type=int, default=10)
+    parser.add_argument("--sensors", type=int, default=8, help="Sensors per platform, up to 8.")
+    parser.add_argument("--records", type=int, default=50000, help="Records written by the ingest test.")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10.0, help="Duration of the concurrent test.")
+    parser.add_argument("--profiles", default=','.join(PROFILES))
+    parser.add_argument("--keep-database", action="store_true", help="Keep the temporary SQLite files.")
+    parser.add_argument("--output", default=None, help="Write the JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    results = []
+    for profile in args.profiles.split(','):
+        db_url = temporary_sqlite_url(prefix=f'xenia_sqlite_bench_{profile}_')
+        try:
+            create_schema(db_url)
+            sensors = seed_metadata(db_url, args.platforms, args.sensors)
+            pragmas = PROFILES[profile]
+            ingest = run_ingest(db_url, pragmas, sensors, args.records, args.batch_size)
+            # The concurrent writer continues after the ingested records so it never hits a duplicate.
+            first_date = START_DATE + timedelta(seconds=600 * (args.records // len(sensors) + 1))
+            concurrent = run_concurrent(db_url, pragmas, sensors, args.readers, args.batch_size, args.seconds,
+                                        first_date)
+        finally:
+            if not args.keep_database:
+                for suffix in ('', '-wal', '-shm', '-journal'):
+                    if os.path.exists(db_url[len('sqlite:///'):] + suffix):
+                        os.remove(db_url[len('sqlite:///'):] + suffix)
+        print(f"{profile:8} ingest {ingest['records_per_sec']:>10} rec/s  concurrent reads "
+              f"{concurrent['reads_per_sec']:>8}/s (failed {concurrent['failed_reads']}) commits "
+              f"{concurrent['commits_per_sec']:>7}/s (failed {concurrent['failed_commits']}) "
+              f"p99 {concurrent['commit_p99_ms']} ms", file=sys.stderr)
+        results.append({'profile': profile, 'pragmas': pragmas, 'ingest': ingest, 'concurrent': concurrent})
+
+    report = {
+        'benchmark': 'sqlite',
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'parameters': {'platforms': args.platforms, 'sensors': args.sensors, 'records': args.records,
+                       'batch_size': args.batch_size, 'readers': args.readers, 'seconds': args.seconds},
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+Synthetic Xenia databases for the benchmark suites: schema creation, platform/sensor provisioning and
+multi_obs streams. Everything created here uses the 'bench' organization so it can be told apart, and
+cleaned up, on a shared database.
+"""
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+from geoalchemy2 import Geometry
+from sqlalchemy import MetaData, Text, create_engine, delete, func, insert, select, text
+
+from ..database_settings import DatabaseConfiguration
+from ..XeniaTables import (
+    Base,
+    m_scalar_type,
+    m_type,
+    multi_obs,
+    obs_type,
+    organization,
+    platform,
+    sensor,
+    uom_type,
+)
+
+BENCH_ORGANIZATION = 'bench'
+
+# A realistic mix of observations for a met/ocean platform.
+BENCH_OBSERVATIONS = (
+    ('air_temperature', 'celsius'),
+    ('water_temperature', 'celsius'),
+    ('wind_speed', 'm_s-1'),
+    ('wind_from_direction', 'degrees_true'),
+    ('air_pressure', 'mb'),
+    ('relative_humidity', 'percent'),
+    ('salinity', 'psu'),
+    ('significant_wave_height', 'm'),
+)
+
+
+def temporary_sqlite_url(prefix='xenia_bench_'):
+    file_descriptor, file_path = tempfile.mkstemp(prefix=prefix, suffix='.db')
+    os.close(file_descriptor)
+    os.remove(file_path)
+    return f"sqlite:///{file_path}"
+
+
+def database_configuration(db_url, **kwargs):
+    """
+    DatabaseConfiguration for a SQLAlchemy URL, used to hand the benchmark database to MultiProcessDataSaver.
+    kwargs are passed through for SQLite, e.g. sqlite_pragmas.
+    """
+    if db_url.startswith('sqlite:///'):
+        return DatabaseConfiguration('sqlite', file_path=db_url[len('sqlite:///'):], **kwargs)
+    return DatabaseConfiguration('postgres', connectionstring=db_url)
+
+
+def create_schema(db_url):
+    """
+    Creates the Xenia tables if they don't exist. On SQLite without SpatiaLite the the_geom columns are
+    created as TEXT, which the bulk write path fills with EWKT.
+    """
+    engine = create_engine(db_url)
+    try:
+        schema_metadata = Base.metadata
+        if engine.dialect.name == 'sqlite':
+            with engine.connect() as connection:
+                try:
+                    connection.execute(text("SELECT spatialite_version()"))
+                    spatialite = True
+                except Exception:
+                    spatialite = False
+            if not spatialite:
+                schema_metadata = MetaData()
+                for table in Base.metadata.sorted_tables:
+                    table_copy = table.to_metadata(schema_metadata)
+                    for column in table_copy.columns:
+                        if isinstance(column.type, Geometry):
+                            column.type = Text()
+        schema_metadata.create_all(engine)
+    finally:
+        engine.dispose()
+
+
+def _next_row_id(connection, table):
+    max_row_id = connection.execute(select(table.c.row_id).order_by(table.c.row_id.desc()).limit(1)).scalar()
+    return (max_row_id or 0) + 1
+
+
+def seed_metadata(db_url, platform_count, sensors_per_platform, seed=1):
+    """
+    Provisions platform_count platforms with sensors_per_platform sensors each, plus the obs_type, uom_type,
+    m_scalar_type and m_type rows they need. Returns a list of (sensor_id, m_type_id, platform_handle,
+    longitude, latitude) tuples.
+    """
+    random_gen = random.Random(seed)
+    engine = create_engine(db_url)
+    sensors = []
+    try:
+        with engine.begin() as connection:
+            m_type_ids = []
+            for obs_name, uom_name in BENCH_OBSERVATIONS[:sensors_per_platform]:
+                obs_id = connection.execute(select(obs_type.row_id).where(obs_type.standard_name == obs_name)).scalar()
+                if obs_id is None:
+                    obs_id = _next_row_id(connection, obs_type.__table__)
+                    connection.execute(insert(obs_type.__table__).values(row_id=obs_id, standard_name=obs_name))
+                uom_id = connection.execute(select(uom_type.row_id).where(uom_type.standard_name == uom_name)).scalar()
+                if uom_id is None:
+                    uom_id = _next_row_id(connection, uom_type.__table__)
+                    connection.execute(insert(uom_type.__table__).values(row_id=uom_id, standard_name=uom_name))
+                scalar_id = connection.execute(select(m_scalar_type.row_id)
+                                               .where(m_scalar_type.obs_type_id == obs_id)
+                                               .where(m_scalar_type.uom_type_id == uom_id)).scalar()
+                if scalar_id is None:
+                    scalar_id = _next_row_id(connection, m_scalar_type.__table__)
+                    connection.execute(insert(m_scalar_type.__table__).values(row_id=scalar_id, obs_type_id=obs_id,
+                                                                             uom_type_id=uom_id))
+                m_type_id = connection.execute(select(m_type.row_id).where(m_type.m_scalar_type_id == scalar_id)).scalar()
+                if m_type_id is None:
+                    m_type_id = _next_row_id(connection, m_type.__table__)
+                    connection.execute(insert(m_type.__table__).values(row_id=m_type_id, num_types=1,
+                                                                      m_scalar_type_id=scalar_id))
+                m_type_ids.append(m_type_id)
+
+            org_id = connection.execute(select(organization.row_id)
+                                        .where(organization.short_name == BENCH_ORGANIZATION)).scalar()
+            if org_id is None:
+                org_id = connection.execute(insert(organization.__table__)
+                                            .values(short_name=BENCH_ORGANIZATION, active=1,
+                                                    row_entry_date=datetime.now())).inserted_primary_key[0]
+
+            for platform_ndx in range(platform_count):
+                platform_handle = f"{BENCH_ORGANIZATION}.platform{platform_ndx}.buoy"
+                longitude = round(random_gen.uniform(-82.0, -75.0), 4)
+                latitude = round(random_gen.uniform(28.0, 36.0), 4)
+                platform_id = connection.execute(select(platform.row_id)
+                                                 .where(platform.platform_handle == platform_handle)).scalar()
+                if platform_id is None:
+                    platform_id = connection.execute(insert(platform.__table__).values(
+                        row_entry_date=datetime.now(), organization_id=org_id, short_name=f"platform{platform_ndx}",
+                        platform_handle=platform_handle, fixed_longitude=longitude, fixed_latitude=latitude,
+                        active=1)).inserted_primary_key[0]
+                else:
+                    longitude, latitude = connection.execute(
+                        select(platform.fixed_longitude, platform.fixed_latitude)
+                        .where(platform.row_id == platform_id)).one()
+                for m_type_id in m_type_ids:
+                    sensor_id = connection.execute(select(sensor.row_id)
+                                                   .where(sensor.platform_id == platform_id)
+                                                   .where(sensor.m_type_id == m_type_id)).scalar()
+                    if sensor_id is None:
+                        sensor_id = connection.execute(insert(sensor.__table__).values(
+                            row_entry_date=datetime.now(), platform_id=platform_id, m_type_id=m_type_id,
+                            active=1, s_order=1, fixed_z=0, report_interval=600)).inserted_primary_key[0]
+                    sensors.append((sensor_id, m_type_id, platform_handle, longitude, latitude))
+    finally:
+        engine.dispose()
+    return sensors
+
+
+def generate_observations(sensors, start_date, count, interval_seconds=600, as_dicts=False, seed=1):
+    """
+    Yields count observations spread round-robin over the sensors, advancing m_date by interval_seconds each
+    time every sensor has reported. Yields multi_obs objects, or dictionaries if as_dicts is True.
+    """
+    random_gen = random.Random(seed)
+    sensor_count = len(sensors)
+    for ndx in range(count):
+        sensor_id, m_type_id, platform_handle, longitude, latitude = sensors[ndx % sensor_count]
+        values = dict(row_entry_date=datetime.now(),
+                      platform_handle=platform_handle,
+                      sensor_id=sensor_id,
+                      m_type_id=m_type_id,
+                      m_date=start_date + timedelta(seconds=interval_seconds * (ndx // sensor_count)),
+                      m_lon=longitude,
+                      m_lat=latitude,
+                      m_z=0,
+                      m_value=round(random_gen.gauss(20.0, 5.0), 3))
+        yield values if as_dicts else multi_obs(**values)
+
+
+def delete_observations(db_url):
+    """
+    Removes the multi_obs rows written for the bench organization's platforms.
+    """
+    engine = create_engine(db_url)
+    try:
+        with engine.begin() as connection:
+            connection.execute(delete(multi_obs.__table__)
+                               .where(multi_obs.platform_handle.like(f"{BENCH_ORGANIZATION}.%")))
+    finally:
+        engine.dispose()
+
+
+def count_observations(db_url):
+    """
+    Returns the number of multi_obs rows for the bench organization's platforms.
+    """
+    engine = create_engine(db_url)
+    try:
+        with engine.connect() as connection:
+            return connection.execute(select(func.count(multi_obs.row_id))
+                                      .where(multi_obs.platform_handle.like(f"{BENCH_ORGANIZATION}.%"))).scalar()
+    finally:
+        engine.dispose()
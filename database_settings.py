@@ -1,5 +1,7 @@
 from configparser import SafeConfigParser
 
+from .xenia_sqlite import sqlite_pragmas_from_config
+
 
 class DatabaseConfiguration:
     def __init__(self, db_type, **kwargs):
@@ -11,9 +13,16 @@ class DatabaseConfiguration:
         self.port = None
         self.database_name =None
         self.connectionstring = None
+        # Connection strings of read-only replicas xeniaAlchemy can route reads to.
+        self.read_replicas = []
+        # SQLite connection pragmas(None for xenia_sqlite.DEFAULT_SQLITE_PRAGMAS) and the SpatiaLite library to
+        # load, True for the default library.
+        self.sqlite_pragmas = None
+        self.spatialite = None
 
         if 'ini_file' not in kwargs:
             self.db_type = db_type.lower()
+            self.read_replicas = list(kwargs.get("read_replicas", []))
             if self.db_type == "postgres":
                 if 'ini_file' not in kwargs:
                     self.username = kwargs.get("username")
@@ -25,6 +34,8 @@ class DatabaseConfiguration:
             elif self.db_type == "sqlite":
                 if 'ini_file' not in kwargs:
                     self.file_path = kwargs.get("file_path")
+                    self.sqlite_pragmas = kwargs.get("sqlite_pragmas", None)
+                    self.spatialite = kwargs.get("spatialite", None)
             else:
                 raise ValueError("Unsupported database type. Use 'postgres' or 'sqlite'.")
 
@@ -32,6 +43,9 @@ class DatabaseConfiguration:
             config_file = SafeConfigParser()
             config_file.read(kwargs['ini_file'])
             self.db_type = config_file.get('Database', 'db_type')
+            # One connection string per line.
+            read_replicas = config_file.get("Database", "read_replicas", fallback="")
+            self.read_replicas = [replica.strip() for replica in read_replicas.splitlines() if replica.strip()]
             if self.db_type == "postgres":
                 self.username = config_file.get("Database", "user")
                 self.password = config_file.get("Database","password")
@@ -42,13 +56,18 @@ class DatabaseConfiguration:
 
             elif self.db_type == "sqlite":
                 self.file_path = config_file.get("Database", "file_path")
+                self.sqlite_pragmas, self.spatialite = sqlite_pragmas_from_config(config_file)
 
             else:
                 raise ValueError("Unsupported database type. Use 'postgres' or 'sqlite'.")
 
     def get_connection_string(self):
         if self.db_type == "postgres":
-            return f"postgresql://{self.username}:{self.password}@{self.host}:{self.port}/{self.database}"
+            if self.connectionstring:
+                return self.connectionstring
+            return f"postgresql://{self.username}:{self.password}@{self.host}:{self.port}/{self.database_name}"
         elif self.db_type == "sqlite":
             return f"sqlite:///{self.file_path}"
 
+    def get_read_replica_connection_strings(self):
+        return list(self.read_replicas)
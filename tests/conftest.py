@@ -0,0 +1,81 @@
+import os
+import sqlite3
+
+import pytest
+from sqlalchemy import text
+
+from ..benchmarks.synthetic import create_schema, seed_metadata, temporary_sqlite_url
+from ..xeniaAlchemy import xeniaAlchemy
+
+
+@pytest.fixture
+def db_url():
+    """
+    A temporary SQLite Xenia database, the_geom columns are TEXT when SpatiaLite isn't available.
+    """
+    url = temporary_sqlite_url(prefix='xenia_test_')
+    create_schema(url)
+    yield url
+    if os.path.exists(url[len('sqlite:///'):]):
+        os.remove(url[len('sqlite:///'):])
+
+
+@pytest.fixture
+def sensors(db_url):
+    """
+    Two platforms with three sensors each, a list of (sensor_id, m_type_id, platform_handle, lon, lat).
+    """
+    return seed_metadata(db_url, 2, 3)
+
+
+@pytest.fixture
+def db(db_url):
+    xenia_db = xeniaAlchemy()
+    assert xenia_db.connect_db(db_url, False)
+    yield xenia_db
+    xenia_db.disconnect()
+
+
+@pytest.fixture
+def unique_observations(db):
+    """
+    The production schema rejects a sensor_id, m_date and m_type_id stored twice, the test schema needs the
+    index added.
+    """
+    with db.dbEngine.begin() as connection:
+        connection.execute(text("CREATE UNIQUE INDEX ux_multi_obs ON multi_obs (sensor_id, m_date, m_type_id)"))
+
+
+class FailingCopyCursor:
+    def copy_expert(self, statement, buffer):
+        raise sqlite3.IntegrityError("duplicate key value violates unique constraint")
+
+    def close(self):
+        pass
+
+
+class FailingCopyConnection:
+    # A driver connection whose cursors fail COPY, like psycopg2 on a duplicate key.
+    def __init__(self, dbapi_connection):
+        self._dbapi_connection = dbapi_connection
+
+    def cursor(self):
+        return FailingCopyCursor()
+
+    def __getattr__(self, name):
+        return getattr(self._dbapi_connection, name)
+
+
+@pytest.fixture
+def failing_copy(monkeypatch):
+    """
+    Returns a function making a connected xeniaAlchemy stand in for PostgreSQL with every COPY failing with a
+    driver error.
+    """
+    def fail_copy(xenia_db):
+        monkeypatch.setattr(xenia_db.dbEngine.dialect, 'name', 'postgresql')
+        connection_class = type(xenia_db.session.connection())
+        connection_property = connection_class.connection
+        monkeypatch.setattr(connection_class, 'connection',
+                            property(lambda self: FailingCopyConnection(connection_property.__get__(self))))
+    return fail_copy
@@ -0,0 +1,80 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import exc, select, text
+
+from ..benchmarks.synthetic import database_configuration, generate_observations
+from ..MultiProcDataSaver import MultiProcessDataSaver
+from ..XeniaTables import multi_obs
+
+START_DATE = datetime(2024, 1, 1)
+
+
+
+def stored_rows(db):
+    with db.dbEngine.connect() as connection:
+        return connection.execute(select(multi_obs.sensor_id, multi_obs.m_date, multi_obs.m_value)
+                                  .order_by(multi_obs.sensor_id, multi_obs.m_date)).all()
+
+
+def stored_points(db):
+    # Read as text, the_geom is a TEXT column holding EWKT without SpatiaLite.
+    with db.dbEngine.connect() as connection:
+        return connection.execute(text("SELECT sensor_id, the_geom FROM multi_obs")).all()
+
+
+def test_add_multi_obs_bulk_objects_and_dicts(db, sensors):
+    records = list(generate_observations(sensors, START_DATE, 12))
+    dict_records = list(generate_observations(sensors, datetime(2024, 2, 1), 12, as_dicts=True))
+    assert db.add_multi_obs_bulk(records) == 12
+    assert db.add_multi_obs_bulk(dict_records) == 12
+    assert db.add_multi_obs_bulk([]) == 0
+
+    assert len(stored_rows(db)) == 24
+    locations = {sensor_id: (longitude, latitude) for sensor_id, _, _, longitude, latitude in sensors}
+    points = stored_points(db)
+    assert len(points) == 24
+    for sensor_id, the_geom in points:
+        # the_geom is computed in the INSERT from m_lon/m_lat.
+        srid, point = the_geom.split(';')
+        assert srid == 'SRID=4326'
+        longitude, latitude = point[len('POINT('):-1].split(' ')
+        assert (float(longitude), float(latitude)) == pytest.approx(locations[sensor_id])
+
+
+def test_add_multi_obs_bulk_duplicate_rolls_back_batch(db, sensors, unique_observations):
+    records = list(generate_observations(sensors, START_DATE, 6, as_dicts=True))
+    db.add_multi_obs_bulk(records[:1])
+    with pytest.raises(exc.IntegrityError):
+        db.add_multi_obs_bulk(records)
+    assert len(stored_rows(db)) == 1
+
+
+def test_saver_write_bulk_saves_the_rest_of_a_batch_with_a_duplicate(db_url, db, sensors,
+                                                                    unique_observations):
+    saver = MultiProcessDataSaver(database_configuration(db_url), 10, bulk_insert=True)
+    records = list(generate_observations(sensors, START_DATE, 6))
+    saver._write_bulk(db, records[2:3])
+
+    written_records = saver._write_bulk(db, records)
+    assert written_records == [(rec.sensor_id, rec.m_date) for ndx, rec in enumerate(records) if ndx != 2]
+    assert [(row.sensor_id, row.m_date) for row in stored_rows(db)] == \
+        sorted((rec.sensor_id, rec.m_date) for rec in records)
+
+
+def test_saver_write_bulk_keeps_going_after_a_record_error(db_url, db, sensors, unique_observations,
+                                                           monkeypatch):
+    saver = MultiProcessDataSaver(database_configuration(db_url), 10, bulk_insert=True)
+    records = list(generate_observations(sensors, START_DATE, 6))
+    saver._write_bulk(db, records[2:3])
+    add_multi_obs_bulk = db.add_multi_obs_bulk
+
+    def failing_add(batch, commit=True):
+        if batch == [records[4]]:
+            raise exc.DataError("INSERT", {}, Exception("value out of range"))
+        return add_multi_obs_bulk(batch, commit)
+
+    monkeypatch.setattr(db, 'add_multi_obs_bulk', failing_add)
+    written_records = saver._write_bulk(db, records)
+    assert written_records == [(rec.sensor_id, rec.m_date) for ndx, rec in enumerate(records) if ndx not in (2, 4)]
+    assert len(stored_rows(db)) == 5
@@ -0,0 +1,26 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+from ..XeniaTables import multi_obs, platform
+
+
+def stored_geometry(db, table_name):
+    # Read as text, the_geom is a TEXT column holding EWKT without SpatiaLite. Loading it through the ORM
+    # needs SpatiaLite's AsEWKB.
+    with db.dbEngine.connect() as connection:
+        return connection.execute(text("SELECT the_geom FROM %s WHERE row_id = (SELECT max(row_id) FROM %s)" % (
+            table_name, table_name))).scalar()
+
+
+def test_orm_inserts_set_the_geom(db, sensors):
+    sensor_id, m_type_id, platform_handle, _, _ = sensors[0]
+    db.session.add(platform(row_entry_date=datetime.now(), organization_id=db.organizationExists('bench'),
+                            short_name='located', platform_handle='bench.located.met', fixed_longitude=-79.5,
+                            fixed_latitude=32.25, active=1))
+    db.session.add(multi_obs(row_entry_date=datetime.now(), platform_handle=platform_handle, sensor_id=sensor_id,
+                             m_type_id=m_type_id, m_date=datetime(2024, 1, 1), m_lon=-80.0, m_lat=33.5, m_value=1.0))
+    db.session.commit()
+
+    assert stored_geometry(db, 'platform') == 'SRID=4326;POINT(-79.5 32.25)'
+    assert stored_geometry(db, 'multi_obs') == 'SRID=4326;POINT(-80.0 33.5)'
@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+from ..XeniaTables import multi_obs
+
+START_DATE = datetime(2024, 1, 1)
+
+
+def test_import_copy_error_rolls_back(db, sensors, failing_copy, monkeypatch):
+    pa = pytest.importorskip('pyarrow')
+    from ..xenia_import import MultiObsImporter
+
+    catalog = {rec[0]: rec for rec in db.get_sensor_catalog()}
+    _, platform_handle, obs_name, uom, s_order, _, _ = catalog[sensors[0][0]]
+    batch = pa.RecordBatch.from_pydict({
+        'platform_handle': [platform_handle] * 3, 'obs_name': [obs_name] * 3, 'uom': [uom] * 3,
+        's_order': [s_order] * 3, 'm_date': [START_DATE + timedelta(hours=ndx) for ndx in range(3)],
+        'm_value': [1.0, 2.0, 3.0]})
+    failing_copy(db)
+
+    assert MultiObsImporter(db).import_batches([batch]) is None
+    monkeypatch.undo()
+    assert not db.session.in_transaction()
+    with db.dbEngine.connect() as db_connection:
+        assert db_connection.execute(select(func.count()).select_from(multi_obs)).scalar() == 0
@@ -0,0 +1,22 @@
+import pytest
+from sqlalchemy import create_engine, exc, text
+
+from ..xenia_metrics import NO_METHOD, XeniaMetrics
+
+
+def test_failed_statements_are_timed_and_leave_no_start_time(db_url):
+    metrics = XeniaMetrics()
+    engine = create_engine(db_url)
+    metrics.instrument_engine(engine)
+    try:
+        with engine.connect() as connection:
+            for _ in range(3):
+                with pytest.raises(exc.OperationalError):
+                    connection.execute(text("SELECT * FROM no_such_table"))
+                connection.rollback()
+            connection.execute(text("SELECT 1"))
+            assert connection.info['xenia_query_start'] == []
+    finally:
+        metrics.remove_engine(engine)
+        engine.dispose()
+    assert metrics.snapshot()['methods'][NO_METHOD]['queries'] == 4
@@ -0,0 +1,51 @@
+import io
+import json
+
+import pytest
+
+from ..xenia_obs_map import PlatformObsMap, iter_json_array
+
+DOCUMENT = '[1.5e10, -2.25E-3 , {"a": [1, 2.0e1], "b": "x,]"}, true, null, 12345678901, [] ]'
+
+
+@pytest.mark.parametrize('chunk_size', range(1, 12))
+def test_iter_json_array_chunk_boundaries(chunk_size):
+    # Every element straddles a chunk boundary for some chunk_size, numbers included.
+    assert list(iter_json_array(io.StringIO(DOCUMENT), chunk_size=chunk_size)) == json.loads(DOCUMENT)
+
+
+def test_iter_json_array_exponent_split():
+    # "1.5e" decodes as 1.5 on its own, the element must wait for the rest of the exponent.
+    assert list(iter_json_array(io.StringIO('[1.5e10,2]'), chunk_size=5)) == [1.5e10, 2]
+
+
+def test_iter_json_array_top_level_number_at_eof():
+    assert list(iter_json_array(io.StringIO('[7]'), chunk_size=2)) == [7]
+
+
+def test_iter_json_array_empty():
+    assert list(iter_json_array(io.StringIO(' [ ] '), chunk_size=1)) == []
+
+
+@pytest.mark.parametrize('document', ['[1, 2', '{"a": 1}', '[1, {"a": '])
+def test_iter_json_array_malformed(document):
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO(document), chunk_size=3))
+
+
+def test_platform_obs_map_load_json_mapping(tmp_path):
+    entries = [dict(platform_handle=f"org.platform{ndx % 3}.buoy", target_obs=f"obs{ndx}", target_uom='m',
+                    header_column=f"column{ndx}", source_uom='m', s_order=1)
+               for ndx in range(30)]
+    file_name = tmp_path / 'mappings.json'
+    file_name.write_text(json.dumps(entries, indent=1))
+
+    platform_obs_map = PlatformObsMap()
+    assert platform_obs_map.load_json_mapping(str(file_name), platform_handles=['org.platform1.buoy']) == 10
+    assert list(platform_obs_map) == ['org.platform1.buoy']
+    assert [obs_rec.source_obs for obs_rec in platform_obs_map['org.platform1.buoy']] == \
+        [f"column{ndx}" for ndx in range(1, 30, 3)]
+
+    platform_obs_map = PlatformObsMap()
+    assert platform_obs_map.load_json_mapping(str(file_name)) == 30
+    assert len(platform_obs_map) == 3
@@ -0,0 +1,85 @@
+import json
+import os
+
+import pytest
+
+from ..benchmarks.synthetic import BENCH_OBSERVATIONS, seed_metadata
+from ..xenia_metrics import XeniaMetrics
+from ..xenia_obs_map import PlatformObsMap
+from ..xenia_obs_map_cache import ObsMapCache, mapping_files_signature
+
+
+@pytest.fixture
+def mapping_files(tmp_path, sensors):
+    """
+    A JSON mapping file per seeded platform, mapping the platform's sensors plus the m_date column.
+    """
+    mapping_files = {}
+    for platform_handle in sorted({platform_handle for _, _, platform_handle, _, _ in sensors}):
+        entries = [dict(target_obs='m_date', target_uom=None, header_column='time', source_uom=None, s_order=1)]
+        entries.extend(dict(target_obs=obs_name, target_uom=uom, header_column=obs_name.upper(), source_uom=uom,
+                            s_order=1)
+                       for obs_name, uom in BENCH_OBSERVATIONS[:3])
+        file_name = tmp_path / f"{platform_handle}.json"
+        file_name.write_text(json.dumps(entries))
+        mapping_files[platform_handle] = str(file_name)
+    return mapping_files
+
+
+def load(mapping_files, db_url, cache_file, **kwargs):
+    metrics = XeniaMetrics()
+    platform_obs_map = PlatformObsMap()
+    assert platform_obs_map.load_mappings(mapping_files, db_connectionstring=db_url, cache_file=cache_file,
+                                          metrics=metrics, **kwargs)
+    resolved = {platform_handle: sorted((obs_rec.source_obs, obs_rec.sensor_id, obs_rec.m_type_id)
+                                        for obs_rec in obs_map if obs_rec.target_obs != 'm_date')
+                for platform_handle, obs_map in platform_obs_map.items()}
+    cache_counts = metrics.snapshot()['caches'].get('obs_map', {'hits': 0, 'misses': 0})
+    return resolved, cache_counts['hits'], cache_counts['misses']
+
+
+def test_cache_reused_until_sensors_change(tmp_path, db_url, sensors, mapping_files):
+    cache_file = str(tmp_path / 'obs_map_cache.db')
+    resolved, hits, misses = load(mapping_files, db_url, cache_file)
+    assert (hits, misses) == (0, 1)
+    # seed_metadata() gives every platform a sensor per BENCH_OBSERVATIONS entry, in order.
+    expected = {}
+    for sensor_id, m_type_id, platform_handle, _, _ in sensors:
+        platform_sensors = expected.setdefault(platform_handle, [])
+        platform_sensors.append((BENCH_OBSERVATIONS[len(platform_sensors)][0].upper(), sensor_id, m_type_id))
+    assert resolved == {platform_handle: sorted(platform_sensors)
+                        for platform_handle, platform_sensors in expected.items()}
+
+    assert load(mapping_files, db_url, cache_file) == (resolved, 1, 0)
+
+    # A sensor added to the database changes the fingerprint, the maps are resolved again.
+    seed_metadata(db_url, 2, 4)
+    assert load(mapping_files, db_url, cache_file) == (resolved, 0, 1)
+    assert load(mapping_files, db_url, cache_file) == (resolved, 1, 0)
+
+
+def test_cache_invalidated_by_mapping_file_change(tmp_path, db_url, sensors, mapping_files):
+    cache_file = str(tmp_path / 'obs_map_cache.db')
+    resolved, _, _ = load(mapping_files, db_url, cache_file)
+    file_name = next(iter(mapping_files.values()))
+    file_stat = os.stat(file_name)
+    os.utime(file_name, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns + 1000000000))
+    assert load(mapping_files, db_url, cache_file) == (resolved, 0, 1)
+
+
+def test_cache_without_db_check(tmp_path, db_url, sensors, mapping_files):
+    cache_file = str(tmp_path / 'obs_map_cache.db')
+    resolved, _, _ = load(mapping_files, db_url, cache_file)
+    # validate_cache=False trusts the cache for the same mapping files without connecting.
+    assert load(mapping_files, 'sqlite:////nonexistent/xenia.db', cache_file, validate_cache=False) == \
+        (resolved, 1, 0)
+
+
+def test_unreadable_fingerprint_is_a_miss(tmp_path, db, sensors, mapping_files):
+    cache = ObsMapCache(str(tmp_path / 'obs_map_cache.db'))
+    source_signature = mapping_files_signature(mapping_files)
+    cache.save(PlatformObsMap(), source_signature, db.get_sensor_fingerprint())
+    assert cache.load(source_signature, db.get_sensor_fingerprint()) is not None
+    assert cache.load(source_signature, None) is None
+    assert cache.load(source_signature, check_db=False) is not None
+    assert cache.load('another signature', check_db=False) is None
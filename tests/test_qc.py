@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from ..xenia_qc import (
+    QC_LEVEL_BAD,
+    QC_LEVEL_GOOD,
+    QC_LEVEL_NO_DATA,
+    QC_LEVEL_SUSPECT,
+    QCEngine,
+    QCLimits,
+    QCLimitsTable,
+)
+from ..XeniaTables import multi_obs
+
+pytest.importorskip('numpy')
+
+START_DATE = datetime(2024, 1, 1)
+VALUES = [1.0, 1.1, 1.2, 9.0, 1.3, 1.3, 1.3, 1.3, None, 50.0]
+LIMITS = QCLimits(range_min=0, range_max=40, spike_suspect=2, spike_fail=5, gradient_suspect=0.001,
+                  flat_line_tolerance=0.01, flat_line_suspect_count=3, flat_line_fail_count=4)
+# (qc_flag, qc_level) per value, the digits in range, spike, gradient, flat line order.
+EXPECTED = [
+    ('1221', QC_LEVEL_GOOD),
+    ('1111', QC_LEVEL_GOOD),
+    ('1111', QC_LEVEL_GOOD),
+    ('1431', QC_LEVEL_BAD),       # Spike fail, 7.8 change in 10 minutes is a suspect gradient.
+    ('1131', QC_LEVEL_SUSPECT),
+    ('1111', QC_LEVEL_GOOD),
+    ('1113', QC_LEVEL_SUSPECT),   # Third repeated value.
+    ('1214', QC_LEVEL_BAD),       # Fourth repeated value, no next value for the spike test.
+    ('9999', QC_LEVEL_NO_DATA),
+    ('4221', QC_LEVEL_BAD),       # Out of range.
+]
+
+
+@pytest.fixture
+def series(db, sensors):
+    """
+    The VALUES series, 10 minutes apart, for a sensor with limits and for one without.
+    """
+    records = []
+    for sensor_id, m_type_id, platform_handle, longitude, latitude in sensors[:2]:
+        records.extend(dict(platform_handle=platform_handle, sensor_id=sensor_id, m_type_id=m_type_id,
+                            m_date=START_DATE + timedelta(minutes=10 * ndx), m_lon=longitude, m_lat=latitude,
+                            m_value=value)
+                       for ndx, value in enumerate(VALUES))
+    db.add_multi_obs_bulk(records)
+    return sensors[0][0], sensors[1][0]
+
+
+def stored_flags(db, sensor_id):
+    with db.dbEngine.connect() as connection:
+        return [tuple(row) for row in connection.execute(select(multi_obs.qc_flag, multi_obs.qc_level)
+                                                         .where(multi_obs.sensor_id == sensor_id)
+                                                         .order_by(multi_obs.m_date))]
+
+
+def test_qc_flags_written(db, series):
+    sensor_id, unlimited_sensor_id = series
+    engine = QCEngine(db, QCLimitsTable(by_sensor={sensor_id: LIMITS}))
+    stats = engine.run(START_DATE, START_DATE + timedelta(days=1))
+    assert (stats['sensors'], stats['rows']) == (1, len(VALUES))
+    assert stats['qc_levels'] == {QC_LEVEL_NO_DATA: 1, QC_LEVEL_BAD: 3, QC_LEVEL_SUSPECT: 2, QC_LEVEL_GOOD: 4}
+    assert stored_flags(db, sensor_id) == EXPECTED
+    assert stored_flags(db, unlimited_sensor_id) == [(None, None)] * len(VALUES)
+
+
+def test_qc_window_uses_context(db, series):
+    sensor_id, _ = series
+    engine = QCEngine(db, QCLimitsTable(by_sensor={sensor_id: LIMITS}))
+    # Only the spike is in the window, its neighbours are read as context but not updated.
+    stats = engine.run(START_DATE + timedelta(minutes=30), START_DATE + timedelta(minutes=40))
+    assert stats['rows'] == 1
+    assert stored_flags(db, sensor_id) == [(None, None)] * 3 + [EXPECTED[3]] + [(None, None)] * 6
+
+
+def test_qc_limits_by_m_type(db, series, sensors):
+    sensor_id, unlimited_sensor_id = series
+    range_limits = QCLimits(range_min=0, range_max=5)
+    engine = QCEngine(db, QCLimitsTable(by_m_type={sensors[0][1]: range_limits, sensors[1][1]: range_limits},
+                                        by_sensor={unlimited_sensor_id: LIMITS}))
+    engine.run(START_DATE, START_DATE + timedelta(days=1))
+    # The sensor's own limits take precedence over its m_type's.
+    assert stored_flags(db, unlimited_sensor_id) == EXPECTED
+    assert [qc_flag for qc_flag, _ in stored_flags(db, sensor_id)] == \
+        ['1222'] * 3 + ['4222'] + ['1222'] * 4 + ['9999', '4222']
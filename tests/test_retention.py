@@ -0,0 +1,86 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from ..benchmarks.synthetic import generate_observations
+from ..xenia_retention import (
+    AGGREGATE_PERIOD,
+    RetentionEngine,
+    RetentionPolicy,
+    floor_hour,
+)
+from ..XeniaTables import multi_obs
+
+START_DATE = datetime(2024, 1, 1)
+NOW = datetime(2024, 1, 5, 0, 30)
+DAYS = 4
+
+
+@pytest.fixture
+def observations(db, sensors, unique_observations):
+    # Every sensor reports every 10 minutes for DAYS days, the first reading of each hour on the hour.
+    records = list(generate_observations(sensors, START_DATE, len(sensors) * 6 * 24 * DAYS, as_dicts=True))
+    for rec in records:
+        # Set by legacy ingest on raw readings, it must not be taken for the aggregate marker.
+        if rec['m_date'].minute == 0:
+            rec['d_top_of_hour'] = 1
+    db.add_multi_obs_bulk(records)
+    return records
+
+
+def stored_rows(db):
+    table = multi_obs.__table__
+    with db.dbEngine.connect() as connection:
+        return connection.execute(select(table.c.sensor_id, table.c.m_date, table.c.m_value,
+                                         table.c.aggregate_period)
+                                  .order_by(table.c.sensor_id, table.c.m_date)).all()
+
+
+def policies(sensors):
+    downsampled_m_type = sensors[0][1]
+    return [RetentionPolicy('hourly', 2, m_type_ids=[downsampled_m_type]),
+            RetentionPolicy('delete', 2, downsample=False)]
+
+
+@pytest.mark.parametrize('window', [timedelta(days=1), timedelta(hours=5)])
+def test_retention_windows(db, sensors, observations, window):
+    cutoff = datetime(2024, 1, 3)
+    downsampled_m_type = sensors[0][1]
+    downsampled_sensors = {sensor_id for sensor_id, m_type_id, _, _, _ in sensors if m_type_id == downsampled_m_type}
+    stats = RetentionEngine(db, policies(sensors), window=window).run(now=NOW)
+
+    raw_before_cutoff = defaultdict(list)
+    for rec in observations:
+        if rec['m_date'] < cutoff:
+            raw_before_cutoff[(rec['sensor_id'], floor_hour(rec['m_date']))].append(rec['m_value'])
+    assert stats['hourly']['cutoff'] == cutoff
+    assert stats['hourly']['sensors'] == len(downsampled_sensors)
+    assert stats['hourly']['rows_deleted'] == 6 * 48 * len(downsampled_sensors)
+    assert stats['hourly']['rows_written'] == 48 * len(downsampled_sensors)
+    assert stats['delete']['rows_deleted'] == 6 * 48 * (len(sensors) - len(downsampled_sensors))
+    assert stats['delete']['rows_written'] == 0
+
+    rows = stored_rows(db)
+    aggregates = [row for row in rows if row.aggregate_period == AGGREGATE_PERIOD]
+    raw_rows = [row for row in rows if row.aggregate_period is None]
+    # Rows at or after the cutoff are untouched.
+    assert all(row.m_date >= cutoff for row in raw_rows)
+    assert len(raw_rows) == sum(1 for rec in observations if rec['m_date'] >= cutoff)
+    # One aggregate per downsampled sensor and hour before the cutoff, the average of the hour's raw values.
+    assert {(row.sensor_id, row.m_date) for row in aggregates} == \
+        {key for key in raw_before_cutoff if key[0] in downsampled_sensors}
+    for row in aggregates:
+        values = raw_before_cutoff[(row.sensor_id, row.m_date)]
+        assert row.m_value == pytest.approx(sum(values) / len(values))
+
+
+def test_retention_rerun_is_a_no_op(db, sensors, observations):
+    engine = RetentionEngine(db, policies(sensors), window=timedelta(hours=7))
+    engine.run(now=NOW)
+    rows = stored_rows(db)
+    stats = engine.run(now=NOW)
+    assert stored_rows(db) == rows
+    assert all(policy_stats['rows_deleted'] == 0 and policy_stats['rows_written'] == 0
+               for policy_stats in stats.values())
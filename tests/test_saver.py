@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from sqlalchemy import exc
+
+from ..benchmarks.synthetic import database_configuration, generate_observations
+from ..MultiProcDataSaver import MultiProcessDataSaver
+from ..xenia_monitor import SensorLatencyTracker
+
+START_DATE = datetime(2024, 1, 1)
+
+
+def test_latency_observes_written_records_only(db_url, db, sensors, unique_observations, monkeypatch):
+    saver = MultiProcessDataSaver(database_configuration(db_url), 10, bulk_insert=True)
+    records = list(generate_observations(sensors[:1], START_DATE, 3))
+    saver._write_bulk(db, records[:1])
+    latency = SensorLatencyTracker(flush_interval=3600)
+    latency.load(db)
+
+    # The first record is a duplicate, only the other two are written and observed.
+    written_records = saver._write_bulk(db, records)
+    assert written_records == [(rec.sensor_id, rec.m_date) for rec in records[1:]]
+    saver._latency_commit_point(db, latency, written_records)
+    assert latency._sensors[sensors[0][0]][0] == records[-1].m_date
+
+    # A batch that fails outright is rolled back and leaves the tracker as it was.
+    def lost_connection(records, commit=True):
+        raise exc.OperationalError("INSERT", {}, Exception("connection lost"))
+
+    monkeypatch.setattr(db, 'add_multi_obs_bulk', lost_connection)
+    newer_records = list(generate_observations(sensors[:1], datetime(2024, 2, 1), 2))
+    assert saver._write_bulk(db, newer_records) == []
+    saver._latency_commit_point(db, latency, [])
+    assert latency._sensors[sensors[0][0]][0] == records[-1].m_date
+    assert not latency._pending
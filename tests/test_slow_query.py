@@ -0,0 +1,63 @@
+import pytest
+from sqlalchemy import create_engine, exc, text
+
+from ..xenia_slow_query import SlowQueryRecorder
+
+
+class PlanCursor:
+    def execute(self, statement, parameters=None):
+        self.statement = statement
+
+    def fetchall(self):
+        return [("Seq Scan on multi_obs",)]
+
+    def close(self):
+        pass
+
+
+class AutocommitConnection:
+    # A read replica connection: no transaction, so EXPLAIN runs without a savepoint.
+    autocommit = True
+
+    def cursor(self):
+        return PlanCursor()
+
+
+class StatementCursor:
+    connection = AutocommitConnection()
+
+
+@pytest.fixture
+def recorder(tmp_path):
+    slow_query_recorder = SlowQueryRecorder(str(tmp_path / 'slow_queries.log'), threshold_seconds=0,
+                                            max_explained_statements=3)
+    yield slow_query_recorder
+    slow_query_recorder.close()
+
+
+def test_failed_statements_leave_no_start_time(db_url, recorder):
+    engine = create_engine(db_url)
+    recorder.attach(engine)
+    try:
+        with engine.connect() as connection:
+            for _ in range(3):
+                with pytest.raises(exc.OperationalError):
+                    connection.execute(text("SELECT * FROM no_such_table"))
+                connection.rollback()
+            connection.execute(text("SELECT 1"))
+            assert connection.info['xenia_slow_query_start'] == []
+    finally:
+        recorder.detach(engine)
+        engine.dispose()
+
+
+def test_explain_times_are_bounded(recorder):
+    statements = ["SELECT * FROM multi_obs WHERE sensor_id = %d" % (sensor_id) for sensor_id in range(5)]
+    for statement in statements:
+        assert recorder._explain(None, StatementCursor(), statement, None) == "Seq Scan on multi_obs"
+    assert list(recorder._last_explain) == statements[2:]
+    # Still inside explain_interval, no second plan.
+    assert recorder._explain(None, StatementCursor(), statements[4], None) is None
+    # Dropped from the bounded times, so explained again.
+    assert recorder._explain(None, StatementCursor(), statements[0], None) == "Seq Scan on multi_obs"
+    assert list(recorder._last_explain) == statements[3:] + statements[:1]
@@ -0,0 +1,41 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert, select
+
+from ..benchmarks.synthetic import create_schema, seed_metadata, temporary_sqlite_url
+from ..xenia_status import CurrentStatusView
+from ..xeniaAlchemy import xeniaAlchemy
+from ..XeniaTables import platform, platform_status
+
+
+@pytest.fixture
+def replica_url():
+    """
+    A read replica that lags the primary: it has the metadata but none of the statuses.
+    """
+    url = temporary_sqlite_url(prefix='xenia_test_replica_')
+    create_schema(url)
+    seed_metadata(url, 2, 3)
+    yield url
+    if os.path.exists(url[len('sqlite:///'):]):
+        os.remove(url[len('sqlite:///'):])
+
+
+def test_status_view_loads_from_the_primary(db_url, sensors, replica_url):
+    platform_handle = sensors[0][2]
+    db = xeniaAlchemy()
+    assert db.connect_db(db_url, False, read_replicas=[replica_url])
+    try:
+        with db.dbEngine.begin() as connection:
+            platform_id = connection.execute(select(platform.row_id)
+                                             .where(platform.platform_handle == platform_handle)).scalar()
+            connection.execute(insert(platform_status.__table__).values(
+                row_entry_date=datetime.now(), begin_date=datetime.now() - timedelta(days=1),
+                platform_handle=platform_handle, platform_id=platform_id, status=1, reason='Maintenance'))
+
+        status_view = CurrentStatusView(db)
+        assert status_view.platform_status(platform_handle).reason == 'Maintenance'
+    finally:
+        db.disconnect()
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+
+from ..xenia_qc import (
+    QC_LEVEL_BAD,
+    QC_LEVEL_GOOD,
+    QC_LEVEL_NO_DATA,
+    QC_LEVEL_SUSPECT,
+    QCLimits,
+    QCLimitsTable,
+    StreamingQC,
+)
+from ..XeniaTables import multi_obs
+
+START_DATE = datetime(2024, 1, 1)
+VALUES = [1.0, 1.1, 1.2, 9.0, 1.3, 1.3, 1.3, 1.3, None, 50.0]
+LIMITS = QCLimits(range_min=0, range_max=40, spike_suspect=2, spike_fail=5, gradient_suspect=0.001,
+                  flat_line_tolerance=0.01, flat_line_suspect_count=3, flat_line_fail_count=4)
+# (qc_flag, qc_level) per value, the digits in range, spike, gradient, flat line order. The spike test
+# measures the distance from the rolling mean of the values before.
+EXPECTED = [
+    ('1221', QC_LEVEL_GOOD),
+    ('1111', QC_LEVEL_GOOD),
+    ('1111', QC_LEVEL_GOOD),
+    ('1431', QC_LEVEL_BAD),       # 7.9 above the mean, 7.8 change in 10 minutes is a suspect gradient.
+    ('1131', QC_LEVEL_SUSPECT),
+    ('1111', QC_LEVEL_GOOD),
+    ('1113', QC_LEVEL_SUSPECT),   # Third repeated value.
+    ('1114', QC_LEVEL_BAD),       # Fourth repeated value.
+    ('9999', QC_LEVEL_NO_DATA),
+    ('4431', QC_LEVEL_BAD),       # Out of range, the gradient is taken from the last value 20 minutes before.
+]
+
+
+def series(sensor_id, as_dicts):
+    for ndx, value in enumerate(VALUES):
+        values = dict(sensor_id=sensor_id, m_type_id=1, m_date=START_DATE + timedelta(minutes=10 * ndx),
+                      m_value=value)
+        yield values if as_dicts else multi_obs(**values)
+
+
+def qc_flags(rec):
+    if isinstance(rec, dict):
+        return rec.get('qc_flag'), rec.get('qc_level')
+    return rec.qc_flag, rec.qc_level
+
+
+def test_streaming_qc_objects_and_dicts():
+    qc = StreamingQC(QCLimitsTable(by_sensor={1: LIMITS, 2: LIMITS}))
+    for sensor_id, as_dicts in ((1, False), (2, True)):
+        records = list(series(sensor_id, as_dicts))
+        assert all(qc.apply(rec) for rec in records)
+        assert [qc_flags(rec) for rec in records] == EXPECTED
+
+    # No limits for the sensor or its m_type, the record is left alone.
+    rec = next(series(3, True))
+    assert not qc.apply(rec)
+    assert qc_flags(rec) == (None, None)
+
+
+def test_streaming_qc_skips_repeated_dates():
+    qc = StreamingQC(QCLimitsTable(by_sensor={1: LIMITS}))
+    records = list(series(1, True))
+    for rec in records:
+        qc.apply(rec)
+
+    # A repeat of the last value is flagged, with no gradient since no time passed, but not added to the state.
+    repeat = dict(records[-1])
+    qc.apply(repeat)
+    assert qc_flags(repeat) == ('4421', QC_LEVEL_BAD)
+    # Had the repeat been added this would be the third value of a flat line.
+    next_rec = dict(records[-1], m_date=records[-1]['m_date'] + timedelta(minutes=10))
+    qc.apply(next_rec)
+    assert qc_flags(next_rec) == ('4411', QC_LEVEL_BAD)
@@ -0,0 +1,198 @@
+import os
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, func, select, update
+
+from ..benchmarks.synthetic import (
+    create_schema,
+    database_configuration,
+    generate_observations,
+    seed_metadata,
+    temporary_sqlite_url,
+)
+from ..xenia_sync import MultiObsSync
+from ..XeniaTables import multi_obs, sync_state
+
+START_DATE = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def target_url():
+    url = temporary_sqlite_url(prefix='xenia_test_target_')
+    create_schema(url)
+    yield url
+    if os.path.exists(url[len('sqlite:///'):]):
+        os.remove(url[len('sqlite:///'):])
+
+
+def central_rows(target_url):
+    engine = create_engine(target_url)
+    try:
+        with engine.connect() as connection:
+            return connection.execute(select(multi_obs.platform_handle, multi_obs.m_date, multi_obs.m_value)
+                                      .order_by(multi_obs.platform_handle, multi_obs.m_date,
+                                                multi_obs.m_value)).all()
+    finally:
+        engine.dispose()
+
+
+def source_rows(db):
+    with db.dbEngine.connect() as connection:
+        return connection.execute(select(multi_obs.platform_handle, multi_obs.m_date, multi_obs.m_value)
+                                  .order_by(multi_obs.platform_handle, multi_obs.m_date, multi_obs.m_value)).all()
+
+
+def max_row_id(db):
+    with db.dbEngine.connect() as connection:
+        return connection.execute(select(func.max(multi_obs.row_id))).scalar()
+
+
+def run_sync(db_url, target_url, **kwargs):
+    with MultiObsSync(database_configuration(db_url), database_configuration(target_url), 'collector1',
+                      chunk_size=50) as sync:
+        return sync.run(**kwargs), sync.status()
+
+
+def test_sync_resumes_from_high_water_mark(db_url, db, sensors, target_url):
+    # The central database numbers its sensors differently from the collector.
+    seed_metadata(target_url, 3, 2)
+    seed_metadata(target_url, 2, 3)
+    db.add_multi_obs_bulk(list(generate_observations(sensors, START_DATE, 180)))
+
+    stats, status = run_sync(db_url, target_url, max_chunks=2)
+    assert (stats['chunks'], stats['rows_read'], stats['rows_written']) == (2, 100, 100)
+    assert status['last_row_id'] == stats['last_row_id'] == 100
+    assert status['rows_synced'] == 100
+
+    stats, status = run_sync(db_url, target_url)
+    assert (stats['rows_read'], stats['rows_written']) == (80, 80)
+    assert status['last_row_id'] == max_row_id(db)
+    assert central_rows(target_url) == source_rows(db)
+
+    # Only the rows added since are read.
+    db.add_multi_obs_bulk(list(generate_observations(sensors, datetime(2024, 2, 1), 12)))
+    stats, status = run_sync(db_url, target_url)
+    assert (stats['rows_read'], stats['rows_written']) == (12, 12)
+    assert status['last_row_id'] == max_row_id(db)
+    assert status['rows_synced'] == 192
+    assert central_rows(target_url) == source_rows(db)
+
+    stats, _ = run_sync(db_url, target_url)
+    assert (stats['chunks'], stats['rows_read']) == (0, 0)
+
+
+def test_sync_does_not_duplicate_rows_already_copied(db_url, db, sensors, target_url):
+    seed_metadata(target_url, 2, 3)
+    db.add_multi_obs_bulk(list(generate_observations(sensors, START_DATE, 120)))
+    run_sync(db_url, target_url)
+    engine = create_engine(target_url)
+    try:
+        with engine.begin() as connection:
+            connection.execute(update(sync_state).values(last_row_id=0))
+    finally:
+        engine.dispose()
+
+    stats, status = run_sync(db_url, target_url)
+    assert (stats['rows_read'], stats['rows_written']) == (120, 0)
+    assert central_rows(target_url) == source_rows(db)
+
+
+def test_sync_failed_chunk_is_retried(db_url, db, sensors, target_url, monkeypatch):
+    seed_metadata(target_url, 2, 3)
+    db.add_multi_obs_bulk(list(generate_observations(sensors, START_DATE, 120)))
+    write_chunk = MultiObsSync._write_chunk
+    chunk_count = 0
+
+    def failing_write_chunk(self, rows):
+        nonlocal chunk_count
+        chunk_count += 1
+        inserted_count = write_chunk(self, rows)
+        if chunk_count == 2:
+            raise RuntimeError("Connection lost.")
+        return inserted_count
+
+    monkeypatch.setattr(MultiObsSync, '_write_chunk', failing_write_chunk)
+    stats, status = run_sync(db_url, target_url)
+    assert stats is None
+    # The failed chunk's rows and high-water mark were rolled back together.
+    assert status['last_row_id'] == 50
+    assert len(central_rows(target_url)) == 50
+
+    monkeypatch.setattr(MultiObsSync, '_write_chunk', write_chunk)
+    stats, status = run_sync(db_url, target_url)
+    assert (stats['rows_read'], stats['rows_written']) == (70, 70)
+    assert central_rows(target_url) == source_rows(db)
+
+
+def test_sync_holds_high_water_mark_at_unmapped_sensor(db_url, db, sensors, target_url):
+    seed_metadata(target_url, 2, 3)
+    observations = list(generate_observations(sensors, START_DATE, 120, as_dicts=True))
+    db.add_multi_obs_bulk(observations[:60])
+    # A row for a sensor the source catalog can't resolve.
+    db.add_multi_obs_bulk([dict(observations[0], sensor_id=9999)])
+    db.add_multi_obs_bulk(observations[60:])
+
+    stats, status = run_sync(db_url, target_url)
+    assert (stats['rows_read'], stats['rows_written'], stats['rows_skipped']) == (60, 60, 0)
+    assert status['last_row_id'] == 60
+    # The next run stops at the same row rather than skipping past it.
+    stats, status = run_sync(db_url, target_url)
+    assert (stats['rows_read'], status['last_row_id']) == (0, 60)
+
+    with db.dbEngine.begin() as connection:
+        connection.execute(multi_obs.__table__.delete().where(multi_obs.sensor_id == 9999))
+    stats, status = run_sync(db_url, target_url)
+    assert (stats['rows_read'], stats['rows_written']) == (60, 60)
+    assert status['last_row_id'] == max_row_id(db)
+    assert central_rows(target_url) == source_rows(db)
+
+
+def test_sync_provisions_missing_sensors_with_one_catalog_reload(db_url, db, sensors, target_url, monkeypatch):
+    # The second platform is seeded centrally without its sensors, adding a platform through the ORM needs
+    # SpatiaLite.
+    seed_metadata(target_url, 1, 3)
+    seed_metadata(target_url, 2, 0)
+    db.add_multi_obs_bulk(list(generate_observations(sensors, START_DATE, 60)))
+    central_ids = MultiObsSync._central_ids
+    reload_count = 0
+
+    def counted_central_ids(self):
+        nonlocal reload_count
+        reload_count += 1
+        return central_ids(self)
+
+    monkeypatch.setattr(MultiObsSync, '_central_ids', counted_central_ids)
+    stats, _ = run_sync(db_url, target_url)
+    assert (stats['rows_read'], stats['rows_written']) == (60, 60)
+    # Read before provisioning the second platform's three sensors and once after.
+    assert reload_count == 2
+    assert central_rows(target_url) == source_rows(db)
+
+
+def test_sync_rechecks_skipped_sensors_every_run(db_url, db, sensors, target_url):
+    seed_metadata(target_url, 2, 0)
+    db.add_multi_obs_bulk(list(generate_observations(sensors, START_DATE, 12)))
+    with MultiObsSync(database_configuration(db_url), database_configuration(target_url), 'collector1',
+                      add_missing_sensors=False) as sync:
+        stats = sync.run()
+        assert (stats['rows_read'], stats['rows_skipped']) == (12, 12)
+
+        # The sensors are added centrally while the sync keeps running.
+        seed_metadata(target_url, 2, 3)
+        db.add_multi_obs_bulk(list(generate_observations(sensors, datetime(2024, 2, 1), 12)))
+        stats = sync.run()
+        assert (stats['rows_read'], stats['rows_written'], stats['rows_skipped']) == (12, 12, 0)
+
+
+def test_sync_copy_error_rolls_back(db_url, db, sensors, target_url, failing_copy, monkeypatch):
+    seed_metadata(target_url, 2, 3)
+    db.add_multi_obs_bulk(list(generate_observations(sensors, START_DATE, 30)))
+    with MultiObsSync(database_configuration(db_url), database_configuration(target_url), 'collector1') as sync:
+        failing_copy(sync.target)
+        assert sync.run() is None
+        monkeypatch.undo()
+        assert sync.status() == {}
+        stats = sync.run()
+    assert (stats['rows_read'], stats['rows_written']) == (30, 30)
+    assert central_rows(target_url) == source_rows(db)
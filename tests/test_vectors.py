@@ -0,0 +1,100 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, select
+
+from ..benchmarks.synthetic import (
+    create_schema,
+    database_configuration,
+    seed_metadata,
+    temporary_sqlite_url,
+)
+from ..xenia_sync import MultiObsSync
+from ..xeniaAlchemy import xeniaAlchemy
+from ..XeniaTables import multi_obs
+
+START_DATE = datetime(2024, 1, 1)
+# The first component is also measured by a single value sensor of the seeded platforms.
+COMPONENTS = [('air_temperature', 'celsius'), ('water_temperature', 'celsius')]
+VECTOR_KEY = ('air_temperature,water_temperature', 'celsius,celsius')
+
+
+@pytest.fixture
+def vector_sensor(db, sensors):
+    """
+    A multi-value sensor on the first seeded platform with a day of hourly observations. Returns its
+    (sensor_id, m_type_id, platform_handle).
+    """
+    platform_handle = sensors[0][2]
+    sensor_id = db.newVectorSensor(datetime.now(), 'air_water_temperature', COMPONENTS,
+                                   db.platformExists(platform_handle), addObsAndUOM=True)
+    m_type_id = next(rec[5] for rec in db.get_sensor_catalog(sensor_ids=[sensor_id]))
+    db.add_multi_obs_bulk([dict(platform_handle=platform_handle, sensor_id=sensor_id, m_type_id=m_type_id,
+                                m_date=START_DATE + timedelta(hours=ndx), m_lon=sensors[0][3], m_lat=sensors[0][4],
+                                m_values=[20.0 + ndx, 15.0 - ndx])
+                           for ndx in range(24)])
+    return sensor_id, m_type_id, platform_handle
+
+
+@pytest.fixture
+def target_url():
+    url = temporary_sqlite_url(prefix='xenia_test_target_')
+    create_schema(url)
+    yield url
+    if os.path.exists(url[len('sqlite:///'):]):
+        os.remove(url[len('sqlite:///'):])
+
+
+def vector_rows(engine_or_db, platform_handle):
+    engine = engine_or_db.dbEngine if isinstance(engine_or_db, xeniaAlchemy) else engine_or_db
+    with engine.connect() as connection:
+        return connection.execute(select(multi_obs.m_date, multi_obs.m_value, multi_obs.m_value_2)
+                                  .where(multi_obs.platform_handle == platform_handle)
+                                  .where(multi_obs.m_value_2.isnot(None))
+                                  .order_by(multi_obs.m_date)).all()
+
+
+def test_catalog_keys_vector_sensor_on_its_components(db, sensors, vector_sensor):
+    sensor_id, m_type_id, platform_handle = vector_sensor
+    catalog = {rec[0]: rec for rec in db.get_sensor_catalog()}
+    assert catalog[sensor_id] == (sensor_id, platform_handle) + VECTOR_KEY + (1, m_type_id, 'air_water_temperature')
+    # The single value sensor of the first component keeps its own key.
+    assert catalog[sensors[0][0]][2:4] == COMPONENTS[0]
+    assert len({rec[1:5] for rec in catalog.values()}) == len(catalog)
+
+
+def test_sync_provisions_vector_sensor(db_url, db, sensors, vector_sensor, target_url):
+    # Platforms are seeded centrally, adding one through the ORM needs SpatiaLite.
+    seed_metadata(target_url, 2, 3)
+    with MultiObsSync(database_configuration(db_url), database_configuration(target_url), 'collector1') as sync:
+        stats = sync.run()
+        central_catalog = sync.target.get_sensor_catalog()
+    assert stats['rows_skipped'] == 0
+    assert [rec[2:5] for rec in central_catalog if rec[1] == vector_sensor[2] and rec[2] == VECTOR_KEY[0]] == \
+        [VECTOR_KEY + (1,)]
+    engine = create_engine(target_url)
+    try:
+        assert vector_rows(engine, vector_sensor[2]) == vector_rows(db, vector_sensor[2])
+    finally:
+        engine.dispose()
+    assert len(vector_rows(db, vector_sensor[2])) == 24
+
+
+def test_export_import_vector_sensor(tmp_path, db, sensors, vector_sensor, target_url):
+    pytest.importorskip('pyarrow')
+    from ..xenia_export import MultiObsExporter
+    from ..xenia_import import MultiObsImporter
+
+    sensor_id, _, platform_handle = vector_sensor
+    assert MultiObsExporter(db, str(tmp_path)).export(START_DATE, START_DATE + timedelta(days=1),
+                                                      sensor_ids=[sensor_id])['rows'] == 24
+    seed_metadata(target_url, 2, 3)
+    target = xeniaAlchemy()
+    assert target.connect_db(target_url, False)
+    try:
+        stats = MultiObsImporter(target, add_missing_sensors=True).import_parquet(str(tmp_path))
+        assert (stats['rows_written'], stats['rows_skipped']) == (24, 0)
+        assert vector_rows(target, platform_handle) == vector_rows(db, platform_handle)
+    finally:
+        target.disconnect()
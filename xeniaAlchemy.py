@@ -1,17 +1,47 @@
 """
 
 """
+import collections
+import functools
 import logging
+from contextlib import contextmanager
 from datetime import datetime
 
-from sqlalchemy import MetaData, create_engine, exc, func
+from sqlalchemy import (
+    Float,
+    Integer,
+    MetaData,
+    and_,
+    bindparam,
+    column,
+    create_engine,
+    event,
+    exc,
+    func,
+    insert,
+    literal,
+    or_,
+    select,
+    text,
+    update,
+)
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.exc import NoResultFound
 
+from .xenia_metrics import timed
+from .xenia_replicas import ReadReplicaPool
+from .xenia_spatial import (
+    envelope_expression,
+    has_spatialite,
+    haversine_km,
+    point_expression,
+)
+from .xenia_sqlite import apply_sqlite_profile
 from .XeniaTables import (
     m_scalar_type,
     m_type,
     multi_obs,
+    multi_obs_array,
     obs_type,
     organization,
     platform,
@@ -24,6 +54,154 @@ from .XeniaTables import (
 
 logger = logging.getLogger(__name__
                            )
+
+# multi_obs columns written by the bulk insert path. row_id is assigned by the database and the_geom is
+# derived from m_lon/m_lat in the INSERT itself.
+MULTI_OBS_BULK_COLUMNS = tuple(column.name for column in multi_obs.__table__.columns
+                               if column.name not in ('row_id', 'the_geom'))
+
+# Columns returned by the multi_obs time window and region reads.
+MULTI_OBS_READ_COLUMNS = (multi_obs.row_id, multi_obs.platform_handle, multi_obs.sensor_id, multi_obs.m_type_id,
+                          multi_obs.m_date, multi_obs.m_lon, multi_obs.m_lat, multi_obs.m_z, multi_obs.m_value,
+                          multi_obs.qc_level, multi_obs.qc_flag)
+
+# multi_obs value columns, the components of a multi-value(vector) m_type are stored in order, m_value first.
+MULTI_OBS_VALUE_COLUMNS = ('m_value', 'm_value_2', 'm_value_3', 'm_value_4', 'm_value_5', 'm_value_6', 'm_value_7',
+                           'm_value_8')
+
+# m_type scalar type columns, in the same order as MULTI_OBS_VALUE_COLUMNS.
+M_TYPE_SCALAR_COLUMNS = ('m_scalar_type_id', 'm_scalar_type_id_2', 'm_scalar_type_id_3', 'm_scalar_type_id_4',
+                         'm_scalar_type_id_5', 'm_scalar_type_id_6', 'm_scalar_type_id_7', 'm_scalar_type_id_8')
+
+# Joins the component names of a multi-value sensor, it can't appear in a standard name.
+COMPONENT_SEPARATOR = ','
+
+# Row returned by get_multi_obs_vectors(), values holds one value per component of the sensor's m_type.
+VectorObservation = collections.namedtuple('VectorObservation',
+                                           ['sensor_id', 'm_type_id', 'm_date', 'values', 'qc_level', 'qc_flag'])
+
+MULTI_OBS_ARRAY_COLUMNS = tuple(column.name for column in multi_obs_array.__table__.columns if column.name != 'row_id')
+
+MULTI_OBS_ARRAY_READ_COLUMNS = (multi_obs_array.row_id, multi_obs_array.platform_handle, multi_obs_array.sensor_id,
+                                multi_obs_array.m_type_id, multi_obs_array.m_date, multi_obs_array.m_lon,
+                                multi_obs_array.m_lat, multi_obs_array.m_values, multi_obs_array.bin_values,
+                                multi_obs_array.bin_start, multi_obs_array.bin_size, multi_obs_array.qc_level)
+
+# A multi_obs_array bin returned as a multi_obs row, same fields as the get_multi_obs() rows. m_z is the bin
+# coordinate and row_id is None.
+ExpandedObservation = collections.namedtuple('ExpandedObservation',
+                                             [column.key for column in MULTI_OBS_READ_COLUMNS])
+
+PLATFORM_LOCATION_COLUMNS = (platform.row_id, platform.platform_handle, platform.fixed_longitude,
+                             platform.fixed_latitude)
+
+
+def vector_values(values):
+    """
+    The multi_obs value columns for the components of a multi-value observation, in m_type component order.
+    """
+    if len(values) > len(MULTI_OBS_VALUE_COLUMNS):
+        raise ValueError("At most %d values per observation, got: %d" % (len(MULTI_OBS_VALUE_COLUMNS), len(values)))
+    return dict(zip(MULTI_OBS_VALUE_COLUMNS, values))
+
+
+def component_names(components):
+    """
+    The (obs_name, uom) a multi-value sensor is keyed on in the sensor catalog, its components' obs names and
+    uoms joined in value order with COMPONENT_SEPARATOR, e.g. ('eastward_wind,northward_wind', 'm_s-1,m_s-1').
+    """
+    return (COMPONENT_SEPARATOR.join(obs_name for obs_name, _ in components),
+            COMPONENT_SEPARATOR.join(uom for _, uom in components))
+
+
+def split_component_names(obs_name, uom):
+    """
+    The [(obs_name, uom)...] components of a catalog obs_name and uom, a single one for a single value sensor.
+    """
+    return list(zip(obs_name.split(COMPONENT_SEPARATOR), uom.split(COMPONENT_SEPARATOR)))
+
+
+def m_type_components(connection, m_type_ids):
+    """
+    The [(obs_name, uom)...] components of m_types keyed on m_type_id, read with two queries through
+    connection, a Session or Connection.
+    """
+    m_types = connection.execute(select(m_type.row_id, m_type.num_types,
+                                        *[getattr(m_type, column_name) for column_name in M_TYPE_SCALAR_COLUMNS])
+                                 .where(m_type.row_id.in_(m_type_ids))).all()
+    scalar_ids = {scalar_id for row in m_types for scalar_id in row[2:] if scalar_id is not None}
+    names = dict((row_id, (obs_name, uom)) for row_id, obs_name, uom in
+                 connection.execute(select(m_scalar_type.row_id, obs_type.standard_name, uom_type.standard_name)
+                                    .join(obs_type, obs_type.row_id == m_scalar_type.obs_type_id)
+                                    .join(uom_type, uom_type.row_id == m_scalar_type.uom_type_id)
+                                    .where(m_scalar_type.row_id.in_(scalar_ids))))
+    return {row[0]: [names.get(scalar_id) for scalar_id in row[2:2 + (row[1] or 1)]] for row in m_types}
+
+
+def scalar_m_types():
+    """
+    Filter for the single value m_types, num_types is NULL in older databases.
+    """
+    return or_(m_type.num_types.is_(None), m_type.num_types == 1)
+
+
+def bin_coordinates(row):
+    """
+    The bin coordinates of a multi_obs_array row: bin_values, or bin_start + i * bin_size for regular bins, or
+    the bin indexes if neither is set.
+    """
+    if row.bin_values is not None:
+        return row.bin_values
+    if row.bin_start is not None and row.bin_size is not None:
+        return [row.bin_start + ndx * row.bin_size for ndx in range(len(row.m_values))]
+    return list(range(len(row.m_values)))
+
+
+def expand_array_observation(row):
+    """
+    Yields an ExpandedObservation per bin of a multi_obs_array row.
+    """
+    for m_z, m_value in zip(bin_coordinates(row), row.m_values):
+        yield ExpandedObservation(None, row.platform_handle, row.sensor_id, row.m_type_id, row.m_date, row.m_lon,
+                                  row.m_lat, m_z, m_value, row.qc_level, None)
+
+
+def primary_reads(method):
+    """
+    Decorator for provisioning methods that check for a row and then add it: every read inside the call goes to
+    the primary so replica lag can't make an existing row look missing.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.primary():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def replica_reads(method):
+    """
+    Decorator for read-only methods that get their session from read_session(). If a replica fails during the
+    call the method is run again against the primary, whether the failure was raised or logged and returned as
+    None.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.read_replicas is None or self._primary_depth:
+            return method(self, *args, **kwargs)
+        failure_count = self.read_replicas.failure_count
+        try:
+            result = method(self, *args, **kwargs)
+        except exc.OperationalError:
+            if self.read_replicas.failure_count == failure_count:
+                raise
+        else:
+            if self.read_replicas.failure_count == failure_count:
+                return result
+        with self.primary():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class xeniaAlchemy(object):
     def __init__(self):
         self.dbEngine = None
@@ -31,12 +209,33 @@ class xeniaAlchemy(object):
         self.session = None
         self.connection = None
         self.logger = logger
-
-    def connect_db(self, connection_string, printSQL = False):
+        self._spatialite = None
+        self._spatialite_indexes = {}
+        # Optional xenia_metrics.XeniaMetrics collecting method timings and per method query counts.
+        self.metrics = None
+        self.slow_query_recorder = None
+        # Optional xenia_replicas.ReadReplicaPool the existence checks and observation reads are routed to.
+        self.read_replicas = None
+        self._primary_depth = 0
+        self.archive = None
+
+    def connect_db(self, connection_string, printSQL = False, metrics=None, slow_query_recorder=None,
+                   read_replicas=None, replica_retry_interval=30, sqlite_pragmas=None, spatialite=None,
+                   archive=None):
 
       try:
           # Connect to the database
           self.dbEngine = create_engine(connection_string, echo=printSQL)
+          # SQLite connections get the xenia_sqlite tuning profile(WAL, synchronous NORMAL, busy_timeout...),
+          # pass sqlite_pragmas={} to open them with the SQLite defaults.
+          apply_sqlite_profile(self.dbEngine, sqlite_pragmas, spatialite)
+          if metrics is not None:
+              self.metrics = metrics
+              metrics.instrument_engine(self.dbEngine)
+          # Optional xenia_slow_query.SlowQueryRecorder logging statements over its threshold.
+          self.slow_query_recorder = slow_query_recorder
+          if slow_query_recorder is not None:
+              slow_query_recorder.attach(self.dbEngine)
 
           # metadata object is used to keep information such as datatypes for our table's columns.
           self.metadata = MetaData()
@@ -44,9 +243,24 @@ class xeniaAlchemy(object):
 
           Session = sessionmaker(bind=self.dbEngine)
           self.session = Session()
+          # The spatial queries only match on the_geom, so ORM inserts(newPlatform, build_minimal_platform, the
+          # ORM saver) get it from their coordinates like the bulk path does.
+          event.listen(self.session, 'before_flush', self._set_new_geometry)
 
           self.connection = self.dbEngine.connect()
 
+          # Optional xenia_archive.MultiObsArchive, get_multi_obs() adds its rows to windows it covers.
+          self.archive = archive
+
+          # read_replicas is a list of connection strings, reads go round-robin to the healthy ones.
+          if read_replicas:
+              self.read_replicas = ReadReplicaPool(read_replicas, replica_retry_interval, printSQL)
+              for replica in self.read_replicas.replicas:
+                  if metrics is not None:
+                      metrics.instrument_engine(replica.engine)
+                  if slow_query_recorder is not None:
+                      slow_query_recorder.attach(replica.engine)
+
           return True
       except exc.OperationalError as e:
           self.logger.exception(e)
@@ -56,18 +270,56 @@ class xeniaAlchemy(object):
     def disconnect(self):
         self.session.close()
         self.connection.close()
+        if self.metrics is not None:
+            self.metrics.remove_engine(self.dbEngine)
+        if self.slow_query_recorder is not None:
+            self.slow_query_recorder.detach(self.dbEngine)
+        if self.read_replicas is not None:
+            self.read_replicas.dispose()
+            self.read_replicas = None
         self.dbEngine.dispose()
 
+    """
+    Function: read_session
+    Purpose: Session for a read-only query. With read replicas configured this is the session of the next
+    healthy replica in the rotation, otherwise, inside primary() or if every replica is down, the primary
+    session.
+    """
+
+
+    def read_session(self):
+        if self.read_replicas is not None and not self._primary_depth:
+            session = self.read_replicas.next_session()
+            if session is not None:
+                return session
+        return self.session
+
+    """
+    Function: primary
+    Purpose: Context manager sending every read made inside it to the primary, for read-then-write sequences
+    that must see their own writes.
+    """
+
+
+    @contextmanager
+    def primary(self):
+        self._primary_depth += 1
+        try:
+            yield self
+        finally:
+            self._primary_depth -= 1
+
+    @primary_reads
     def build_minimal_platform(self, platform_name, observation_list):
         name_parts = platform_name.split('.')
         org_id = self.organizationExists(name_parts[0])
         row_entry_date = datetime.now()
         if org_id is None:
-            self.logger.debug("Adding organization name: %s" % (name_parts[0]))
+            self.logger.debug("Adding organization name: %s", name_parts[0])
             org_id = self.addOrganization(row_entry_date, name_parts[0])
 
         if self.platformExists(platform_name) is None:
-            self.logger.debug("Adding platform handle: %s" % (platform_name))
+            self.logger.debug("Adding platform handle: %s", platform_name)
             plat_rec = platform(row_entry_date=row_entry_date,
                                 organization_id=org_id,
                                 platform_handle=platform_name,
@@ -77,7 +329,12 @@ class xeniaAlchemy(object):
         for obs_info in observation_list:
 
             self.logger.debug(
-                "Platform: %s adding sensor: %s(%s)" % (platform_name, obs_info['obs_name'], obs_info['uom_name']))
+                "Platform: %s adding sensor: %s(%s)", platform_name, obs_info['obs_name'], obs_info['uom_name'])
+            # obs_name and uom joined by component_names() describe a multi-value sensor.
+            components = split_component_names(obs_info['obs_name'], obs_info['uom_name'])
+            if len(components) > 1:
+                self._build_vector_sensor(platform_name, components, obs_info, row_entry_date)
+                continue
             try:
                 if self.addNewSensor(obs_info['obs_name'], obs_info['uom_name'],
                                      platform_name,
@@ -91,14 +348,28 @@ class xeniaAlchemy(object):
             except Exception as e:
                 self.logger.exception(e)
 
+    def _build_vector_sensor(self, platform_name, components, obs_info, row_entry_date):
+        # The sensor is named after its components unless obs_info gives its short_name.
+        sensor_name = obs_info.get('sensor_name') or obs_info['obs_name']
+        if self.vectorSensorExists(sensor_name, platform_name, obs_info['s_order']) is not None:
+            return
+        platform_id = self.platformExists(platform_name)
+        if platform_id is None or self.newVectorSensor(row_entry_date, sensor_name, components, platform_id,
+                                                       sOrder=obs_info['s_order'], addObsAndUOM=True) is None:
+            self.logger.error("Error platform: %s multi-value sensor: %s(%s) not added" % (
+                platform_name, obs_info['obs_name'], obs_info['uom_name']))
+
     """
     Function: platformExists  
     """
 
 
+    @timed
+    @replica_reads
     def platformExists(self, platformHandle):
+        session = self.read_session()
         try:
-            platRec = self.session.query(platform.row_id) \
+            platRec = session.query(platform.row_id) \
                 .filter(platform.platform_handle == platformHandle) \
                 .one()
             return platRec.row_id
@@ -136,13 +407,15 @@ class xeniaAlchemy(object):
     """
 
 
+    @timed
+    @primary_reads
     def newPlatform(self, rowEntryDate, platformHandle, fixedLongitude, fixedLatitude, active=1, url="", description=""):
         platformRec = None
         platformHandleParts = platformHandle.split('.')
         # Check to make sure the organization exists:
         orgId = self.organizationExists(platformHandleParts[0])
         if orgId is None:
-            self.logger.debug("Organization: %s does not exist. Adding." % (platformHandleParts[0]))
+            self.logger.debug("Organization: %s does not exist. Adding.", platformHandleParts[0])
             orgId = self.addOrganization(rowEntryDate, platformHandleParts[0])
             if orgId is None:
                 self.logger.error("Could not add organization, cannot continue adding platform.")
@@ -166,7 +439,7 @@ class xeniaAlchemy(object):
                                    description=description)
 
             self.addRec(platformRec, True)
-            self.logger.debug("Platform: %s(%d) added to database." % (platformRec.platform_handle, platformRec.row_id))
+            self.logger.debug("Platform: %s(%d) added to database.", platformRec.platform_handle, platformRec.row_id)
         except Exception as e:
             self.logger.exception(e)
 
@@ -178,6 +451,7 @@ class xeniaAlchemy(object):
     """
 
 
+    @timed
     def addOrganization(self, rowEntryDate, organizationName, active=1, longName="", description="", url=""):
         orgRec = organization(row_entry_date=rowEntryDate,
                               short_name=organizationName,
@@ -194,9 +468,12 @@ class xeniaAlchemy(object):
     """
 
 
+    @timed
+    @replica_reads
     def organizationExists(self, organizationName):
+        session = self.read_session()
         try:
-            orgRec = self.session.query(organization.row_id) \
+            orgRec = session.query(organization.row_id) \
                 .filter(organization.short_name == organizationName) \
                 .one()
             return orgRec.row_id
@@ -220,10 +497,13 @@ class xeniaAlchemy(object):
     """
 
 
+    @timed
+    @replica_reads
     def sensorExists(self, obsName, uom, platformHandle, sOrder=1):
+        session = self.read_session()
         try:
 
-            rec = self.session.query(sensor.row_id) \
+            rec = session.query(sensor.row_id) \
                 .join(platform, platform.row_id == sensor.platform_id) \
                 .join(m_type, m_type.row_id == sensor.m_type_id) \
                 .join(m_scalar_type, m_scalar_type.row_id == m_type.m_scalar_type_id) \
@@ -232,7 +512,8 @@ class xeniaAlchemy(object):
                 .filter(sensor.s_order == sOrder) \
                 .filter(platform.platform_handle == platformHandle) \
                 .filter(obs_type.standard_name == obsName) \
-                .filter(uom_type.standard_name == uom).one()
+                .filter(uom_type.standard_name == uom) \
+                .filter(scalar_m_types()).one()
             return rec.row_id
         except NoResultFound as e:
             self.logger.debug(e)
@@ -242,9 +523,11 @@ class xeniaAlchemy(object):
         return None
 
 
+    @timed
+    @primary_reads
     def newSensor(self, rowEntryDate, obsName, uom, platformId, active=1, fixedZ=0, sOrder=1, mTypeId=None,
                   addObsAndUOM=False):
-        self.logger.debug("Adding sensor: %s(%s) sOrder: %d on platform: %d" % (obsName, uom, sOrder, platformId))
+        self.logger.debug("Adding sensor: %s(%s) sOrder: %d on platform: %d", obsName, uom, sOrder, platformId)
         sensorId = None
         if mTypeId is None:
             mTypeId = self.mTypeExists(obsName, uom)
@@ -252,29 +535,9 @@ class xeniaAlchemy(object):
                 # If we want to add the obs type and uom type, we have to add them to add to tables: obs_type, uom_type, m_scalar_type
                 # before we can add the m_type.
                 if addObsAndUOM:
-                    # Does obs_type exist? If not, we attempt to add.
-                    obsId = self.obsTypeExists(obsName)
-                    if obsId is None:
-                        # Add the obs to the obs_type table.
-                        obsId = self.addObsType(obsName)
-                        # Cannot continue if we were unable to add.
-                        if obsId is None:
-                            return None
-
-                    # Does the uom type exist? If not, we attempt to add.
-                    uomId = self.uomTypeExists(uom)
-                    if uomId is None:
-                        uomId = self.addUOMType(uom)
-                        # Cannot continue if we were unable to add.
-                        if uomId is None:
-                            return None
-
-                    # Does the scalar_id exist?
-                    mScalarId = self.scalarTypeExists(obsId, uomId)
+                    mScalarId = self._scalar_type_id(obsName, uom, True)
                     if mScalarId is None:
-                        mScalarId = self.addScalarType(obsId, uomId)
-                        if mScalarId is None:
-                            return None
+                        return None
 
                     # Now we can add the m_type
                     mTypeId = self.addMType(mScalarId)
@@ -297,7 +560,169 @@ class xeniaAlchemy(object):
                   self.logger.error("Unable to add sensor: %s(%s)." % (obsName, uom))
             else:
                   self.logger.debug(
-                      "Added sensor: %s(%s) sOrder: %d on platform: %d" % (obsName, uom, sOrder, platformId))
+                      "Added sensor: %s(%s) sOrder: %d on platform: %d", obsName, uom, sOrder, platformId)
+        return sensorId
+
+
+    def _scalar_type_id(self, obsName, uom, addObsAndUOM):
+        """
+        The m_scalar_type row_id of obsName(uom), the obs_type, uom_type and m_scalar_type rows are added if they
+        don't exist and addObsAndUOM is True. None if it doesn't exist or couldn't be added.
+        """
+        # Does obs_type exist? If not, we attempt to add.
+        obsId = self.obsTypeExists(obsName)
+        if obsId is None:
+            if not addObsAndUOM:
+                return None
+            # Add the obs to the obs_type table.
+            obsId = self.addObsType(obsName)
+            # Cannot continue if we were unable to add.
+            if obsId is None:
+                return None
+
+        # Does the uom type exist? If not, we attempt to add.
+        uomId = self.uomTypeExists(uom)
+        if uomId is None:
+            if not addObsAndUOM:
+                return None
+            uomId = self.addUOMType(uom)
+            # Cannot continue if we were unable to add.
+            if uomId is None:
+                return None
+
+        # Does the scalar_id exist?
+        mScalarId = self.scalarTypeExists(obsId, uomId)
+        if mScalarId is None and addObsAndUOM:
+            mScalarId = self.addScalarType(obsId, uomId)
+        return mScalarId
+
+
+    """
+    Function: vectorMTypeExists
+    Purpose: Checks to see if a multi-value m_type with the given components, in order, exists.
+    Parameters:
+      components is a list of (obsName, uom) tuples, at most 8.
+    Returns:
+      The m_type id(row_id) if it exists, or None if it does not exist or an error occured.
+    """
+
+
+    @timed
+    @replica_reads
+    def vectorMTypeExists(self, components):
+        scalarIds = []
+        for obsName, uom in components:
+            mScalarId = self._scalar_type_id(obsName, uom, False)
+            if mScalarId is None:
+                self.logger.debug("m_scalar_type %s(%s) does not exist.", obsName, uom)
+                return None
+            scalarIds.append(mScalarId)
+        return self._vector_m_type_id(scalarIds)
+
+    def _vector_m_type_id(self, scalarIds):
+        session = self.read_session()
+        try:
+            query = session.query(m_type.row_id).filter(m_type.num_types == len(scalarIds))
+            for ndx, column_name in enumerate(M_TYPE_SCALAR_COLUMNS):
+                scalar_column = getattr(m_type, column_name)
+                if ndx < len(scalarIds):
+                    query = query.filter(scalar_column == scalarIds[ndx])
+                else:
+                    query = query.filter(scalar_column.is_(None))
+            rec = query.order_by(m_type.row_id).first()
+            if rec is not None:
+                return rec.row_id
+        except exc.SQLAlchemyError as e:
+            session.rollback()
+            self.logger.exception(e)
+        return None
+
+
+    """
+    Function: vectorSensorExists
+    Purpose: Checks to see if the multi-value sensor sensorName is on the platform.
+    Parameters:
+      sensorName is the sensor short_name given to newVectorSensor.
+      platformHandle is the platform on which we search for the sensor.
+      sOrder, if provided specifies the specific sensor if there are multiples of the same on a platform.
+    Returns:
+      The sensor id(row_id) if it exists, or None if it does not exist or an error occured.
+    """
+
+
+    @timed
+    @replica_reads
+    def vectorSensorExists(self, sensorName, platformHandle, sOrder=1):
+        session = self.read_session()
+        try:
+            rec = session.query(sensor.row_id) \
+                .join(platform, platform.row_id == sensor.platform_id) \
+                .join(m_type, m_type.row_id == sensor.m_type_id) \
+                .filter(sensor.s_order == sOrder) \
+                .filter(platform.platform_handle == platformHandle) \
+                .filter(sensor.short_name == sensorName) \
+                .filter(m_type.num_types > 1).one()
+            return rec.row_id
+        except NoResultFound as e:
+            self.logger.debug(e)
+        except exc.InvalidRequestError as e:
+            self.logger.exception(e)
+        return None
+
+
+    """
+    Function: newVectorSensor
+    Purpose: Adds a multi-value sensor, such as wind u/v or a current vector, whose observations are stored in
+    one multi_obs row with a value per component in m_value..m_value_8. The multi-value m_type is added if it
+    doesn't exist.
+    Parameters:
+      rowEntryDate is the entry date for the new rows.
+      sensorName is the sensor short_name, also used as the description of a new m_type.
+      components is a list of (obsName, uom) tuples, at most 8, in the order the values are stored.
+      platformId is the platform row_id.
+      addObsAndUOM, if True, adds the obs_type, uom_type and m_scalar_type rows of the components that don't exist.
+    Returns:
+      The sensor id(row_id), or None if an error occured.
+    """
+
+
+    @timed
+    @primary_reads
+    def newVectorSensor(self, rowEntryDate, sensorName, components, platformId, active=1, fixedZ=0, sOrder=1,
+                        addObsAndUOM=False):
+        if not 1 < len(components) <= len(M_TYPE_SCALAR_COLUMNS):
+            self.logger.error("A multi-value sensor needs 2 to %d components, got: %d" % (
+                len(M_TYPE_SCALAR_COLUMNS), len(components)))
+            return None
+        self.logger.debug("Adding multi-value sensor: %s %s sOrder: %d on platform: %d", sensorName, components,
+                          sOrder, platformId)
+        scalarIds = []
+        for obsName, uom in components:
+            mScalarId = self._scalar_type_id(obsName, uom, addObsAndUOM)
+            if mScalarId is None:
+                self.logger.error("m_scalar_type does not exist, cannot add sensor: %s component: %s(%s) platform: %d"
+                                  % (sensorName, obsName, uom, platformId))
+                return None
+            scalarIds.append(mScalarId)
+        mTypeId = self._vector_m_type_id(scalarIds)
+        if mTypeId is None:
+            mTypeId = self.addMType(scalarIds, sensorName)
+            if mTypeId is None:
+                return None
+
+        sensorRec = sensor(row_entry_date=rowEntryDate,
+                           platform_id=platformId,
+                           m_type_id=mTypeId,
+                           short_name=sensorName,
+                           fixed_z=fixedZ,
+                           active=active,
+                           s_order=sOrder)
+        sensorId = self.addRec(sensorRec, True)
+        if sensorId is None:
+            self.logger.error("Unable to add sensor: %s." % (sensorName))
+        else:
+            self.logger.debug("Added multi-value sensor: %s sOrder: %d on platform: %d", sensorName, sOrder,
+                              platformId)
         return sensorId
 
 
@@ -312,17 +737,21 @@ class xeniaAlchemy(object):
     """
 
 
+    @timed
+    @replica_reads
     def mTypeExists(self, obsName, uom):
+        session = self.read_session()
         try:
-            rec = self.session.query(m_type.row_id) \
+            rec = session.query(m_type.row_id) \
                 .join(m_scalar_type, m_scalar_type.row_id == m_type.m_scalar_type_id) \
                 .join(obs_type, obs_type.row_id == m_scalar_type.obs_type_id) \
                 .join(uom_type, uom_type.row_id == m_scalar_type.uom_type_id) \
                 .filter(obs_type.standard_name == obsName) \
-                .filter(uom_type.standard_name == uom).one()
+                .filter(uom_type.standard_name == uom) \
+                .filter(scalar_m_types()).one()
             return rec.row_id
         except NoResultFound:
-            self.logger.debug("m_type %s(%s) does not exist." % (obsName, uom))
+            self.logger.debug("m_type %s(%s) does not exist.", obsName, uom)
         except exc.InvalidRequestError as e:
             self.logger.exception(e)
 
@@ -335,13 +764,15 @@ class xeniaAlchemy(object):
     "user friendly" since it requires knowledge of the obs type id and uom type id. Most likely you wouldn't call this directly
     but would be using the addSensor function to do it automagically.
     Parameters: 
-      scalarID is the row_id of the scalar_type to add.
+      scalarID is the row_id of the scalar_type to add, or a list of up to 8 row_ids for a multi-value m_type whose
+      components are stored in m_value..m_value_8 in the same order.
     Returns:
       The m_type_id(row_id) if it exists, -1 if it does not exists, or None if an error occured. If there was an error
       lastErrorMsg can be checked for the error message.
     """
 
 
+    @timed
     def addMType(self, scalarID, description=""):
         rowId = None
         # At the moment the row_id columns are not autoincrement, so we need to get the max value first.
@@ -352,14 +783,20 @@ class xeniaAlchemy(object):
             if (self.logger):
                 self.logger.exception(e)
         else:
-            mTypeRec = m_type(row_id=nextRowId, num_types=1, m_scalar_type_id=scalarID, description=description)
+            scalarIds = list(scalarID) if isinstance(scalarID, (list, tuple)) else [scalarID]
+            if not 0 < len(scalarIds) <= len(M_TYPE_SCALAR_COLUMNS):
+                self.logger.error("An m_type has 1 to %d scalar types, got: %d" % (len(M_TYPE_SCALAR_COLUMNS),
+                                                                                  len(scalarIds)))
+                return None
+            mTypeRec = m_type(row_id=nextRowId, num_types=len(scalarIds), description=description,
+                              **dict(zip(M_TYPE_SCALAR_COLUMNS, scalarIds)))
             rowId = self.addRec(mTypeRec, True)
             if (rowId is None):
                 if (self.logger):
-                    self.logger.error("Unable to add scalarID: %d to m_type table." % (scalarID))
+                    self.logger.error("Unable to add scalarID: %s to m_type table." % (scalarID))
             else:
                 if (self.logger):
-                    self.logger.debug("Added scalarID: %d to m_type table." % (scalarID))
+                    self.logger.debug("Added scalarID: %s to m_type table.", scalarID)
         return rowId
 
 
@@ -374,15 +811,18 @@ class xeniaAlchemy(object):
     """
 
 
+    @timed
+    @replica_reads
     def obsTypeExists(self, obsName):
+        session = self.read_session()
         rowId = None
         try:
-            rec = self.session.query(obs_type.row_id) \
+            rec = session.query(obs_type.row_id) \
                 .filter(obs_type.standard_name == obsName) \
                 .one()
             rowId = rec.row_id
         except NoResultFound:
-            self.logger.debug("Observation: %s does not exist in obs_type table." % (obsName))
+            self.logger.debug("Observation: %s does not exist in obs_type table.", obsName)
         except exc.InvalidRequestError as e:
             self.logger.exception(e)
 
@@ -399,6 +839,7 @@ class xeniaAlchemy(object):
     """
 
 
+    @timed
     def addObsType(self, obsName):
         rowId = None
         # At the moment the row_id columns are not autoincrement, so we need to get the max value first.
@@ -416,7 +857,7 @@ class xeniaAlchemy(object):
                     self.logger.error("Unable to add obs: %s to obs_type table." % (obsName))
             else:
                 if (self.logger):
-                    self.logger.debug("Added obs: %s to obs_type table." % (obsName))
+                    self.logger.debug("Added obs: %s to obs_type table.", obsName)
         return rowId
 
 
@@ -431,15 +872,18 @@ class xeniaAlchemy(object):
     """
 
 
+    @timed
+    @replica_reads
     def uomTypeExists(self, uomName):
+        session = self.read_session()
         rowId = None
         try:
-            rec = self.session.query(uom_type.row_id) \
+            rec = session.query(uom_type.row_id) \
                 .filter(uom_type.standard_name == uomName) \
                 .one()
             rowId = rec.row_id
         except NoResultFound:
-            self.logger.debug("UOM: %s does not exist in obs_type table." % (uomName))
+            self.logger.debug("UOM: %s does not exist in obs_type table.", uomName)
         except exc.InvalidRequestError as e:
             self.logger.exception(e)
         return rowId
@@ -455,6 +899,7 @@ class xeniaAlchemy(object):
     """
 
 
+    @timed
     def addUOMType(self, uomName):
         rowId = None
         # At the moment the row_id columns are not autoincrement, so we need to get the max value first.
@@ -472,7 +917,7 @@ class xeniaAlchemy(object):
                     self.logger.error("Unable to add uom: %s to uom_type table." % (uomName))
             else:
                 if (self.logger):
-                    self.logger.debug("Added uom: %s to obs_type table." % (uomName))
+                    self.logger.debug("Added uom: %s to obs_type table.", uomName)
         return rowId
 
 
@@ -490,18 +935,21 @@ class xeniaAlchemy(object):
     """
 
 
+    @timed
+    @replica_reads
     def scalarTypeExists(self, obsTypeID, uomTypeID):
+        session = self.read_session()
         rowId = None
         try:
-            rec = self.session.query(m_scalar_type.row_id) \
+            rec = session.query(m_scalar_type.row_id) \
                 .filter(m_scalar_type.obs_type_id == obsTypeID) \
                 .filter(m_scalar_type.uom_type_id == uomTypeID) \
                 .one()
             rowId = rec.row_id
         except NoResultFound:
             self.logger.debug(
-                "Scalar type for obs_type_id: %d uom_type_id: %d does not exist in m_scalar_type table." % (
-                obsTypeID, uomTypeID))
+                "Scalar type for obs_type_id: %d uom_type_id: %d does not exist in m_scalar_type table.",
+                obsTypeID, uomTypeID)
         except exc.InvalidRequestError as e:
             self.logger.exception(e)
         return rowId
@@ -521,6 +969,7 @@ class xeniaAlchemy(object):
     """
 
 
+    @timed
     def addScalarType(self, obsTypeID, uomTypeID):
         rowId = None
         # At the moment the row_id columns are not autoincrement, so we need to get the max value first.
@@ -540,39 +989,240 @@ class xeniaAlchemy(object):
                         obsTypeID, uomTypeID))
             else:
                 if (self.logger):
-                    self.logger.debug("Added m_scalar_type: obs_type_id: %d  uom_type_id: %d to m_scalar_type table." % (
-                    obsTypeID, uomTypeID))
+                    self.logger.debug("Added m_scalar_type: obs_type_id: %d  uom_type_id: %d to m_scalar_type table.",
+                                      obsTypeID, uomTypeID)
         return rowId
 
 
+    @timed
+    @replica_reads
     def getCurrentPlatformStatus(self, platformHandle):
+        session = self.read_session()
         try:
-            rec = self.session.query(sensor_status.status) \
-                .filter(platform_status.platform_handle == platformHandle).one()
+            rec = session.query(platform_status.status) \
+                .join(platform, platform.row_id == platform_status.platform_id) \
+                .filter(platform.platform_handle == platformHandle) \
+                .filter(self._current_status(platform_status, datetime.now())) \
+                .order_by(platform_status.begin_date.desc().nulls_last(), platform_status.row_id.desc()) \
+                .limit(1).one()
             return rec.status
         except NoResultFound as e:
             self.logger.debug(e)
-        except exc.InvalidRequestError as e:
+        except exc.SQLAlchemyError as e:
+            session.rollback()
             self.logger.exception(e)
         return None
 
 
+    @timed
+    @replica_reads
     def getCurrentSensorStatus(self, obsName, platformHandle):
+        session = self.read_session()
         try:
-            rec = self.session.query(platform_status.status) \
+            rec = session.query(sensor_status.status) \
+                .join(platform, platform.row_id == sensor_status.platform_id) \
                 .filter(platform.platform_handle == platformHandle) \
-                .filter(sensor_status.sensor_name == obsName).one()
+                .filter(sensor_status.sensor_name == obsName) \
+                .filter(self._current_status(sensor_status, datetime.now())) \
+                .order_by(sensor_status.begin_date.desc().nulls_last(), sensor_status.row_id.desc()) \
+                .limit(1).one()
             return rec.status
         except NoResultFound as e:
             self.logger.debug(e)
-        except exc.InvalidRequestError as e:
+        except exc.SQLAlchemyError as e:
+            session.rollback()
+            self.logger.exception(e)
+        return None
+
+    @staticmethod
+    def _current_status(status_table, at):
+        """
+        A status row is current at a date if it has begun, or has no begin_date, and hasn't ended.
+        """
+        return and_(or_(status_table.begin_date.is_(None), status_table.begin_date <= at),
+                    or_(status_table.end_date.is_(None), status_table.end_date > at))
+
+    """
+    Function: get_current_platform_statuses
+    Purpose: The current status of many platforms in one query, the latest current platform_status row of each
+    platform by begin_date.
+    Parameters:
+      platform_handles, if given, limits the result to those platforms, otherwise every platform with a
+      current status is returned.
+      at, if given, is the date the statuses are current at, the default is now.
+    Returns:
+      A dictionary keyed on platform_handle of rows with platform_id, platform_handle, status, begin_date,
+      expected_end_date, end_date, reason and author, or None if an error occured.
+    """
+
+
+    @timed
+    @replica_reads
+    def get_current_platform_statuses(self, platform_handles=None, at=None):
+        session = self.read_session()
+        try:
+            rank = func.row_number().over(partition_by=platform_status.platform_id,
+                                          order_by=(platform_status.begin_date.desc().nulls_last(),
+                                                    platform_status.row_id.desc()))
+            ranked = select(platform_status.platform_id, platform.platform_handle, platform_status.status,
+                            platform_status.begin_date, platform_status.expected_end_date,
+                            platform_status.end_date, platform_status.reason, platform_status.author,
+                            rank.label('status_rank')) \
+                .join(platform, platform.row_id == platform_status.platform_id) \
+                .where(self._current_status(platform_status, at or datetime.now()))
+            if platform_handles is not None:
+                ranked = ranked.where(platform.platform_handle.in_(platform_handles))
+            ranked = ranked.subquery()
+            rows = session.execute(select(*[col for col in ranked.c if col.name != 'status_rank'])
+                                   .where(ranked.c.status_rank == 1)).all()
+            return {row.platform_handle: row for row in rows}
+        except exc.SQLAlchemyError as e:
+            session.rollback()
+            self.logger.exception(e)
+        return None
+
+    """
+    Function: get_current_sensor_statuses
+    Purpose: The current status of many sensors in one query, the latest current sensor_status row of each
+    sensor by begin_date.
+    Parameters:
+      platform_handles, if given, limits the result to the sensors on those platforms.
+      sensor_ids, if given, limits the result to those sensors.
+      at, if given, is the date the statuses are current at, the default is now.
+    Returns:
+      A dictionary keyed on sensor_id of rows with sensor_id, sensor_name, platform_id, platform_handle, status,
+      begin_date, expected_end_date, end_date, reason and author, or None if an error occured.
+    """
+
+
+    @timed
+    @replica_reads
+    def get_current_sensor_statuses(self, platform_handles=None, sensor_ids=None, at=None):
+        session = self.read_session()
+        try:
+            rank = func.row_number().over(partition_by=sensor_status.sensor_id,
+                                          order_by=(sensor_status.begin_date.desc().nulls_last(),
+                                                    sensor_status.row_id.desc()))
+            ranked = select(sensor_status.sensor_id, sensor_status.sensor_name, sensor.platform_id,
+                            platform.platform_handle, sensor_status.status, sensor_status.begin_date,
+                            sensor_status.expected_end_date, sensor_status.end_date, sensor_status.reason,
+                            sensor_status.author, rank.label('status_rank')) \
+                .join(sensor, sensor.row_id == sensor_status.sensor_id) \
+                .join(platform, platform.row_id == sensor.platform_id) \
+                .where(self._current_status(sensor_status, at or datetime.now()))
+            if platform_handles is not None:
+                ranked = ranked.where(platform.platform_handle.in_(platform_handles))
+            if sensor_ids is not None:
+                ranked = ranked.where(sensor_status.sensor_id.in_(sensor_ids))
+            ranked = ranked.subquery()
+            rows = session.execute(select(*[col for col in ranked.c if col.name != 'status_rank'])
+                                   .where(ranked.c.status_rank == 1)).all()
+            return {row.sensor_id: row for row in rows}
+        except exc.SQLAlchemyError as e:
+            session.rollback()
+            self.logger.exception(e)
+        return None
+
+    """
+    Function: get_platform_status_history
+    Purpose: Every platform_status row overlapping a time window.
+    Parameters:
+      platform_handles is a list of platform handles.
+      start_date, end_date bound the window, a row without an end_date is still open.
+    Returns:
+      A list of platform_status rows with the platform_handle, ordered by platform_handle and begin_date, or None
+      if an error occured.
+    """
+
+
+    @timed
+    @replica_reads
+    def get_platform_status_history(self, platform_handles, start_date, end_date):
+        session = self.read_session()
+        try:
+            return session.query(platform.platform_handle, platform_status.status, platform_status.begin_date,
+                                 platform_status.expected_end_date, platform_status.end_date,
+                                 platform_status.reason, platform_status.author) \
+                .join(platform, platform.row_id == platform_status.platform_id) \
+                .filter(platform.platform_handle.in_(platform_handles)) \
+                .filter(or_(platform_status.begin_date.is_(None), platform_status.begin_date < end_date)) \
+                .filter(or_(platform_status.end_date.is_(None), platform_status.end_date >= start_date)) \
+                .order_by(platform.platform_handle, platform_status.begin_date, platform_status.row_id) \
+                .all()
+        except exc.SQLAlchemyError as e:
+            session.rollback()
+            self.logger.exception(e)
+        return None
+
+    """
+    Function: get_sensor_status_history
+    Purpose: Every sensor_status row overlapping a time window.
+    Parameters:
+      sensor_ids is a list of sensor row_ids.
+      start_date, end_date bound the window, a row without an end_date is still open.
+    Returns:
+      A list of sensor_status rows ordered by sensor_id and begin_date, or None if an error occured.
+    """
+
+
+    @timed
+    @replica_reads
+    def get_sensor_status_history(self, sensor_ids, start_date, end_date):
+        session = self.read_session()
+        try:
+            return session.query(sensor_status.sensor_id, sensor_status.sensor_name, sensor_status.status,
+                                 sensor_status.begin_date, sensor_status.expected_end_date, sensor_status.end_date,
+                                 sensor_status.reason, sensor_status.author) \
+                .filter(sensor_status.sensor_id.in_(sensor_ids)) \
+                .filter(or_(sensor_status.begin_date.is_(None), sensor_status.begin_date < end_date)) \
+                .filter(or_(sensor_status.end_date.is_(None), sensor_status.end_date >= start_date)) \
+                .order_by(sensor_status.sensor_id, sensor_status.begin_date, sensor_status.row_id) \
+                .all()
+        except exc.SQLAlchemyError as e:
+            session.rollback()
+            self.logger.exception(e)
+        return None
+
+    """
+    Function: get_status_fingerprint
+    Purpose: A cheap summary of platform_status and sensor_status that changes whenever a row is added or
+    updated(through row_update_date), for caches of the current statuses.
+    Parameters:
+      at, if given, is the date the next scheduled change is looked for after, the default is now.
+    Returns:
+      A tuple of (fingerprint, next_change) where next_change is the earliest begin_date or end_date after at,
+      when the current statuses change without any row changing, or None. None if an error occured.
+    """
+
+
+    @timed
+    def get_status_fingerprint(self, at=None):
+        at = at or datetime.now()
+        try:
+            fingerprint = []
+            next_changes = []
+            # A connection of its own, so the read neither commits nor rolls back work pending on self.session.
+            with self.dbEngine.connect() as connection:
+                for status_table in (platform_status, sensor_status):
+                    rec = connection.execute(select(func.max(status_table.row_id), func.count(status_table.row_id),
+                                                    func.max(status_table.row_update_date))).one()
+                    fingerprint.extend((rec[0], rec[1], str(rec[2]) if rec[2] is not None else None))
+                    for date_column in (status_table.begin_date, status_table.end_date):
+                        next_changes.append(connection.execute(select(func.min(date_column))
+                                                               .where(date_column > at)).scalar())
+            next_changes = [date for date in next_changes if date is not None]
+            return tuple(fingerprint), min(next_changes, default=None)
+        except exc.SQLAlchemyError as e:
             self.logger.exception(e)
         return None
 
 
+    @timed
+    @replica_reads
     def platformTypeExists(self, platformType):
+        session = self.read_session()
         try:
-            platRec = self.session.query(platform_type.row_id) \
+            platRec = session.query(platform_type.row_id) \
                 .filter(platform_type.type_name == platformType) \
                 .one()
             return platRec.row_id
@@ -583,6 +1233,7 @@ class xeniaAlchemy(object):
         return None
 
 
+    @timed
     def addPlatformType(self, typeName, description="", commit=False):
         platType = None
         try:
@@ -597,6 +1248,7 @@ class xeniaAlchemy(object):
         return platType
 
 
+    @timed
     def addRec(self, rec, commit=False):
         try:
             self.session.add(rec)
@@ -609,6 +1261,7 @@ class xeniaAlchemy(object):
         return rec.row_id
 
 
+    @timed
     def add_or_update_record(self, rec, update_if_exists=True, commit=False):
         row_id = None
         try:
@@ -647,6 +1300,580 @@ class xeniaAlchemy(object):
     def addSensor(self, sensorRec, commit=False):
         return self.addRec(sensorRec, commit)
 
+
+    def _point_expression(self, lon, lat):
+        if self._spatialite is None:
+            self._spatialite = has_spatialite(self.session.connection())
+        return point_expression(self.dbEngine.dialect.name, lon, lat, spatialite=self._spatialite)
+
+
+    def _set_new_geometry(self, session, flush_context, instances):
+        for rec in session.new:
+            if isinstance(rec, platform):
+                lon, lat = rec.fixed_longitude, rec.fixed_latitude
+            elif isinstance(rec, multi_obs):
+                lon, lat = rec.m_lon, rec.m_lat
+            else:
+                continue
+            if rec.the_geom is None and lon is not None and lat is not None:
+                rec.the_geom = self._point_expression(literal(lon, Float), literal(lat, Float))
+
+
+    """
+    Function: add_multi_obs_bulk
+    Purpose: Inserts a batch of observations with a single executemany INSERT instead of adding ORM objects
+    to the session one at a time. the_geom is computed by the database from m_lon/m_lat in the same INSERT:
+    ST_SetSRID(ST_MakePoint()) on PostgreSQL, MakePoint() on SpatiaLite, EWKT text on plain SQLite.
+    Parameters:
+      records is an iterable of multi_obs objects or dictionaries keyed on multi_obs column names. A dictionary
+      can give the values of a multi-value observation as an m_values sequence.
+      commit, if True, commits the batch.
+    Returns:
+      The number of records inserted. On an IntegrityError the batch is rolled back and the error re-raised
+      so the caller can decide how to handle the individual records.
+    """
+
+
+    @timed
+    def add_multi_obs_bulk(self, records, commit=True):
+        rows = []
+        for rec in records:
+            if isinstance(rec, dict):
+                row = {column: rec.get(column) for column in MULTI_OBS_BULK_COLUMNS}
+                # A multi-value observation can give its values as a sequence instead of m_value..m_value_8.
+                if 'm_values' in rec:
+                    row.update(vector_values(rec['m_values']))
+            else:
+                row = {column: getattr(rec, column) for column in MULTI_OBS_BULK_COLUMNS}
+            row['geom_lon'] = row['m_lon']
+            row['geom_lat'] = row['m_lat']
+            rows.append(row)
+        if not rows:
+            return 0
+
+        stmt = insert(multi_obs.__table__).values(
+            the_geom=self._point_expression(bindparam('geom_lon', type_=Float), bindparam('geom_lat', type_=Float)))
+        try:
+            self.session.execute(stmt, rows)
+            if commit:
+                self.session.commit()
+        except exc.IntegrityError:
+            self.session.rollback()
+            raise
+        if self.metrics is not None:
+            self.metrics.add_rows_written(len(rows))
+        return len(rows)
+
+
+    """
+    Function: add_multi_obs_array_bulk
+    Purpose: Inserts a batch of array valued observations(profiles, spectra) into multi_obs_array with a single
+    executemany INSERT, one row per sensor and m_date instead of a multi_obs row per bin.
+    Parameters:
+      records is an iterable of multi_obs_array objects or dictionaries keyed on multi_obs_array column names.
+      num_values defaults to the length of m_values and row_entry_date to now.
+      commit, if True, commits the batch.
+    Returns:
+      The number of records inserted. On an IntegrityError, a sensor_id and m_date already stored, the batch is
+      rolled back and the error re-raised.
+    """
+
+
+    @timed
+    def add_multi_obs_array_bulk(self, records, commit=True):
+        row_entry_date = datetime.now()
+        rows = []
+        for rec in records:
+            if isinstance(rec, dict):
+                row = {column: rec.get(column) for column in MULTI_OBS_ARRAY_COLUMNS}
+            else:
+                row = {column: getattr(rec, column) for column in MULTI_OBS_ARRAY_COLUMNS}
+            if row['num_values'] is None:
+                row['num_values'] = len(row['m_values'])
+            if row['row_entry_date'] is None:
+                row['row_entry_date'] = row_entry_date
+            rows.append(row)
+        if not rows:
+            return 0
+        try:
+            self.session.execute(insert(multi_obs_array.__table__), rows)
+            if commit:
+                self.session.commit()
+        except exc.IntegrityError:
+            self.session.rollback()
+            raise
+        if self.metrics is not None:
+            self.metrics.add_rows_written(len(rows))
+        return len(rows)
+
+
+    """
+    Function: update_missing_geometry
+    Purpose: Deferred, batched population of the_geom for platform rows(from fixed_longitude/fixed_latitude)
+    and multi_obs rows(from m_lon/m_lat) that have coordinates but no geometry. Each batch is a single
+    set-wise UPDATE over a row_id range and is committed on its own, so the job can be interrupted and rerun.
+    Parameters:
+      batch_size is the row_id range covered by each UPDATE.
+    Returns:
+      The number of rows updated.
+    """
+
+
+    @timed
+    def update_missing_geometry(self, batch_size=50000):
+        updated_count = 0
+        for table, lon_column, lat_column in ((platform.__table__, platform.fixed_longitude, platform.fixed_latitude),
+                                              (multi_obs.__table__, multi_obs.m_lon, multi_obs.m_lat)):
+            missing_geom = (table.c.the_geom.is_(None), lon_column.isnot(None), lat_column.isnot(None))
+            min_row_id, max_row_id = self.session.query(func.min(table.c.row_id), func.max(table.c.row_id)) \
+                .filter(*missing_geom).one()
+            if min_row_id is None:
+                continue
+            start_row_id = min_row_id
+            while start_row_id <= max_row_id:
+                stmt = update(table) \
+                    .where(table.c.row_id >= start_row_id) \
+                    .where(table.c.row_id < start_row_id + batch_size) \
+                    .where(*missing_geom) \
+                    .values(the_geom=self._point_expression(lon_column, lat_column))
+                try:
+                    result = self.session.execute(stmt)
+                    self.session.commit()
+                except exc.SQLAlchemyError as e:
+                    self.session.rollback()
+                    self.logger.exception(e)
+                    return updated_count
+                updated_count += result.rowcount
+                start_row_id += batch_size
+            self.logger.debug("Updated the_geom for %d rows in %s.", updated_count, table.name)
+        return updated_count
+
+
+    def _spatialite_index_enabled(self, table_name):
+        if table_name not in self._spatialite_indexes:
+            try:
+                enabled = self.session.execute(
+                    text("SELECT spatial_index_enabled FROM geometry_columns "
+                         "WHERE f_table_name = :table_name AND f_geometry_column = 'the_geom'"),
+                    {'table_name': table_name}).scalar()
+            except exc.OperationalError:
+                enabled = None
+            self._spatialite_indexes[table_name] = bool(enabled)
+        return self._spatialite_indexes[table_name]
+
+
+    def _bbox_filter(self, table, lon_column, lat_column, min_lon, min_lat, max_lon, max_lat):
+        # PostgreSQL uses the GiST index on the_geom through the && operator, SpatiaLite uses its R-tree when the
+        # table has one. Otherwise we fall back to filtering the lon/lat columns.
+        dialect_name = self.dbEngine.dialect.name
+        if dialect_name == 'postgresql':
+            return table.the_geom.intersects(envelope_expression(dialect_name, min_lon, min_lat, max_lon, max_lat))
+        if self._spatialite is None:
+            self._spatialite = has_spatialite(self.session.connection())
+        if self._spatialite and self._spatialite_index_enabled(table.__tablename__):
+            rtree_rows = text("SELECT ROWID FROM SpatialIndex WHERE f_table_name = :rtree_table "
+                              "AND f_geometry_column = 'the_geom' "
+                              "AND search_frame = BuildMbr(:rtree_min_lon, :rtree_min_lat, :rtree_max_lon, :rtree_max_lat)") \
+                .bindparams(rtree_table=table.__tablename__, rtree_min_lon=min_lon, rtree_min_lat=min_lat,
+                            rtree_max_lon=max_lon, rtree_max_lat=max_lat) \
+                .columns(column('ROWID', Integer))
+            return table.row_id.in_(rtree_rows)
+        return lon_column.between(min_lon, max_lon) & lat_column.between(min_lat, max_lat)
+
+
+    """
+    Function: get_platform_locations
+    Purpose: Returns the location of every platform, or only the platforms added or changed since a date.
+    Parameters:
+      changed_since, if provided, only returns platforms whose row_update_date(or row_entry_date if never
+      updated) is at or after it.
+    Returns:
+      A list of rows with row_id, platform_handle, fixed_longitude, fixed_latitude, active and changed_date,
+      or None if an error occured.
+    """
+
+
+    @timed
+    @replica_reads
+    def get_platform_locations(self, changed_since=None):
+        session = self.read_session()
+        changed_date = func.coalesce(platform.row_update_date, platform.row_entry_date)
+        try:
+            query = session.query(*PLATFORM_LOCATION_COLUMNS, platform.active, changed_date.label('changed_date'))
+            if changed_since is not None:
+                query = query.filter(changed_date >= changed_since)
+            return query.all()
+        except exc.SQLAlchemyError as e:
+            session.rollback()
+            self.logger.exception(e)
+        return None
+
+
+    """
+    Function: get_platforms_in_bbox
+    Purpose: Returns the platforms located inside the bounding box.
+    Parameters:
+      min_lon, min_lat, max_lon, max_lat define the bounding box in WGS84 degrees.
+      active_only, if True, only returns platforms with active = 1.
+    Returns:
+      A list of rows with row_id, platform_handle, fixed_longitude and fixed_latitude, or None if an error
+      occured.
+    """
+
+
+    @timed
+    @replica_reads
+    def get_platforms_in_bbox(self, min_lon, min_lat, max_lon, max_lat, active_only=True):
+        session = self.read_session()
+        try:
+            query = session.query(*PLATFORM_LOCATION_COLUMNS) \
+                .filter(self._bbox_filter(platform, platform.fixed_longitude, platform.fixed_latitude,
+                                          min_lon, min_lat, max_lon, max_lat))
+            if active_only:
+                query = query.filter(platform.active == 1)
+            return query.order_by(platform.platform_handle).all()
+        except exc.SQLAlchemyError as e:
+            session.rollback()
+            self.logger.exception(e)
+        return None
+
+
+    """
+    Function: get_nearest_platforms
+    Purpose: Returns the count platforms nearest to the given point.
+    Parameters:
+      lon, lat is the search point in WGS84 degrees.
+      count is the number of platforms to return.
+      active_only, if True, only considers platforms with active = 1.
+    Returns:
+      A list of (row, distance_km) tuples ordered by distance, row having row_id, platform_handle,
+      fixed_longitude and fixed_latitude. None if an error occured.
+    """
+
+
+    @timed
+    @replica_reads
+    def get_nearest_platforms(self, lon, lat, count=5, active_only=True):
+        session = self.read_session()
+        try:
+            query = session.query(*PLATFORM_LOCATION_COLUMNS) \
+                .filter(platform.fixed_longitude.isnot(None)) \
+                .filter(platform.fixed_latitude.isnot(None))
+            if active_only:
+                query = query.filter(platform.active == 1)
+            if self.dbEngine.dialect.name == 'postgresql':
+                # KNN ordering with the <-> operator walks the GiST index. It orders by planar degrees, so take
+                # a few extra candidates and let the great circle distance settle the final order.
+                query = query.filter(platform.the_geom.isnot(None)) \
+                    .order_by(platform.the_geom.distance_centroid(point_expression('postgresql', lon, lat))) \
+                    .limit(count * 4)
+            platforms = [(rec, haversine_km(lon, lat, rec.fixed_longitude, rec.fixed_latitude)) for rec in query]
+            platforms.sort(key=lambda platform_distance: platform_distance[1])
+            return platforms[:count]
+        except exc.SQLAlchemyError as e:
+            session.rollback()
+            self.logger.exception(e)
+        return None
+
+
+    """
+    Function: get_multi_obs
+    Purpose: Time window read of observations for one or more sensors.
+    Parameters:
+      sensor_ids is a list of sensor row_ids.
+      start_date, end_date bound the window, start_date inclusive and end_date exclusive.
+    Returns:
+      A list of rows with the MULTI_OBS_READ_COLUMNS, ordered by sensor_id and m_date, or None if an error
+      occured. With an archive the window's archived rows are included, as
+      xenia_archive.ArchivedObservation tuples with the same fields.
+    """
+
+
+    @timed
+    @replica_reads
+    def get_multi_obs(self, sensor_ids, start_date, end_date):
+        session = self.read_session()
+        try:
+            rows = session.query(*MULTI_OBS_READ_COLUMNS) \
+                .filter(multi_obs.sensor_id.in_(sensor_ids)) \
+                .filter(multi_obs.m_date >= start_date) \
+                .filter(multi_obs.m_date < end_date) \
+                .order_by(multi_obs.sensor_id, multi_obs.m_date) \
+                .all()
+            if self.archive is not None:
+                rows = self.archive.union(rows, sensor_ids, start_date, end_date)
+            return rows
+        except exc.SQLAlchemyError as e:
+            session.rollback()
+            self.logger.exception(e)
+        except (OSError, ValueError) as e:
+            self.logger.exception(e)
+        return None
+
+
+    """
+    Function: get_multi_obs_vectors
+    Purpose: Time window read that returns each observation's values as one tuple, m_value..m_value_8 cut to the
+    number of components of the sensor's m_type, for multi-value sensors such as wind u/v or current vectors.
+    Parameters:
+      sensor_ids is a list of sensor row_ids.
+      start_date, end_date bound the window, start_date inclusive and end_date exclusive.
+    Returns:
+      A list of VectorObservation ordered by sensor_id and m_date, or None if an error occured.
+    """
+
+
+    @timed
+    @replica_reads
+    def get_multi_obs_vectors(self, sensor_ids, start_date, end_date):
+        session = self.read_session()
+        try:
+            value_columns = [getattr(multi_obs, column_name) for column_name in MULTI_OBS_VALUE_COLUMNS]
+            rows = session.query(multi_obs.sensor_id, multi_obs.m_type_id, multi_obs.m_date, m_type.num_types,
+                                 multi_obs.qc_level, multi_obs.qc_flag, *value_columns) \
+                .join(m_type, m_type.row_id == multi_obs.m_type_id) \
+                .filter(multi_obs.sensor_id.in_(sensor_ids)) \
+                .filter(multi_obs.m_date >= start_date) \
+                .filter(multi_obs.m_date < end_date) \
+                .order_by(multi_obs.sensor_id, multi_obs.m_date) \
+                .all()
+            return [VectorObservation(row[0], row[1], row[2], tuple(row[6:6 + (row[3] or 1)]), row[4], row[5])
+                    for row in rows]
+        except exc.SQLAlchemyError as e:
+            session.rollback()
+            self.logger.exception(e)
+        return None
+
+
+    """
+    Function: get_m_type_components
+    Purpose: The components of m_types, for naming the values returned by get_multi_obs_vectors().
+    Parameters:
+      m_type_ids is a list of m_type row_ids.
+    Returns:
+      A dictionary keyed on m_type_id of [(obs_name, uom)...] lists in value order, or None if an error occured.
+    """
+
+
+    @timed
+    @replica_reads
+    def get_m_type_components(self, m_type_ids):
+        session = self.read_session()
+        try:
+            return m_type_components(session, m_type_ids)
+        except exc.SQLAlchemyError as e:
+            session.rollback()
+            self.logger.exception(e)
+        return None
+
+
+
+    """
+    Function: get_multi_obs_arrays
+    Purpose: Time window read of array valued observations.
+    Parameters:
+      sensor_ids is a list of sensor row_ids.
+      start_date, end_date bound the window, start_date inclusive and end_date exclusive.
+    Returns:
+      A list of rows with row_id, platform_handle, sensor_id, m_type_id, m_date, m_lon, m_lat, m_values,
+      bin_values, bin_start, bin_size and qc_level, ordered by sensor_id and m_date, or None if an error occured.
+    """
+
+
+    @timed
+    @replica_reads
+    def get_multi_obs_arrays(self, sensor_ids, start_date, end_date):
+        session = self.read_session()
+        try:
+            return session.query(*MULTI_OBS_ARRAY_READ_COLUMNS) \
+                .filter(multi_obs_array.sensor_id.in_(sensor_ids)) \
+                .filter(multi_obs_array.m_date >= start_date) \
+                .filter(multi_obs_array.m_date < end_date) \
+                .order_by(multi_obs_array.sensor_id, multi_obs_array.m_date) \
+                .all()
+        except exc.SQLAlchemyError as e:
+            session.rollback()
+            self.logger.exception(e)
+        return None
+
+
+    """
+    Function: get_multi_obs_array_expanded
+    Purpose: get_multi_obs_arrays() expanded to one multi_obs style row per bin, with the bin coordinate in m_z,
+    for code written against per bin multi_obs rows.
+    Parameters:
+      sensor_ids is a list of sensor row_ids.
+      start_date, end_date bound the window, start_date inclusive and end_date exclusive.
+    Returns:
+      A list of ExpandedObservation ordered by sensor_id, m_date and bin, or None if an error occured.
+    """
+
+
+    def get_multi_obs_array_expanded(self, sensor_ids, start_date, end_date):
+        rows = self.get_multi_obs_arrays(sensor_ids, start_date, end_date)
+        if rows is None:
+            return None
+        return [expanded for row in rows for expanded in expand_array_observation(row)]
+
+
+    def _time_bucket(self, date_column, bucket):
+        if bucket not in ('hour', 'day'):
+            raise ValueError("Unsupported rollup bucket: %s. Use 'hour' or 'day'." % (bucket))
+        if self.dbEngine.dialect.name == 'postgresql':
+            return func.date_trunc(bucket, date_column)
+        return func.strftime('%Y-%m-%d %H:00:00' if bucket == 'hour' else '%Y-%m-%d 00:00:00', date_column)
+
+
+    """
+    Function: get_multi_obs_rollup
+    Purpose: Aggregates observations for one or more sensors into hourly or daily buckets in the database.
+    Parameters:
+      sensor_ids is a list of sensor row_ids.
+      start_date, end_date bound the window, start_date inclusive and end_date exclusive.
+      bucket is 'hour' or 'day'.
+    Returns:
+      A list of rows with sensor_id, bucket_date, obs_count, avg_value, min_value and max_value ordered by
+      sensor_id and bucket_date, or None if an error occured. bucket_date is a datetime on PostgreSQL and a
+      'YYYY-MM-DD HH:00:00' string on SQLite.
+    """
+
+
+    @timed
+    @replica_reads
+    def get_multi_obs_rollup(self, sensor_ids, start_date, end_date, bucket='hour'):
+        session = self.read_session()
+        bucket_date = self._time_bucket(multi_obs.m_date, bucket).label('bucket_date')
+        try:
+            return session.query(multi_obs.sensor_id,
+                                 bucket_date,
+                                 func.count(multi_obs.m_value).label('obs_count'),
+                                 func.avg(multi_obs.m_value).label('avg_value'),
+                                 func.min(multi_obs.m_value).label('min_value'),
+                                 func.max(multi_obs.m_value).label('max_value')) \
+                .filter(multi_obs.sensor_id.in_(sensor_ids)) \
+                .filter(multi_obs.m_date >= start_date) \
+                .filter(multi_obs.m_date < end_date) \
+                .group_by(multi_obs.sensor_id, bucket_date) \
+                .order_by(multi_obs.sensor_id, bucket_date) \
+                .all()
+        except exc.SQLAlchemyError as e:
+            session.rollback()
+            self.logger.exception(e)
+        return None
+
+
+    """
+    Function: get_obs_in_region
+    Purpose: Returns the observations inside the bounding box for a time window.
+    Parameters:
+      min_lon, min_lat, max_lon, max_lat define the bounding box in WGS84 degrees.
+      start_date, end_date bound the window, start_date inclusive and end_date exclusive.
+      sensor_ids, if provided, restricts the search to those sensors.
+      by_platform_location, if True, selects observations from sensors on platforms located in the box
+      instead of by the observation's own the_geom. Use this for fixed platforms that don't store
+      m_lon/m_lat per observation.
+    Returns:
+      A list of rows with the MULTI_OBS_READ_COLUMNS, ordered by sensor_id and m_date, or None if an error
+      occured.
+    """
+
+
+    @timed
+    @replica_reads
+    def get_obs_in_region(self, min_lon, min_lat, max_lon, max_lat, start_date, end_date, sensor_ids=None,
+                          by_platform_location=False):
+        session = self.read_session()
+        try:
+            query = session.query(*MULTI_OBS_READ_COLUMNS) \
+                .filter(multi_obs.m_date >= start_date) \
+                .filter(multi_obs.m_date < end_date)
+            if by_platform_location:
+                region_sensors = select(sensor.row_id) \
+                    .join(platform, platform.row_id == sensor.platform_id) \
+                    .where(self._bbox_filter(platform, platform.fixed_longitude, platform.fixed_latitude,
+                                             min_lon, min_lat, max_lon, max_lat))
+                query = query.filter(multi_obs.sensor_id.in_(region_sensors))
+            else:
+                query = query.filter(self._bbox_filter(multi_obs, multi_obs.m_lon, multi_obs.m_lat,
+                                                       min_lon, min_lat, max_lon, max_lat))
+            if sensor_ids is not None:
+                query = query.filter(multi_obs.sensor_id.in_(sensor_ids))
+            return query.order_by(multi_obs.sensor_id, multi_obs.m_date).all()
+        except exc.SQLAlchemyError as e:
+            session.rollback()
+            self.logger.exception(e)
+        return None
+
+
+    """
+    Function: get_sensor_fingerprint
+    Purpose: Cheap summary of the sensor and m_type tables used to decide if locally cached sensor/m_type
+    resolutions are still valid. Any sensor added, deleted or updated(with row_update_date set) changes it.
+    Returns:
+      A tuple of (max sensor.row_id, sensor count, max sensor.row_update_date, max m_type.row_id), or None if
+      an error occured.
+    """
+
+
+    @timed
+    def get_sensor_fingerprint(self):
+        try:
+            max_m_type_id = self.session.query(func.max(m_type.row_id)).scalar_subquery()
+            rec = self.session.query(func.max(sensor.row_id),
+                                     func.count(sensor.row_id),
+                                     func.max(sensor.row_update_date),
+                                     max_m_type_id).one()
+            return (rec[0], rec[1], str(rec[2]) if rec[2] is not None else None, rec[3])
+        except exc.SQLAlchemyError as e:
+            self.logger.exception(e)
+        return None
+
+
+    """
+    Function: get_sensor_catalog
+    Purpose: Every sensor with the names it is resolved by, in one query, for callers that map whole batches
+    of observations to sensor ids instead of calling sensorExists() per observation.
+    Parameters:
+      sensor_ids, if given, limits the catalog to those sensors.
+      platform_handles, if given, limits the catalog to the sensors on those platforms.
+    Returns:
+      A list of (sensor_id, platform_handle, obs_name, uom, s_order, m_type_id, sensor short_name) tuples, or None
+      if an error occured. The obs_name and uom of a multi-value sensor are those of all its components, see
+      component_names(), so it never shares the (platform_handle, obs_name, uom, s_order) key of a single value
+      sensor measuring its first component.
+    """
+
+
+    @timed
+    @replica_reads
+    def get_sensor_catalog(self, sensor_ids=None, platform_handles=None):
+        session = self.read_session()
+        try:
+            query = session.query(sensor.row_id, platform.platform_handle, obs_type.standard_name,
+                                  uom_type.standard_name, sensor.s_order, sensor.m_type_id, sensor.short_name,
+                                  m_type.num_types) \
+                .join(platform, platform.row_id == sensor.platform_id) \
+                .join(m_type, m_type.row_id == sensor.m_type_id) \
+                .join(m_scalar_type, m_scalar_type.row_id == m_type.m_scalar_type_id) \
+                .join(obs_type, obs_type.row_id == m_scalar_type.obs_type_id) \
+                .join(uom_type, uom_type.row_id == m_scalar_type.uom_type_id)
+            if sensor_ids is not None:
+                query = query.filter(sensor.row_id.in_(sensor_ids))
+            if platform_handles is not None:
+                query = query.filter(platform.platform_handle.in_(platform_handles))
+            rows = query.all()
+            vector_m_type_ids = {row[5] for row in rows if row[7] is not None and row[7] > 1}
+            components = m_type_components(session, vector_m_type_ids) if vector_m_type_ids else {}
+            catalog = []
+            for row in rows:
+                obs_name, uom = component_names(components[row[5]]) if row[5] in components else row[2:4]
+                catalog.append((row[0], row[1], obs_name, uom, row[4], row[5], row[6]))
+            return catalog
+        except exc.SQLAlchemyError as e:
+            session.rollback()
+            self.logger.exception(e)
+        return None
+
     '''
     def build_minimal_platform(self, platform_name, observation_list):
         name_parts = platform_name.split('.')
@@ -681,6 +1908,8 @@ class xeniaAlchemy(object):
                 self.logger.exception(e)
     '''
 
+    @timed
+    @primary_reads
     def addNewSensor(self, obs_name, uom, platform_handle, active=1, fixed_z=0, s_order=1, m_type_id=None,
                      add_obs_and_uom=False):
         # If the sensor already exists, we're done.
@@ -751,7 +1980,7 @@ class xeniaAlchemy(object):
                                 s_order=s_order)
             sensor_id = self.addRec(sensor_rec, True)
             if sensor_id is not None:
-                self.logger.debug("Added sensor: %s(%s) sOrder: %d on platform: %d" % (obs_name, uom, s_order, platform_id))
+                self.logger.debug("Added sensor: %s(%s) sOrder: %d on platform: %d", obs_name, uom, s_order, platform_id)
                 return sensor_id
             else:
                 raise Exception("Unable to add sensor: %s(%s)." % (obs_name, uom))
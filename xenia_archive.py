@@ -0,0 +1,290 @@
+"""
+Cold storage tier for multi_obs: rows older than a cutoff are moved to Parquet files(through xenia_export)
+listed in a JSON manifest, and deleted from the database, so the hot table only holds recent data.
+
+A run goes through three steps, recorded in the manifest so a run that was interrupted is finished by the
+next one instead of exporting the same rows twice:
+  1. The rows with m_date before the cutoff and row_id up to the current maximum are exported, the run is
+     added to the manifest as "deleting" with its files.
+  2. Those rows are deleted from multi_obs in row_id ordered chunks, each committed on its own.
+  3. The run is marked "complete".
+Files of "deleting" runs are already read by read(), rows that are in both a file and the database are
+returned once(by row_id).
+
+xeniaAlchemy.get_multi_obs() unions in the archived rows when it has an archive(connect_db(archive=...)) and
+the window starts before the archive's archived_before date.
+
+pyarrow is an optional dependency, needed to archive and to read archived rows.
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, exc, func, select
+
+from .database_settings import DatabaseConfiguration
+from .xenia_export import MultiObsExporter, require_pyarrow
+from .xeniaAlchemy import MULTI_OBS_READ_COLUMNS, xeniaAlchemy
+from .XeniaTables import multi_obs
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE_NAME = 'manifest.json'
+
+MANIFEST_VERSION = 1
+
+# Archived rows are returned with the same fields, in the same order, as the get_multi_obs() database rows.
+ArchivedObservation = collections.namedtuple('ArchivedObservation',
+                                             [column.key for column in MULTI_OBS_READ_COLUMNS])
+
+
+class MultiObsArchive:
+    """
+    A multi_obs archive in archive_dir. delete_chunk_size is the row_id range each DELETE covers when
+    archived rows are removed from the database, the other parameters are passed to MultiObsExporter.
+    """
+    def __init__(self, archive_dir, delete_chunk_size=50000, batch_size=50000, row_group_size=250000,
+                 compression='zstd'):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.archive_dir = archive_dir
+        self.delete_chunk_size = delete_chunk_size
+        self.batch_size = batch_size
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self._manifest = None
+        self._manifest_mtime = None
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.archive_dir, MANIFEST_FILE_NAME)
+
+    @property
+    def manifest(self):
+        """
+        The manifest, reloaded if another process changed the file since it was last read.
+        """
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return {'version': MANIFEST_VERSION, 'runs': []}
+        if mtime != self._manifest_mtime:
+            with open(self.manifest_path) as manifest_file:
+                self._manifest = json.load(manifest_file)
+            self._manifest_mtime = mtime
+        return self._manifest
+
+    def _save_manifest(self, manifest):
+        # Written to a temporary file and renamed over the old one, readers never see a partial manifest.
+        os.makedirs(self.archive_dir, exist_ok=True)
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.replace(temp_path, self.manifest_path)
+        self._manifest = manifest
+        self._manifest_mtime = os.stat(self.manifest_path).st_mtime_ns
+
+    @property
+    def archived_before(self):
+        """
+        The latest cutoff of the runs in the manifest, rows before it may be in the archive. None if nothing is
+        archived.
+        """
+        return max((datetime.fromisoformat(run['cutoff']) for run in self.manifest['runs']), default=None)
+
+    def _file_entries(self, file_paths):
+        """
+        Manifest entries for the Parquet files of a run, with the m_date range and sensor ids of each so
+        reads only open the files they need.
+        """
+        pa = require_pyarrow()
+        entries = []
+        for file_path in file_paths:
+            table = pa.parquet.read_table(file_path, columns=['sensor_id', 'm_date'])
+            m_date_range = pa.compute.min_max(table['m_date']).as_py()
+            entries.append({
+                'path': os.path.relpath(file_path, self.archive_dir),
+                'rows': table.num_rows,
+                'min_m_date': m_date_range['min'].isoformat(),
+                'max_m_date': m_date_range['max'].isoformat(),
+                'sensor_ids': sorted(pa.compute.unique(table['sensor_id']).to_pylist()),
+            })
+        return entries
+
+    def _delete_archived_rows(self, db, run):
+        """
+        Deletes a run's rows from multi_obs, one row_id range at a time. Only sensors that were exported are
+        deleted, so rows the export couldn't resolve metadata for stay in the database.
+        """
+        table = multi_obs.__table__
+        cutoff = datetime.fromisoformat(run['cutoff'])
+        sensor_ids = sorted({sensor_id for entry in run['files'] for sensor_id in entry['sensor_ids']})
+        if not sensor_ids:
+            return 0
+        archived = (table.c.m_date < cutoff, table.c.sensor_id.in_(sensor_ids))
+        min_row_id = db.session.execute(select(func.min(table.c.row_id)).where(*archived)
+                                        .where(table.c.row_id <= run['max_row_id'])).scalar()
+        deleted_count = 0
+        start_row_id = min_row_id
+        while start_row_id is not None and start_row_id <= run['max_row_id']:
+            end_row_id = min(start_row_id + self.delete_chunk_size - 1, run['max_row_id'])
+            result = db.session.execute(delete(table).where(table.c.row_id.between(start_row_id, end_row_id))
+                                        .where(*archived))
+            db.session.commit()
+            deleted_count += result.rowcount
+            self.logger.info("Archive run: %s deleted %d of %d rows, row_id: %d of %d.", run['run_id'],
+                             deleted_count, run['rows'], end_row_id, run['max_row_id'])
+            start_row_id = end_row_id + 1
+        return deleted_count
+
+    """
+    Function: archive
+    Purpose: Moves the multi_obs rows older than the cutoff to Parquet files and deletes them from the
+    database. A previous run that was interrupted while deleting is finished first.
+    Parameters:
+      db is a connected xeniaAlchemy, every read goes to its primary.
+      older_than is the age, a timedelta, of the rows to archive. cutoff, an m_date, can be passed instead.
+    Returns:
+      A dictionary with the run id, cutoff and the rows archived and deleted, or None if an error occurred.
+    """
+
+
+    def archive(self, db, older_than=timedelta(days=90), cutoff=None):
+        start_time = time.perf_counter()
+        if cutoff is None:
+            cutoff = datetime.now() - older_than
+        try:
+            with db.primary():
+                manifest = self.manifest
+                for run in manifest['runs']:
+                    if run['state'] == 'deleting':
+                        self.logger.info("Archive run: %s was interrupted, finishing its deletes.", run['run_id'])
+                        self._delete_archived_rows(db, run)
+                        run['state'] = 'complete'
+                        self._save_manifest(manifest)
+
+                max_row_id = db.session.execute(select(func.max(multi_obs.row_id))).scalar()
+                db.session.commit()
+                run_id = datetime.now().strftime('%Y%m%dT%H%M%S')
+                stats = {'rows': 0}
+                if max_row_id is not None:
+                    exporter = MultiObsExporter(db, self.archive_dir, batch_size=self.batch_size,
+                                                row_group_size=self.row_group_size, compression=self.compression,
+                                                run_id=run_id)
+                    stats = exporter.export(None, cutoff, max_row_id=max_row_id)
+                    if stats is None:
+                        return None
+                if not stats['rows']:
+                    self.logger.info("Archive: nothing to archive before: %s", cutoff)
+                    return {'run_id': None, 'cutoff': cutoff, 'rows_archived': 0, 'rows_deleted': 0}
+
+                run = {
+                    'run_id': run_id,
+                    'cutoff': cutoff.isoformat(),
+                    'max_row_id': max_row_id,
+                    'rows': stats['rows'],
+                    'bytes': stats['bytes'],
+                    'state': 'deleting',
+                    'files': self._file_entries(stats['files']),
+                }
+                manifest['runs'].append(run)
+                self._save_manifest(manifest)
+
+                deleted_count = self._delete_archived_rows(db, run)
+                run['state'] = 'complete'
+                self._save_manifest(manifest)
+        except exc.SQLAlchemyError as e:
+            db.session.rollback()
+            self.logger.exception(e)
+            return None
+        self.logger.info("Archive run: %s archived %d rows before %s in %.2f seconds.", run_id, stats['rows'],
+                         cutoff, time.perf_counter() - start_time)
+        return {'run_id': run_id, 'cutoff': cutoff, 'rows_archived': stats['rows'], 'rows_deleted': deleted_count}
+
+    """
+    Function: read
+    Purpose: Time window read of archived observations.
+    Parameters:
+      sensor_ids is a list of sensor row_ids.
+      start_date, end_date bound the window, start_date inclusive and end_date exclusive.
+    Returns:
+      A list of ArchivedObservation, ordered by sensor_id and m_date.
+    """
+
+
+    def read(self, sensor_ids, start_date, end_date):
+        pa = require_pyarrow()
+        import pyarrow.dataset
+
+        sensor_ids = set(sensor_ids)
+        file_paths = [os.path.join(self.archive_dir, entry['path'])
+                      for run in self.manifest['runs'] for entry in run['files']
+                      if datetime.fromisoformat(entry['min_m_date']) < end_date
+                      and datetime.fromisoformat(entry['max_m_date']) >= start_date
+                      and sensor_ids.intersection(entry['sensor_ids'])]
+        if not file_paths:
+            return []
+        m_date = pyarrow.dataset.field('m_date')
+        row_filter = pyarrow.dataset.field('sensor_id').isin(list(sensor_ids)) \
+            & (m_date >= pa.scalar(start_date, pa.timestamp('us'))) \
+            & (m_date < pa.scalar(end_date, pa.timestamp('us')))
+        table = pyarrow.dataset.dataset(file_paths, format='parquet') \
+            .to_table(columns=list(ArchivedObservation._fields), filter=row_filter) \
+            .sort_by([('sensor_id', 'ascending'), ('m_date', 'ascending')])
+        return [ArchivedObservation(**rec) for rec in table.to_pylist()]
+
+    """
+    Function: union
+    Purpose: Adds the archived rows of a time window to the database rows of the same window.
+    Parameters:
+      database_rows is the get_multi_obs() result from the database.
+      sensor_ids, start_date, end_date are the get_multi_obs() arguments.
+    Returns:
+      The rows, ordered by sensor_id and m_date. A row in both, archived but not deleted yet, is returned
+      once.
+    """
+
+
+    def union(self, database_rows, sensor_ids, start_date, end_date):
+        archived_before = self.archived_before
+        if archived_before is None or start_date >= archived_before:
+            return database_rows
+        archived_rows = self.read(sensor_ids, start_date, end_date)
+        if not archived_rows:
+            return database_rows
+        database_row_ids = {row.row_id for row in database_rows}
+        rows = list(database_rows)
+        rows.extend(row for row in archived_rows if row.row_id not in database_row_ids)
+        rows.sort(key=lambda row: (row.sensor_id, row.m_date))
+        return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old multi_obs rows to a Parquet archive.")
+    parser.add_argument("--ini", required=True, help="ini file with the [Database] section.")
+    parser.add_argument("--archive-dir", required=True)
+    parser.add_argument("--older-than-days", type=float, default=90)
+    parser.add_argument("--delete-chunk-size", type=int, default=50000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    config = DatabaseConfiguration(None, ini_file=args.ini)
+    db = xeniaAlchemy()
+    if not db.connect_db(config.get_connection_string(), False, sqlite_pragmas=config.sqlite_pragmas,
+                         spatialite=config.spatialite):
+        return 1
+    try:
+        archive = MultiObsArchive(args.archive_dir, delete_chunk_size=args.delete_chunk_size)
+        stats = archive.archive(db, older_than=timedelta(days=args.older_than_days))
+    finally:
+        db.disconnect()
+    return 0 if stats is not None else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,304 @@
+"""
+Columnar export of multi_obs to Parquet, partitioned by platform and month.
+
+Rows are streamed from a server-side cursor(stream_results) one platform at a time in m_date order, converted
+to Arrow record batches and written to one open Parquet file at a time, so memory is bounded by the batch and
+row group sizes no matter how large the export is. The sensor metadata(obs_type, uom_type, s_order, sensor
+short name) is read once and joined onto each batch with pyarrow.compute, not in the SQL.
+
+The files are laid out hive style, which pyarrow.dataset, pandas, Polars, DuckDB and Spark read as partition
+columns:
+    <output_dir>/platform=<platform_handle>/month=<YYYY-MM>/part-<run_id>.parquet
+The files keep their platform_handle column, so a single file can be read on its own.
+
+pyarrow is an optional dependency, only needed when an export runs.
+"""
+import argparse
+import logging
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import exc, select
+
+from .database_settings import DatabaseConfiguration
+from .xeniaAlchemy import (
+    MULTI_OBS_BULK_COLUMNS,
+    component_names,
+    m_type_components,
+    xeniaAlchemy,
+)
+from .XeniaTables import (
+    m_scalar_type,
+    m_type,
+    multi_obs,
+    obs_type,
+    platform,
+    sensor,
+    uom_type,
+)
+
+logger = logging.getLogger(__name__)
+
+# multi_obs columns exported, the_geom is left out since m_lon/m_lat carry the same point.
+EXPORT_COLUMNS = ('row_id',) + MULTI_OBS_BULK_COLUMNS
+
+# Sensor metadata columns added to every row.
+METADATA_COLUMNS = ('obs_name', 'uom', 's_order', 'sensor_name')
+
+
+def require_pyarrow():
+    """
+    Imports pyarrow and pyarrow.parquet, raising an ImportError that says how to install them if missing.
+    """
+    try:
+        import pyarrow
+        import pyarrow.compute  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError as e:
+        raise ImportError("pyarrow is required for Parquet import and export: pip install pyarrow") from e
+    return pyarrow
+
+
+def multi_obs_arrow_schema():
+    """
+    Arrow schema for EXPORT_COLUMNS plus METADATA_COLUMNS. The string columns are dictionary encoded, they
+    repeat a handful of values per file.
+    """
+    pa = require_pyarrow()
+    string_type = pa.dictionary(pa.int32(), pa.string())
+    arrow_types = {
+        'Integer': pa.int32(),
+        'Float': pa.float64(),
+        'DateTime': pa.timestamp('us'),
+        'String': string_type,
+    }
+    fields = [pa.field('row_id', pa.int64())]
+    for name in MULTI_OBS_BULK_COLUMNS:
+        fields.append(pa.field(name, arrow_types[type(multi_obs.__table__.c[name].type).__name__]))
+    fields.extend([pa.field('obs_name', string_type), pa.field('uom', string_type), pa.field('s_order', pa.int32()),
+                   pa.field('sensor_name', string_type)])
+    return pa.schema(fields)
+
+
+class MultiObsExporter:
+    """
+    Exports multi_obs rows from a connected xeniaAlchemy to Parquet files under output_dir.
+    batch_size is the number of rows fetched from the cursor at a time and row_group_size the number of rows
+    per Parquet row group, together they bound the memory used. run_id names the files written by this
+    exporter so repeated exports into the same directory don't overwrite each other.
+    """
+    def __init__(self, db, output_dir, batch_size=50000, row_group_size=250000, compression='zstd', run_id=None):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.db = db
+        self.output_dir = output_dir
+        self.batch_size = batch_size
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.run_id = run_id or datetime.now().strftime('%Y%m%dT%H%M%S')
+
+    def _connection(self):
+        """
+        Connection the rows are streamed over: a read replica's if any are healthy, otherwise the primary's.
+        PostgreSQL runs the export in one REPEATABLE READ transaction, a consistent snapshot across platforms.
+        """
+        engine = self.db.read_session().get_bind()
+        connection = engine.connect()
+        if engine.dialect.name == 'postgresql':
+            connection = connection.execution_options(isolation_level='REPEATABLE READ')
+        return connection
+
+    def _sensor_metadata(self, connection, sensor_ids, platform_handles):
+        """
+        (sensor_id, platform_handle, obs_name, uom, s_order, sensor short_name) per sensor. A multi-value sensor
+        is labelled with all its components, as in xeniaAlchemy.get_sensor_catalog(), so xenia_import resolves it.
+        """
+        stmt = select(sensor.row_id, platform.platform_handle, obs_type.standard_name, uom_type.standard_name,
+                      sensor.s_order, sensor.short_name, sensor.m_type_id, m_type.num_types) \
+            .join(platform, platform.row_id == sensor.platform_id) \
+            .join(m_type, m_type.row_id == sensor.m_type_id) \
+            .join(m_scalar_type, m_scalar_type.row_id == m_type.m_scalar_type_id) \
+            .join(obs_type, obs_type.row_id == m_scalar_type.obs_type_id) \
+            .join(uom_type, uom_type.row_id == m_scalar_type.uom_type_id)
+        if sensor_ids is not None:
+            stmt = stmt.where(sensor.row_id.in_(sensor_ids))
+        if platform_handles is not None:
+            stmt = stmt.where(platform.platform_handle.in_(platform_handles))
+        rows = connection.execute(stmt).all()
+        vector_m_type_ids = {row[6] for row in rows if row[7] is not None and row[7] > 1}
+        components = m_type_components(connection, vector_m_type_ids) if vector_m_type_ids else {}
+        return [row[:2] + (component_names(components[row[6]]) if row[6] in components else row[2:4]) + row[4:6]
+                for row in rows]
+
+    def _metadata_table(self, metadata_rows):
+        """
+        Arrow table of the sensor metadata, indexed by position so a batch's sensor_id column can be turned
+        into the metadata columns with index_in() and take().
+        """
+        pa = require_pyarrow()
+        schema = multi_obs_arrow_schema()
+        return pa.table({
+            'sensor_id': pa.array([rec[0] for rec in metadata_rows], pa.int32()),
+            'obs_name': pa.array([rec[2] for rec in metadata_rows], pa.string()).dictionary_encode(),
+            'uom': pa.array([rec[3] for rec in metadata_rows], pa.string()).dictionary_encode(),
+            's_order': pa.array([rec[4] for rec in metadata_rows], pa.int32()),
+            'sensor_name': pa.array([rec[5] for rec in metadata_rows], pa.string()).dictionary_encode(),
+        }).cast(pa.schema([pa.field('sensor_id', pa.int32())] + [schema.field(name) for name in METADATA_COLUMNS]))
+
+    def _record_batch(self, rows, metadata_table, schema):
+        pa = require_pyarrow()
+        pc = pa.compute
+        columns = list(zip(*rows))
+        arrays = []
+        for ndx, name in enumerate(EXPORT_COLUMNS):
+            field = schema.field(name)
+            if pa.types.is_dictionary(field.type):
+                arrays.append(pa.array(columns[ndx], pa.string()).dictionary_encode().cast(field.type))
+            else:
+                arrays.append(pa.array(columns[ndx], field.type))
+        positions = pc.index_in(arrays[EXPORT_COLUMNS.index('sensor_id')], value_set=metadata_table['sensor_id'])
+        for name in METADATA_COLUMNS:
+            arrays.append(metadata_table[name].take(positions).combine_chunks())
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    def _partition_path(self, platform_handle, month):
+        # Platform handles are org.name.type, a path separator in one would escape the output directory.
+        directory = os.path.join(self.output_dir, "platform=%s" % (platform_handle.replace(os.sep, '_')),
+                                 "month=%s" % (month))
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, "part-%s.parquet" % (self.run_id))
+
+    """
+    Function: export
+    Purpose: Writes the multi_obs rows in [start_date, end_date) for the requested sensors and/or platforms
+    to Parquet, one file per platform and month.
+    Parameters:
+      start_date, end_date are the m_date range, end exclusive. start_date None exports everything before
+      end_date.
+      sensor_ids, if given, limits the export to those sensors.
+      platform_handles, if given, limits the export to the sensors on those platforms.
+      max_row_id, if given, leaves out rows inserted after that row_id.
+    Returns:
+      A dictionary with the rows and files written, the bytes on disk and elapsed seconds, or None if an
+      error occurred.
+    """
+
+
+    def export(self, start_date, end_date, sensor_ids=None, platform_handles=None, max_row_id=None):
+        pa = require_pyarrow()
+        pq = pa.parquet
+        schema = multi_obs_arrow_schema()
+        stats = {'rows': 0, 'files': [], 'bytes': 0}
+        start_time = time.perf_counter()
+        table = multi_obs.__table__
+        writer = None
+        try:
+            with self._connection() as connection:
+                metadata_rows = self._sensor_metadata(connection, sensor_ids, platform_handles)
+                metadata_table = self._metadata_table(metadata_rows)
+                platform_sensors = {}
+                for rec in metadata_rows:
+                    platform_sensors.setdefault(rec[1], []).append(rec[0])
+
+                for platform_handle in sorted(platform_sensors):
+                    stmt = select(*[table.c[name] for name in EXPORT_COLUMNS]) \
+                        .where(table.c.sensor_id.in_(platform_sensors[platform_handle])) \
+                        .where(table.c.m_date < end_date) \
+                        .order_by(table.c.m_date)
+                    if start_date is not None:
+                        stmt = stmt.where(table.c.m_date >= start_date)
+                    if max_row_id is not None:
+                        stmt = stmt.where(table.c.row_id <= max_row_id)
+                    result = connection.execution_options(stream_results=True, yield_per=self.batch_size) \
+                        .execute(stmt)
+                    month = None
+                    pending = []
+                    pending_count = 0
+                    m_date_ndx = EXPORT_COLUMNS.index('m_date')
+                    for rows in result.partitions():
+                        # Split the batch where the month changes, rows are in m_date order.
+                        start_ndx = 0
+                        while start_ndx < len(rows):
+                            row_month = rows[start_ndx][m_date_ndx].strftime('%Y-%m')
+                            end_ndx = start_ndx
+                            while end_ndx < len(rows) and rows[end_ndx][m_date_ndx].strftime('%Y-%m') == row_month:
+                                end_ndx += 1
+                            if row_month != month:
+                                writer = self._flush(writer, pending, schema, stats, close=True)
+                                pending, pending_count = [], 0
+                                month = row_month
+                                file_path = self._partition_path(platform_handle, month)
+                                writer = pq.ParquetWriter(file_path, schema, compression=self.compression)
+                                stats['files'].append(file_path)
+                            batch = self._record_batch(rows[start_ndx:end_ndx], metadata_table, schema)
+                            pending.append(batch)
+                            pending_count += batch.num_rows
+                            if pending_count >= self.row_group_size:
+                                self._flush(writer, pending, schema, stats)
+                                pending, pending_count = [], 0
+                            start_ndx = end_ndx
+                    writer = self._flush(writer, pending, schema, stats, close=True)
+                    self.logger.info("Export: %s %d rows, %d files so far.", platform_handle, stats['rows'],
+                                     len(stats['files']))
+                connection.rollback()
+        except exc.SQLAlchemyError as e:
+            self.logger.exception(e)
+            return None
+        finally:
+            if writer is not None:
+                writer.close()
+        stats['bytes'] = sum(os.path.getsize(file_path) for file_path in stats['files'])
+        stats['elapsed'] = time.perf_counter() - start_time
+        return stats
+
+    def _flush(self, writer, pending, schema, stats, close=False):
+        """
+        Writes the pending batches as one row group. Returns the writer, or None once it's closed.
+        """
+        pa = require_pyarrow()
+        if writer is None:
+            return None
+        if pending:
+            writer.write_table(pa.Table.from_batches(pending, schema=schema), row_group_size=self.row_group_size)
+            stats['rows'] += sum(batch.num_rows for batch in pending)
+        if close:
+            writer.close()
+            return None
+        return writer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export multi_obs to Parquet, partitioned by platform and month.")
+    parser.add_argument("--ini", required=True, help="ini file with the [Database] section.")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--start", required=True, help="Start date, ISO 8601.")
+    parser.add_argument("--end", required=True, help="End date(exclusive), ISO 8601.")
+    parser.add_argument("--platform", action="append", default=None, help="Platform handle, may be repeated.")
+    parser.add_argument("--sensor-id", type=int, action="append", default=None, help="Sensor id, may be repeated.")
+    parser.add_argument("--batch-size", type=int, default=50000)
+    parser.add_argument("--row-group-size", type=int, default=250000)
+    parser.add_argument("--compression", default='zstd')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    config = DatabaseConfiguration(None, ini_file=args.ini)
+    db = xeniaAlchemy()
+    if not db.connect_db(config.get_connection_string(), False, read_replicas=config.get_read_replica_connection_strings(),
+                         sqlite_pragmas=config.sqlite_pragmas, spatialite=config.spatialite):
+        return 1
+    try:
+        exporter = MultiObsExporter(db, args.output_dir, batch_size=args.batch_size,
+                                    row_group_size=args.row_group_size, compression=args.compression)
+        stats = exporter.export(datetime.fromisoformat(args.start), datetime.fromisoformat(args.end),
+                                sensor_ids=args.sensor_id, platform_handles=args.platform)
+    finally:
+        db.disconnect()
+    if stats is None:
+        return 1
+    logger.info("Exported %d rows to %d files, %d bytes in %.2f seconds.", stats['rows'], len(stats['files']),
+                stats['bytes'], stats['elapsed'])
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
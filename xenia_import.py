@@ -0,0 +1,268 @@
+"""
+Bulk import of Arrow/Parquet observation datasets into multi_obs.
+
+Batches are resolved to sensor_id/m_type_id with pyarrow.compute against a lookup built once from
+xeniaAlchemy.get_sensor_catalog(): the (platform_handle, obs_name, uom, s_order) columns are joined into one
+key column and matched with index_in(), there is no per-row Python work. On PostgreSQL every batch is
+written as CSV by pyarrow and loaded with COPY, the_geom included as EWKT, elsewhere the batch goes through
+xeniaAlchemy.add_multi_obs_bulk().
+
+The input needs platform_handle, obs_name, uom and m_date columns, s_order defaults to 1 and any other
+multi_obs column(m_value, m_lon, qc_level...) is copied when present. A multi-value sensor is named by all
+its components, e.g. obs_name 'eastward_wind,northward_wind' and uom 'm_s-1,m_s-1', with its values in
+m_value..m_value_8. Files written by xenia_export have these columns, their sensor_id, m_type_id and row_id
+columns are ignored since ids are resolved on import.
+
+pyarrow is an optional dependency, only needed when an import runs.
+"""
+import argparse
+import io
+import logging
+import time
+from datetime import datetime
+
+from sqlalchemy import exc
+
+from .database_settings import DatabaseConfiguration
+from .xenia_export import multi_obs_arrow_schema, require_pyarrow
+from .xenia_spatial import DEFAULT_SRID
+from .xeniaAlchemy import MULTI_OBS_BULK_COLUMNS, xeniaAlchemy
+
+logger = logging.getLogger(__name__)
+
+KEY_COLUMNS = ('platform_handle', 'obs_name', 'uom', 's_order')
+
+REQUIRED_COLUMNS = ('platform_handle', 'obs_name', 'uom', 'm_date')
+
+# Separates the parts of the sensor lookup key, it can't appear in a platform handle or standard name.
+KEY_SEPARATOR = '\x1f'
+
+
+class MultiObsImporter:
+    """
+    Imports Arrow record batches into multi_obs through a connected xeniaAlchemy.
+    batch_size is the number of rows per batch read from Parquet and per commit. If add_missing_sensors is
+    True, platforms and sensors not in the database are provisioned, otherwise their rows are skipped and
+    counted.
+    """
+    def __init__(self, db, batch_size=100000, add_missing_sensors=False):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.db = db
+        self.batch_size = batch_size
+        self.add_missing_sensors = add_missing_sensors
+        self._lookup_keys = None
+        self._lookup_sensor_ids = None
+        self._lookup_m_type_ids = None
+        # Every multi_obs column with its plain(not dictionary encoded) Arrow type.
+        pa = require_pyarrow()
+        self._column_types = {}
+        for field in multi_obs_arrow_schema():
+            if field.name in MULTI_OBS_BULK_COLUMNS:
+                self._column_types[field.name] = pa.string() if pa.types.is_dictionary(field.type) else field.type
+
+    def build_lookup(self):
+        """
+        Reads the sensor catalog from the primary into the Arrow arrays the batches are matched against.
+        """
+        pa = require_pyarrow()
+        with self.db.primary():
+            catalog = self.db.get_sensor_catalog()
+        if catalog is None:
+            raise RuntimeError("Unable to read the sensor catalog.")
+        self._lookup_keys = pa.array([KEY_SEPARATOR.join(str(value) for value in rec[1:5]) for rec in catalog],
+                                     pa.string())
+        self._lookup_sensor_ids = pa.array([rec[0] for rec in catalog], pa.int32())
+        self._lookup_m_type_ids = pa.array([rec[5] for rec in catalog], pa.int32())
+        self.logger.debug("Sensor lookup built with %d sensors.", len(catalog))
+
+    def _batch_keys(self, batch):
+        pa = require_pyarrow()
+        pc = pa.compute
+        parts = []
+        for name in KEY_COLUMNS:
+            if name == 's_order' and name not in batch.schema.names:
+                parts.append(pa.scalar('1'))
+            else:
+                column = batch.column(name)
+                if pa.types.is_dictionary(column.type):
+                    column = column.dictionary_decode()
+                parts.append(pc.cast(column, pa.string()))
+        return pc.binary_join_element_wise(*parts, KEY_SEPARATOR)
+
+    def _resolve(self, batch, stats):
+        """
+        Returns the batch as a table of MULTI_OBS_BULK_COLUMNS with sensor_id and m_type_id resolved, rows whose
+        sensor can't be resolved are dropped and counted in stats['rows_skipped'].
+        """
+        pa = require_pyarrow()
+        pc = pa.compute
+        keys = self._batch_keys(batch)
+        positions = pc.index_in(keys, value_set=self._lookup_keys)
+        if self.add_missing_sensors and positions.null_count:
+            missing_keys = pc.unique(pc.filter(keys, pc.is_null(positions))).to_pylist()
+            if self._provision(missing_keys):
+                self.build_lookup()
+                positions = pc.index_in(keys, value_set=self._lookup_keys)
+
+        resolved = pc.is_valid(positions)
+        stats['rows_skipped'] += positions.null_count
+        positions = pc.filter(positions, resolved)
+        batch = batch.filter(resolved)
+
+        now = pa.scalar(datetime.now(), self._column_types['row_entry_date'])
+        columns = {}
+        for name, arrow_type in self._column_types.items():
+            if name == 'sensor_id':
+                columns[name] = self._lookup_sensor_ids.take(positions)
+            elif name == 'm_type_id':
+                columns[name] = self._lookup_m_type_ids.take(positions)
+            elif name in batch.schema.names:
+                column = batch.column(name)
+                if pa.types.is_dictionary(column.type):
+                    column = column.dictionary_decode()
+                columns[name] = pc.cast(column, arrow_type)
+            else:
+                columns[name] = pa.nulls(batch.num_rows, arrow_type)
+        columns['row_entry_date'] = pc.fill_null(columns['row_entry_date'], now)
+        return pa.table(columns)
+
+    def _provision(self, missing_keys):
+        """
+        Adds the platforms and sensors for missing_keys. Returns True if any were added.
+        """
+        observations = {}
+        for key in missing_keys:
+            platform_handle, obs_name, uom, s_order = key.split(KEY_SEPARATOR)
+            observations.setdefault(platform_handle, []).append({'obs_name': obs_name, 'uom_name': uom,
+                                                                 's_order': int(s_order)})
+        for platform_handle, observation_list in observations.items():
+            self.logger.info("Provisioning %d sensors on platform: %s", len(observation_list), platform_handle)
+            self.db.build_minimal_platform(platform_handle, observation_list)
+        return bool(observations)
+
+    def _copy_table(self, table):
+        """
+        Loads the table into multi_obs with COPY, the_geom as EWKT computed by pyarrow. Returns False if the
+        driver has no COPY support.
+        """
+        pa = require_pyarrow()
+        import pyarrow.csv
+
+        pc = pa.compute
+        connection = self.db.session.connection()
+        cursor = connection.connection.cursor()
+        if not hasattr(cursor, 'copy_expert'):
+            cursor.close()
+            return False
+        # Null if either coordinate is null, as point_expression() is in the executemany path.
+        the_geom = pc.binary_join_element_wise(
+            "SRID=%d;POINT(" % (DEFAULT_SRID), pc.cast(table['m_lon'], pa.string()), " ",
+            pc.cast(table['m_lat'], pa.string()), ")", "")
+        table = table.append_column('the_geom', the_geom)
+        buffer = io.BytesIO()
+        # all_valid quotes every non-null value, so an empty string stays distinct from NULL.
+        pyarrow.csv.write_csv(table, buffer, pyarrow.csv.WriteOptions(include_header=False, quoting_style='all_valid'))
+        buffer.seek(0)
+        statement = "COPY multi_obs (%s) FROM STDIN WITH (FORMAT csv)" % (', '.join(table.column_names))
+        dbapi = connection.dialect.loaded_dbapi
+        try:
+            cursor.copy_expert(statement, buffer)
+        # Errors from the raw cursor aren't wrapped by SQLAlchemy, wrap them as it would so the caller's
+        # SQLAlchemyError handling rolls back.
+        except dbapi.Error as e:
+            raise exc.DBAPIError.instance(statement, None, e, dbapi.Error, dialect=connection.dialect) from e
+        finally:
+            cursor.close()
+        return True
+
+    def _write_table(self, table):
+        if self.db.dbEngine.dialect.name == 'postgresql' and self._copy_table(table):
+            self.db.session.commit()
+            if self.db.metrics is not None:
+                self.db.metrics.add_rows_written(table.num_rows)
+            return table.num_rows
+        return self.db.add_multi_obs_bulk(table.to_pylist())
+
+    """
+    Function: import_batches
+    Purpose: Resolves and writes each Arrow record batch, committing after every batch.
+    Parameters:
+      batches is an iterable of pyarrow.RecordBatch, e.g. a RecordBatchReader or dataset.to_batches().
+    Returns:
+      A dictionary with the rows read, written and skipped, the batch count and elapsed seconds, or None if an
+      error occurred. Batches committed before an error stay in the database.
+    """
+
+
+    def import_batches(self, batches):
+        require_pyarrow()
+        stats = {'rows_read': 0, 'rows_written': 0, 'rows_skipped': 0, 'batches': 0}
+        start_time = time.perf_counter()
+        try:
+            if self._lookup_keys is None:
+                self.build_lookup()
+            for batch in batches:
+                missing_columns = [name for name in REQUIRED_COLUMNS if name not in batch.schema.names]
+                if missing_columns:
+                    raise ValueError("Batch is missing the required columns: %s" % (', '.join(missing_columns)))
+                table = self._resolve(batch, stats)
+                stats['rows_written'] += self._write_table(table) if table.num_rows else 0
+                stats['rows_read'] += batch.num_rows
+                stats['batches'] += 1
+                self.logger.info("Import batch: %d rows read: %d written: %d skipped: %d", stats['batches'],
+                                 stats['rows_read'], stats['rows_written'], stats['rows_skipped'])
+        except (exc.SQLAlchemyError, RuntimeError, ValueError) as e:
+            self.db.session.rollback()
+            self.logger.exception(e)
+            return None
+        stats['elapsed'] = time.perf_counter() - start_time
+        return stats
+
+    """
+    Function: import_parquet
+    Purpose: Imports a Parquet file or a directory of them, e.g. an xenia_export output directory.
+    Parameters:
+      path is the file or directory.
+    Returns:
+      See import_batches.
+    """
+
+
+    def import_parquet(self, path):
+        pa = require_pyarrow()
+        import pyarrow.dataset
+
+        dataset = pyarrow.dataset.dataset(path, format='parquet', partitioning='hive')
+        # Only read the columns the import uses.
+        columns = [name for name in dataset.schema.names if name in MULTI_OBS_BULK_COLUMNS or name in KEY_COLUMNS]
+        self.logger.debug("Importing: %s with pyarrow %s", path, pa.__version__)
+        return self.import_batches(dataset.to_batches(columns=columns, batch_size=self.batch_size))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import Parquet observation files into multi_obs.")
+    parser.add_argument("--ini", required=True, help="ini file with the [Database] section.")
+    parser.add_argument("--batch-size", type=int, default=100000)
+    parser.add_argument("--add-missing-sensors", action="store_true",
+                        help="Add platforms and sensors the database doesn't have instead of skipping their rows.")
+    parser.add_argument("path", nargs='+', help="Parquet file or directory.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    config = DatabaseConfiguration(None, ini_file=args.ini)
+    db = xeniaAlchemy()
+    if not db.connect_db(config.get_connection_string(), False, sqlite_pragmas=config.sqlite_pragmas,
+                         spatialite=config.spatialite):
+        return 1
+    try:
+        importer = MultiObsImporter(db, batch_size=args.batch_size, add_missing_sensors=args.add_missing_sensors)
+        for path in args.path:
+            if importer.import_parquet(path) is None:
+                return 1
+    finally:
+        db.disconnect()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,349 @@
+import bisect
+import contextvars
+import functools
+import logging
+import threading
+import time
+
+# Upper bounds, in seconds, of the latency histogram buckets. The last bucket is +Inf.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Name of the timed method currently executing, queries issued by the engine are attributed to it.
+_current_method = contextvars.ContextVar('xenia_current_method', default=None)
+
+NO_METHOD = '<none>'
+
+
+class LatencyHistogram:
+    """
+    Cumulative latency histogram with fixed LATENCY_BUCKETS bucket boundaries, in the Prometheus style.
+    """
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, quantile):
+        """
+        Approximate quantile, the upper bound of the bucket holding it. Returns None if nothing was observed.
+        """
+        if not self.count:
+            return None
+        rank = quantile * self.count
+        running_count = 0
+        for ndx, bucket_count in enumerate(self.counts):
+            running_count += bucket_count
+            if running_count >= rank:
+                return LATENCY_BUCKETS[ndx] if ndx < len(LATENCY_BUCKETS) else self.max
+        return self.max
+
+
+class MethodStats:
+    __slots__ = ('calls', 'errors', 'queries', 'rows_written', 'latency', 'query_latency')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.queries = 0
+        self.rows_written = 0
+        self.latency = LatencyHistogram()
+        self.query_latency = LatencyHistogram()
+
+
+class XeniaMetrics:
+    """
+    In-process statistics for xeniaAlchemy and the components built on it. Collection is opt-in: pass an
+    instance to xeniaAlchemy.connect_db(metrics=...) to time the @timed methods and attribute every SQL
+    statement the engine executes to the method that issued it. The same instance also collects rows written,
+    cache hit/miss counts(ObsMapCache) and gauges such as the MultiProcessDataSaver queue depth.
+    Read it with snapshot(), prometheus_text(), serve it with start_http_server() or log it every so often with
+    start_periodic_log().
+    """
+    def __init__(self, prefix='xenia'):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._methods = {}
+        # cache name -> [hits, misses]
+        self._caches = {}
+        self._gauges = {}
+        self._start_time = time.time()
+        self._http_server = None
+        self._log_stop = None
+
+    def _method_stats(self, method_name):
+        stats = self._methods.get(method_name)
+        if stats is None:
+            stats = self._methods[method_name] = MethodStats()
+        return stats
+
+    def record_call(self, method_name, seconds, error=False):
+        with self._lock:
+            stats = self._method_stats(method_name)
+            stats.calls += 1
+            if error:
+                stats.errors += 1
+            stats.latency.observe(seconds)
+
+    def record_query(self, seconds, method_name=None):
+        if method_name is None:
+            method_name = _current_method.get() or NO_METHOD
+        with self._lock:
+            stats = self._method_stats(method_name)
+            stats.queries += 1
+            stats.query_latency.observe(seconds)
+
+    def add_rows_written(self, row_count, method_name=None):
+        if method_name is None:
+            method_name = _current_method.get() or NO_METHOD
+        with self._lock:
+            self._method_stats(method_name).rows_written += row_count
+
+    def record_cache(self, cache_name, hit):
+        with self._lock:
+            cache_counts = self._caches.setdefault(cache_name, [0, 0])
+            cache_counts[0 if hit else 1] += 1
+
+    def set_gauge(self, gauge_name, value):
+        self._gauges[gauge_name] = value
+
+    def reset(self):
+        with self._lock:
+            self._methods = {}
+            self._caches = {}
+            self._gauges = {}
+            self._start_time = time.time()
+
+    def timer(self, method_name):
+        """
+        Context manager timing a block of code as method_name, queries executed inside it are attributed to it.
+        """
+        return _MethodTimer(self, method_name)
+
+    def instrument_engine(self, engine):
+        """
+        Registers before/after_cursor_execute and handle_error listeners on engine so every statement, failed
+        or not, is counted and timed.
+        """
+        from sqlalchemy import event
+
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    def remove_engine(self, engine):
+        from sqlalchemy import event
+
+        if event.contains(engine, 'before_cursor_execute', self._before_cursor_execute):
+            event.remove(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.remove(engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.remove(engine, 'handle_error', self._handle_error)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('xenia_query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.record_query(time.perf_counter() - conn.info['xenia_query_start'].pop())
+
+    def _handle_error(self, exception_context):
+        # A failed statement never reaches after_cursor_execute, take its start time off here. Without an
+        # execution context the error came before the statement was sent and before_cursor_execute didn't run.
+        conn = exception_context.connection
+        if conn is not None and exception_context.execution_context is not None and \
+                conn.info.get('xenia_query_start'):
+            self.record_query(time.perf_counter() - conn.info['xenia_query_start'].pop())
+
+    def snapshot(self):
+        """
+        Returns the current statistics as a dictionary.
+        """
+        with self._lock:
+            methods = {}
+            for method_name, stats in self._methods.items():
+                methods[method_name] = {
+                    'calls': stats.calls,
+                    'errors': stats.errors,
+                    'queries': stats.queries,
+                    'queries_per_call': round(stats.queries / stats.calls, 2) if stats.calls else None,
+                    'rows_written': stats.rows_written,
+                    'total_seconds': round(stats.latency.sum, 6),
+                    'p50_seconds': stats.latency.quantile(0.5),
+                    'p99_seconds': stats.latency.quantile(0.99),
+                    'max_seconds': round(stats.latency.max, 6),
+                    'query_seconds': round(stats.query_latency.sum, 6)
+                }
+            caches = {}
+            for cache_name, (hits, misses) in self._caches.items():
+                caches[cache_name] = {'hits': hits, 'misses': misses,
+                                      'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None}
+            return {
+                'uptime_seconds': round(time.time() - self._start_time, 3),
+                'methods': methods,
+                'caches': caches,
+                'gauges': dict(self._gauges)
+            }
+
+    def prometheus_text(self):
+        """
+        Returns the statistics in the Prometheus text exposition format.
+        """
+        prefix = self.prefix
+        lines = []
+
+        def histogram(metric_name, help_text, histograms):
+            lines.append(f"# HELP {metric_name} {help_text}")
+            lines.append(f"# TYPE {metric_name} histogram")
+            for method_name, hist in histograms:
+                running_count = 0
+                for ndx, bucket_count in enumerate(hist.counts):
+                    running_count += bucket_count
+                    upper_bound = repr(LATENCY_BUCKETS[ndx]) if ndx < len(LATENCY_BUCKETS) else '+Inf'
+                    lines.append(f'{metric_name}_bucket{{method="{method_name}",le="{upper_bound}"}} {running_count}')
+                lines.append(f'{metric_name}_sum{{method="{method_name}"}} {hist.sum!r}')
+                lines.append(f'{metric_name}_count{{method="{method_name}"}} {hist.count}')
+
+        def counter(metric_name, help_text, values):
+            lines.append(f"# HELP {metric_name} {help_text}")
+            lines.append(f"# TYPE {metric_name} counter")
+            for labels, value in values:
+                lines.append(f"{metric_name}{{{labels}}} {value}")
+
+        with self._lock:
+            methods = sorted(self._methods.items())
+            histogram(f"{prefix}_method_duration_seconds", "Time spent in xeniaAlchemy methods.",
+                      [(method_name, stats.latency) for method_name, stats in methods if stats.calls])
+            histogram(f"{prefix}_query_duration_seconds", "SQL statement execution time by calling method.",
+                      [(method_name, stats.query_latency) for method_name, stats in methods if stats.queries])
+            counter(f"{prefix}_method_calls_total", "Calls of xeniaAlchemy methods.",
+                    [(f'method="{method_name}"', stats.calls) for method_name, stats in methods if stats.calls])
+            counter(f"{prefix}_method_errors_total", "Calls of xeniaAlchemy methods that raised.",
+                    [(f'method="{method_name}"', stats.errors) for method_name, stats in methods if stats.calls])
+            counter(f"{prefix}_queries_total", "SQL statements executed by calling method.",
+                    [(f'method="{method_name}"', stats.queries) for method_name, stats in methods])
+            counter(f"{prefix}_rows_written_total", "Rows written by method.",
+                    [(f'method="{method_name}"', stats.rows_written) for method_name, stats in methods
+                     if stats.rows_written])
+            counter(f"{prefix}_cache_requests_total", "Cache lookups by cache and result.",
+                    [(f'cache="{cache_name}",result="{result}"', count)
+                     for cache_name, counts in sorted(self._caches.items())
+                     for result, count in zip(('hit', 'miss'), counts)])
+            gauges = sorted(self._gauges.items())
+        for gauge_name, value in gauges:
+            lines.append(f"# TYPE {prefix}_{gauge_name} gauge")
+            lines.append(f"{prefix}_{gauge_name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary_line(self):
+        """
+        One line summary: per method calls, queries, rows and total time, the busiest methods first.
+        """
+        stats = self.snapshot()
+        method_parts = []
+        for method_name, method_stats in sorted(stats['methods'].items(), key=lambda item: -item[1]['total_seconds']):
+            method_parts.append("%s calls=%d queries=%d rows=%d total=%.3fs" % (
+                method_name, method_stats['calls'], method_stats['queries'], method_stats['rows_written'],
+                method_stats['total_seconds'] or method_stats['query_seconds']))
+        cache_parts = ["%s hit_rate=%s" % (cache_name, cache_stats['hit_rate'])
+                       for cache_name, cache_stats in stats['caches'].items()]
+        gauge_parts = ["%s=%s" % (gauge_name, value) for gauge_name, value in stats['gauges'].items()]
+        return " | ".join(method_parts + cache_parts + gauge_parts)
+
+    def start_periodic_log(self, interval_seconds=60, log=None, level=logging.INFO):
+        """
+        Starts a daemon thread logging summary_line() every interval_seconds.
+        """
+        log = log if log is not None else self.logger
+        self.stop_periodic_log()
+        self._log_stop = threading.Event()
+
+        def log_stats(stop_event):
+            while not stop_event.wait(interval_seconds):
+                log.log(level, "Xenia stats: %s", self.summary_line())
+
+        threading.Thread(target=log_stats, args=(self._log_stop,), name='xenia-metrics-log', daemon=True).start()
+
+    def stop_periodic_log(self):
+        if self._log_stop is not None:
+            self._log_stop.set()
+            self._log_stop = None
+
+    def start_http_server(self, port, host='127.0.0.1'):
+        """
+        Serves prometheus_text() on http://host:port/metrics from a daemon thread. Returns the server.
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                metrics.logger.debug(format, *args)
+
+        self.stop_http_server()
+        self._http_server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self._http_server.serve_forever, name='xenia-metrics-http', daemon=True).start()
+        self.logger.info("Serving metrics on http://%s:%d/metrics", host, self._http_server.server_address[1])
+        return self._http_server
+
+    def stop_http_server(self):
+        if self._http_server is not None:
+            self._http_server.shutdown()
+            self._http_server.server_close()
+            self._http_server = None
+
+
+class _MethodTimer:
+    __slots__ = ('metrics', 'method_name', 'token', 'start_time')
+
+    def __init__(self, metrics, method_name):
+        self.metrics = metrics
+        self.method_name = method_name
+
+    def __enter__(self):
+        self.token = _current_method.set(self.method_name)
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.start_time
+        _current_method.reset(self.token)
+        self.metrics.record_call(self.method_name, elapsed, exc_type is not None)
+        return False
+
+
+def timed(method):
+    """
+    Decorator for methods of objects with a metrics attribute. When metrics is None the method is called
+    directly, otherwise the call is timed and the queries it runs are attributed to it.
+    """
+    method_name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        metrics = self.metrics
+        if metrics is None:
+            return method(self, *args, **kwargs)
+        with _MethodTimer(metrics, method_name):
+            return method(self, *args, **kwargs)
+    return wrapper
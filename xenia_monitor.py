@@ -0,0 +1,340 @@
+"""
+Gap and latency monitoring from sensor.report_interval(seconds).
+
+SensorLatencyTracker runs in the saver: it keeps the newest m_date and its arrival time per sensor in memory,
+counts gaps longer than gap_factor report intervals, and upserts the sensors that changed into the small
+sensor_latency table every flush interval. SensorHealthMonitor reads sensor_latency joined to sensor and
+platform in a single query, so checking thousands of sensors doesn't touch multi_obs, and can record stale
+sensors and platforms in sensor_status/platform_status in bulk.
+"""
+import argparse
+import logging
+import time
+from datetime import datetime
+
+from sqlalchemy import and_, exc, func, insert, or_, select, update
+
+from .database_settings import DatabaseConfiguration
+from .xeniaAlchemy import xeniaAlchemy
+from .XeniaTables import (
+    platform,
+    platform_status,
+    sensor,
+    sensor_latency,
+    sensor_status,
+)
+
+logger = logging.getLogger(__name__)
+
+# Sensor states reported by SensorHealthMonitor.check().
+STATE_OK = 'ok'
+STATE_LATE = 'late'
+STATE_STALE = 'stale'
+STATE_NEVER_REPORTED = 'never_reported'
+
+# sensor_status/platform_status.status written for stale sensors and platforms.
+STALE_STATUS = 1
+
+DEFAULT_AUTHOR = 'xenia_monitor'
+
+
+class SensorLatencyTracker:
+    """
+    Per sensor newest m_date, arrival time and gaps, kept in memory and flushed to sensor_latency.
+    A gap is a step between consecutive m_dates longer than gap_factor times the sensor's report_interval.
+    """
+    def __init__(self, gap_factor=2.0, flush_interval=60):
+        self.gap_factor = gap_factor
+        self.flush_interval = flush_interval
+        # sensor_id -> report_interval seconds.
+        self.report_intervals = {}
+        # sensor_id -> [last_m_date, last_arrival_date, last_latency, new gaps, last_gap_start, last_gap_end]
+        self._sensors = {}
+        # Sensors observed since the last commit point, and since the last flush.
+        self._pending = set()
+        self._dirty = set()
+        self._last_flush = time.monotonic()
+
+    def load(self, db):
+        """
+        Reads the report intervals and the last m_date already recorded for every sensor, so the first record
+        after a restart is checked for a gap too.
+        """
+        # A connection of its own, so the read neither commits nor rolls back work pending on db.session.
+        with db.dbEngine.connect() as connection:
+            self.report_intervals = dict(connection.execute(select(sensor.row_id, sensor.report_interval)
+                                                            .where(sensor.report_interval.isnot(None))).all())
+            for sensor_id, last_m_date, last_arrival_date, last_latency in connection.execute(
+                    select(sensor_latency.sensor_id, sensor_latency.last_m_date, sensor_latency.last_arrival_date,
+                           sensor_latency.last_latency)):
+                self._sensors[sensor_id] = [last_m_date, last_arrival_date, last_latency, 0, None, None]
+
+    def observe(self, sensor_id, m_date):
+        if sensor_id is None or m_date is None:
+            return
+        state = self._sensors.get(sensor_id)
+        if state is None:
+            self._sensors[sensor_id] = [m_date, None, None, 0, None, None]
+        elif state[0] is None or m_date > state[0]:
+            report_interval = self.report_intervals.get(sensor_id)
+            if state[0] is not None and report_interval and \
+                    (m_date - state[0]).total_seconds() > self.gap_factor * report_interval:
+                state[3] += 1
+                state[4] = state[0]
+                state[5] = m_date
+            state[0] = m_date
+        else:
+            return
+        self._pending.add(sensor_id)
+
+    def observe_record(self, rec):
+        if isinstance(rec, dict):
+            self.observe(rec.get('sensor_id'), rec.get('m_date'))
+        else:
+            self.observe(rec.sensor_id, rec.m_date)
+
+    def commit_point(self, db, arrival_date=None):
+        """
+        Called after the observed records are committed: stamps their arrival time and, once flush_interval
+        seconds have passed, flushes the changed sensors. Returns the number of sensors flushed.
+        """
+        if self._pending:
+            arrival_date = arrival_date or datetime.now()
+            for sensor_id in self._pending:
+                state = self._sensors[sensor_id]
+                state[1] = arrival_date
+                state[2] = (arrival_date - state[0]).total_seconds()
+            self._dirty.update(self._pending)
+            self._pending.clear()
+        if self._dirty and time.monotonic() - self._last_flush >= self.flush_interval:
+            return self.flush(db)
+        return 0
+
+    def flush(self, db):
+        """
+        Upserts the changed sensors into sensor_latency with one executemany INSERT ... ON CONFLICT. Returns the
+        number of sensors written.
+        """
+        self._last_flush = time.monotonic()
+        if not self._dirty:
+            return 0
+        dialect_name = db.dbEngine.dialect.name
+        if dialect_name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        elif dialect_name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            raise ValueError("Unsupported dialect: %s for sensor_latency." % (dialect_name))
+        table = sensor_latency.__table__
+        now = datetime.now()
+        rows = []
+        for sensor_id in self._dirty:
+            last_m_date, last_arrival_date, last_latency, gap_count, last_gap_start, last_gap_end = \
+                self._sensors[sensor_id]
+            rows.append({'sensor_id': sensor_id, 'row_update_date': now, 'last_m_date': last_m_date,
+                         'last_arrival_date': last_arrival_date, 'last_latency': last_latency,
+                         'gap_count': gap_count, 'last_gap_start': last_gap_start, 'last_gap_end': last_gap_end})
+        stmt = dialect_insert(table)
+        excluded = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.sensor_id],
+            set_={
+                'row_update_date': excluded.row_update_date,
+                'last_m_date': excluded.last_m_date,
+                'last_arrival_date': excluded.last_arrival_date,
+                'last_latency': excluded.last_latency,
+                'gap_count': table.c.gap_count + excluded.gap_count,
+                'last_gap_start': func.coalesce(excluded.last_gap_start, table.c.last_gap_start),
+                'last_gap_end': func.coalesce(excluded.last_gap_end, table.c.last_gap_end),
+            },
+            # Another saver may have recorded a newer observation for the sensor.
+            where=or_(table.c.last_m_date.is_(None), table.c.last_m_date <= excluded.last_m_date))
+        try:
+            db.session.execute(stmt, rows)
+            db.session.commit()
+        except exc.SQLAlchemyError as e:
+            db.session.rollback()
+            logger.exception(e)
+            return 0
+        for sensor_id in self._dirty:
+            # The gaps are counted in the table now.
+            self._sensors[sensor_id][3] = 0
+        self._dirty.clear()
+        return len(rows)
+
+
+class SensorHealthMonitor:
+    """
+    Compares sensor_latency against sensor.report_interval. A sensor is stale if its newest observation is
+    older than stale_factor report intervals, late if its last observation arrived more than late_factor
+    report intervals after its m_date, and never_reported if it has no sensor_latency row. Only active
+    sensors with a report_interval are checked.
+    """
+    def __init__(self, db, stale_factor=2.0, late_factor=2.0, author=DEFAULT_AUTHOR):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.db = db
+        self.stale_factor = stale_factor
+        self.late_factor = late_factor
+        self.author = author
+
+    """
+    Function: check
+    Purpose: The health of every monitored sensor, from one query over sensor, platform and sensor_latency.
+    Parameters:
+      now, if given, is the time the age of the observations is measured at.
+      platform_handles, if given, limits the check to those platforms.
+    Returns:
+      A list of dictionaries with sensor_id, platform_id, platform_handle, sensor_name, report_interval,
+      last_m_date, last_arrival_date, latency, age(seconds since last_m_date), gap_count, last_gap_start,
+      last_gap_end and state, or None if an error occurred.
+    """
+
+
+    def check(self, now=None, platform_handles=None):
+        now = now or datetime.now()
+        session = self.db.read_session()
+        try:
+            query = session.query(sensor.row_id, sensor.platform_id, platform.platform_handle, sensor.short_name,
+                                  sensor.report_interval, sensor_latency.last_m_date,
+                                  sensor_latency.last_arrival_date, sensor_latency.last_latency,
+                                  sensor_latency.gap_count, sensor_latency.last_gap_start,
+                                  sensor_latency.last_gap_end) \
+                .join(platform, platform.row_id == sensor.platform_id) \
+                .outerjoin(sensor_latency, sensor_latency.sensor_id == sensor.row_id) \
+                .filter(sensor.active == 1) \
+                .filter(sensor.report_interval.isnot(None))
+            if platform_handles is not None:
+                query = query.filter(platform.platform_handle.in_(platform_handles))
+            rows = query.all()
+        except exc.SQLAlchemyError as e:
+            session.rollback()
+            self.logger.exception(e)
+            return None
+
+        results = []
+        for (sensor_id, platform_id, platform_handle, sensor_name, report_interval, last_m_date, last_arrival_date,
+             last_latency, gap_count, last_gap_start, last_gap_end) in rows:
+            age = (now - last_m_date).total_seconds() if last_m_date is not None else None
+            if last_m_date is None:
+                state = STATE_NEVER_REPORTED
+            elif age > self.stale_factor * report_interval:
+                state = STATE_STALE
+            elif last_latency is not None and last_latency > self.late_factor * report_interval:
+                state = STATE_LATE
+            else:
+                state = STATE_OK
+            results.append({'sensor_id': sensor_id, 'platform_id': platform_id, 'platform_handle': platform_handle,
+                            'sensor_name': sensor_name, 'report_interval': report_interval,
+                            'last_m_date': last_m_date, 'last_arrival_date': last_arrival_date,
+                            'latency': last_latency, 'age': age, 'gap_count': gap_count or 0,
+                            'last_gap_start': last_gap_start, 'last_gap_end': last_gap_end, 'state': state})
+        return results
+
+    """
+    Function: write_status
+    Purpose: Records the check results in sensor_status and platform_status: an open row(end_date NULL) is
+    added for each sensor that became stale and for each platform whose monitored sensors are all stale, and
+    the open rows of sensors and platforms that recovered are closed. Only rows written by this monitor's
+    author are touched.
+    Parameters:
+      results is the check() result.
+    Returns:
+      A dictionary with the sensor and platform rows opened and closed, or None if an error occurred.
+    """
+
+
+    def write_status(self, results, now=None):
+        now = now or datetime.now()
+        session = self.db.session
+        stale = {result['sensor_id']: result for result in results if result['state'] == STATE_STALE}
+        platforms = {}
+        for result in results:
+            platforms.setdefault(result['platform_id'], []).append(result)
+        stale_platforms = {platform_id: platform_results[0]['platform_handle']
+                           for platform_id, platform_results in platforms.items()
+                           if all(result['state'] == STATE_STALE for result in platform_results)}
+        stats = {}
+        try:
+            open_sensors = set(session.execute(select(sensor_status.sensor_id)
+                                               .where(sensor_status.author == self.author,
+                                                      sensor_status.end_date.is_(None))).scalars())
+            new_sensors = [{'sensor_id': sensor_id, 'sensor_name': result['sensor_name'],
+                            'platform_id': result['platform_id'], 'row_entry_date': now,
+                            'begin_date': result['last_m_date'], 'author': self.author, 'status': STALE_STATUS,
+                            'reason': "No observations for %d seconds, report interval %d seconds." % (
+                                result['age'], result['report_interval'])}
+                           for sensor_id, result in stale.items() if sensor_id not in open_sensors]
+            if new_sensors:
+                session.execute(insert(sensor_status.__table__), new_sensors)
+            recovered_sensors = [sensor_id for sensor_id in open_sensors
+                                 if sensor_id not in stale and any(result['sensor_id'] == sensor_id
+                                                                   for result in results)]
+            if recovered_sensors:
+                session.execute(update(sensor_status.__table__)
+                                .where(and_(sensor_status.author == self.author, sensor_status.end_date.is_(None),
+                                            sensor_status.sensor_id.in_(recovered_sensors)))
+                                .values(end_date=now, row_update_date=now))
+
+            open_platforms = set(session.execute(select(platform_status.platform_id)
+                                                 .where(platform_status.author == self.author,
+                                                        platform_status.end_date.is_(None))).scalars())
+            new_platforms = [{'platform_id': platform_id, 'platform_handle': platform_handle, 'row_entry_date': now,
+                              'begin_date': now, 'author': self.author, 'status': STALE_STATUS,
+                              'reason': "Every monitored sensor is stale."}
+                             for platform_id, platform_handle in stale_platforms.items()
+                             if platform_id not in open_platforms]
+            if new_platforms:
+                session.execute(insert(platform_status.__table__), new_platforms)
+            recovered_platforms = [platform_id for platform_id in open_platforms
+                                   if platform_id in platforms and platform_id not in stale_platforms]
+            if recovered_platforms:
+                session.execute(update(platform_status.__table__)
+                                .where(and_(platform_status.author == self.author,
+                                            platform_status.end_date.is_(None),
+                                            platform_status.platform_id.in_(recovered_platforms)))
+                                .values(end_date=now, row_update_date=now))
+            session.commit()
+            stats = {'sensors_opened': len(new_sensors), 'sensors_closed': len(recovered_sensors),
+                     'platforms_opened': len(new_platforms), 'platforms_closed': len(recovered_platforms)}
+        except exc.SQLAlchemyError as e:
+            session.rollback()
+            self.logger.exception(e)
+            return None
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report stale and late sensors from sensor_latency.")
+    parser.add_argument("--ini", required=True, help="ini file with the [Database] section.")
+    parser.add_argument("--stale-factor", type=float, default=2.0)
+    parser.add_argument("--late-factor", type=float, default=2.0)
+    parser.add_argument("--platform", action="append", default=None, help="Platform handle, may be repeated.")
+    parser.add_argument("--write-status", action="store_true",
+                        help="Record stale sensors and platforms in sensor_status/platform_status.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    config = DatabaseConfiguration(None, ini_file=args.ini)
+    db = xeniaAlchemy()
+    if not db.connect_db(config.get_connection_string(), False, read_replicas=config.get_read_replica_connection_strings(),
+                         sqlite_pragmas=config.sqlite_pragmas, spatialite=config.spatialite):
+        return 1
+    try:
+        monitor = SensorHealthMonitor(db, stale_factor=args.stale_factor, late_factor=args.late_factor)
+        results = monitor.check(platform_handles=args.platform)
+        if results is None:
+            return 1
+        for result in results:
+            if result['state'] != STATE_OK:
+                logger.info("%s %s(%s) last m_date: %s latency: %s gaps: %d", result['state'],
+                            result['platform_handle'], result['sensor_id'], result['last_m_date'], result['latency'],
+                            result['gap_count'])
+        if args.write_status and monitor.write_status(results) is None:
+            return 1
+    finally:
+        db.disconnect()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -3,83 +3,99 @@ import logging
 from datetime import datetime
 from enum import Enum
 
-from xeniaAlchemy import xeniaAlchemy
-
 
 class ObsMap:
-    def __init__(self):
-        self.__target_obs = None
-        self.__target_uom = None
-        self.__source_obs = None
-        self.__source_uom = None
-        self.__source_index = None
-        self.__s_order = 1
-        self.__sensor_id = None
-        self.__m_type_id = None
-
-    @property
-    def target_obs(self):
-        return self.__target_obs
-
-    @target_obs.setter
-    def target_obs(self, target_obs):
-        self.__target_obs = target_obs
-
-    @property
-    def target_uom(self):
-        return self.__target_uom
-
-    @target_uom.setter
-    def target_uom(self, target_uom):
-        self.__target_uom = target_uom
-
-    @property
-    def source_obs(self):
-        return self.__source_obs
-
-    @source_obs.setter
-    def source_obs(self, source_obs):
-        self.__source_obs = source_obs
-
-    @property
-    def source_uom(self):
-        return self.__source_uom
-
-    @source_uom.setter
-    def source_uom(self, source_uom):
-        self.__source_uom = source_uom
-
-    @property
-    def s_order(self):
-        return self.__s_order
-
-    @s_order.setter
-    def s_order(self, s_order):
-        self.__s_order = s_order
-
-    @property
-    def source_index(self):
-        return self.__source_index
-
-    @source_index.setter
-    def source_index(self, source_index):
-        self.__source_index = source_index
-
-    @property
-    def sensor_id(self):
-        return self.__sensor_id
+    # ObsMap records are read in the innermost loop of every ingest and we keep
+    # them for thousands of platforms, so they are plain slotted attributes rather
+    # than properties over a per-instance __dict__.
+    __slots__ = ('target_obs', 'target_uom', 'source_obs', 'source_uom', 'source_index',
+                 's_order', 'sensor_id', 'm_type_id')
+
+    def __init__(self, target_obs=None, target_uom=None, source_obs=None, source_uom=None,
+                 source_index=None, s_order=1, sensor_id=None, m_type_id=None):
+        self.target_obs = target_obs
+        self.target_uom = target_uom
+        self.source_obs = source_obs
+        self.source_uom = source_uom
+        self.source_index = source_index
+        self.s_order = s_order
+        self.sensor_id = sensor_id
+        self.m_type_id = m_type_id
+
+    def __repr__(self):
+        return "ObsMap(target_obs=%r, target_uom=%r, source_obs=%r, s_order=%r, sensor_id=%r, m_type_id=%r)" % (
+            self.target_obs, self.target_uom, self.source_obs, self.s_order, self.sensor_id, self.m_type_id)
+
+
+def iter_json_array(json_file, chunk_size=65536):
+    """
+    Incrementally parses a file containing a JSON array, yielding one element at a time. Only the current
+    element and a chunk_size read buffer are held in memory, not the whole document.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+    started = False
+
+    def fill(buffer, position):
+        data = json_file.read(chunk_size)
+        return buffer[position:] + data, 0, data == ""
+
+    while True:
+        # Skip whitespace and separators, reading more if we run out of buffer.
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer) or eof:
+                break
+            buffer, position, eof = fill(buffer, position)
+        if position >= len(buffer):
+            raise ValueError("Unexpected end of JSON array.")
+
+        if not started:
+            if buffer[position] != '[':
+                raise ValueError("Expected a JSON array, found: %r" % (buffer[position]))
+            started = True
+            position += 1
+            continue
+        if buffer[position] == ']':
+            return
 
-    @sensor_id.setter
-    def sensor_id(self, sensor_id):
-        self.__sensor_id = sensor_id
-
-    @property
-    def m_type_id(self):
-        return self.__m_type_id
-
-    @m_type_id.setter
-    def m_type_id(self, m_type_id):
-        self.__m_type_id = m_type_id
+        try:
+            element, end = decoder.raw_decode(buffer, position)
+            # An element is only complete once the character after it has been read: "1.5" or "1.5e" at the end
+            # of a chunk decode as 1.5 but may be the start of "1.5e3".
+            if not eof:
+                next_position = end
+                while next_position < len(buffer) and buffer[next_position] in " \t\r\n":
+                    next_position += 1
+                if next_position == len(buffer) or buffer[next_position] not in ",]":
+                    raise json.JSONDecodeError("Element may continue in next chunk.", buffer, end)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            buffer, position, eof = fill(buffer, position)
+            continue
+        position = end
+        yield element
+        # Keep the buffer from growing with consumed elements.
+        if position > chunk_size:
+            buffer = buffer[position:]
+            position = 0
+
+
+def obs_map_from_json(obs):
+    xenia_obs = ObsMap()
+    xenia_obs.target_obs = obs['target_obs']
+    if obs['target_uom'] is not None:
+        xenia_obs.target_uom = obs['target_uom']
+    xenia_obs.source_obs = obs['header_column']
+    if obs['source_uom'] is not None:
+        xenia_obs.source_uom = obs['source_uom']
+    if obs['s_order'] is not None:
+        xenia_obs.s_order = obs['s_order']
+    return xenia_obs
 
 
 class JSONObsMap:
@@ -90,59 +106,58 @@ class JSONObsMap:
     def load_json_mapping(self, file_name):
         try:
             with open(file_name, "r") as obs_json:
-                obs_json = json.load(obs_json)
-                self.load_json(obs_json)
+                self.load_json(iter_json_array(obs_json))
         except Exception as e:
             self.logger.exception(e)
             raise
 
     def load_json(self, obs_json):
         for obs in obs_json:
-            xenia_obs = ObsMap()
-            xenia_obs.target_obs = obs['target_obs']
-            if obs['target_uom'] is not None:
-                xenia_obs.target_uom = obs['target_uom']
-            xenia_obs.source_obs = obs['header_column']
-            if obs['source_uom'] is not None:
-                xenia_obs.source_uom = obs['source_uom']
-            if obs['s_order'] is not None:
-                xenia_obs.s_order = obs['s_order']
-            self.obs.append(xenia_obs)
+            self.obs.append(obs_map_from_json(obs))
 
     def build_db_mappings(self, **kwargs):
         add_missing = kwargs.get('add_missing', False)
-        db = xeniaAlchemy()
-        if db.connect_db(kwargs['db_connectionstring'],False):
-            self.logger.info("Successfully connect to DB: %s at %s" % (kwargs['db_name'], kwargs['db_host']))
-        else:
-            self.logger.error(
-                "Unable to connect to DB: %s at %s. Terminating script." % (kwargs['db_name'], kwargs['db_host']))
-
-        entry_date = datetime.now()
-        for obs_rec in self.obs:
-            if obs_rec.target_obs != 'm_date':
-                self.logger.debug("Platform: %s checking sensor exists %s(%s) s_order: %d" % (kwargs['platform_handle'],
-                                                                                              obs_rec.target_obs,
-                                                                                              obs_rec.target_uom,
-                                                                                              obs_rec.s_order))
-                sensor_id = db.sensorExists(obs_rec.target_obs, obs_rec.target_uom, kwargs['platform_handle'],
-                                            obs_rec.s_order)
-                if sensor_id is None:
-                    self.logger.debug("Sensor does not exist, adding")
-                    platform_id = db.platformExists(kwargs['platform_handle'])
-                    sensor_id = db.newSensor(entry_date.strftime('%Y-%m-%d %H:%M:%S'),
-                                             obs_rec.target_obs,
-                                             obs_rec.target_uom,
-                                             platform_id,
-                                             1,
-                                             0,
-                                             obs_rec.s_order,
-                                             None,
-                                             add_missing)
-                obs_rec.sensor_id = sensor_id
-                m_type_id = db.mTypeExists(obs_rec.target_obs, obs_rec.target_uom)
-                obs_rec.m_type_id = m_type_id
-        db.disconnect()
+        # Callers resolving many platforms can pass in an open connection so we don't connect per platform.
+        db = kwargs.get('db', None)
+        owns_connection = db is None
+        if owns_connection:
+            # Imported here so loading and querying the JSON mappings doesn't pull in SQLAlchemy and the models.
+            from .xeniaAlchemy import xeniaAlchemy
+
+            db = xeniaAlchemy()
+            if db.connect_db(kwargs['db_connectionstring'],False):
+                self.logger.info("Successfully connect to DB: %s at %s", kwargs['db_name'], kwargs['db_host'])
+            else:
+                self.logger.error(
+                    "Unable to connect to DB: %s at %s. Terminating script." % (kwargs['db_name'], kwargs['db_host']))
+
+        # Resolving ids for writes, so read from the primary: a lagging replica could make an existing
+        # sensor look missing and get it added twice.
+        with db.primary():
+            entry_date = datetime.now()
+            for obs_rec in self.obs:
+                if obs_rec.target_obs != 'm_date':
+                    self.logger.debug("Platform: %s checking sensor exists %s(%s) s_order: %d", kwargs['platform_handle'],
+                                      obs_rec.target_obs, obs_rec.target_uom, obs_rec.s_order)
+                    sensor_id = db.sensorExists(obs_rec.target_obs, obs_rec.target_uom, kwargs['platform_handle'],
+                                                obs_rec.s_order)
+                    if sensor_id is None:
+                        self.logger.debug("Sensor does not exist, adding")
+                        platform_id = db.platformExists(kwargs['platform_handle'])
+                        sensor_id = db.newSensor(entry_date,
+                                                 obs_rec.target_obs,
+                                                 obs_rec.target_uom,
+                                                 platform_id,
+                                                 1,
+                                                 0,
+                                                 obs_rec.s_order,
+                                                 None,
+                                                 add_missing)
+                    obs_rec.sensor_id = sensor_id
+                    m_type_id = db.mTypeExists(obs_rec.target_obs, obs_rec.target_uom)
+                    obs_rec.m_type_id = m_type_id
+        if owns_connection:
+            db.disconnect()
 
     def get_date_field(self):
         for obs in self.obs:
@@ -213,3 +228,88 @@ class PlatformObsMap(dict):
             elif filter_method == SearchFilter.SENSOR_ID_FILTER:
                 obs_rec = platform_obs_map.get_rec_from_sensor_id(filter_value)
         return obs_rec
+
+    def load_json_mapping(self, file_name, platform_handles=None):
+        """
+        Streams a merged mapping file, a JSON array of mapping entries each with a platform_handle key, into
+        this PlatformObsMap. Entries are parsed one at a time, so peak memory follows the retained mappings
+        rather than the file size. If platform_handles is given, only entries for those platforms are kept.
+        Returns the number of entries kept.
+        """
+        if platform_handles is not None:
+            platform_handles = set(platform_handles)
+        kept_count = 0
+        try:
+            with open(file_name, "r") as obs_json:
+                for obs in iter_json_array(obs_json):
+                    platform_handle = obs['platform_handle']
+                    if platform_handles is not None and platform_handle not in platform_handles:
+                        continue
+                    platform_obs_map = self.get(platform_handle, None)
+                    if platform_obs_map is None:
+                        platform_obs_map = JSONObsMap()
+                        self[platform_handle] = platform_obs_map
+                    platform_obs_map.add_obs(obs_map_from_json(obs))
+                    kept_count += 1
+        except Exception as e:
+            self.logger.exception(e)
+            raise
+        self.logger.debug("Loaded %d mappings for %d platforms from: %s", kept_count, len(self), file_name)
+        return kept_count
+
+    def load_mappings(self, mapping_files: dict, **kwargs):
+        """
+        Loads the JSON mapping file for each platform and resolves the sensor_id/m_type_id of every
+        observation against the database.
+        mapping_files is a dictionary keyed on platform handle with the JSON mapping file as the value.
+        kwargs are passed through to JSONObsMap.build_db_mappings(db_connectionstring, db_name, db_host and
+        add_missing). If cache_file is given, the resolved maps are stored in an ObsMapCache and later loads
+        reuse them as long as the mapping files and the database sensor fingerprint are unchanged. Passing
+        validate_cache=False trusts a cache built from the same mapping files without touching the database.
+        An optional metrics(xenia_metrics.XeniaMetrics) collects the database and cache statistics.
+        """
+        from .xenia_obs_map_cache import ObsMapCache, mapping_files_signature
+        from .xeniaAlchemy import xeniaAlchemy
+
+        cache = None
+        source_signature = None
+        validate_cache = kwargs.get('validate_cache', True)
+        if kwargs.get('cache_file', None) is not None:
+            cache = ObsMapCache(kwargs['cache_file'], kwargs.get('metrics'))
+            source_signature = mapping_files_signature(mapping_files)
+            if not validate_cache:
+                cached_map = cache.load(source_signature, check_db=False)
+                if cached_map is not None:
+                    self.update(cached_map)
+                    return True
+
+        db = xeniaAlchemy()
+        if not db.connect_db(kwargs['db_connectionstring'], False, metrics=kwargs.get('metrics')):
+            self.logger.error("Unable to connect to DB: %s at %s." % (kwargs.get('db_name'), kwargs.get('db_host')))
+            return False
+        try:
+            if cache is not None:
+                cached_map = cache.load(source_signature, db.get_sensor_fingerprint())
+                if cached_map is not None:
+                    self.logger.info("Loaded %d platform obs maps from cache: %s", len(cached_map), cache.file_path)
+                    self.update(cached_map)
+                    return True
+
+            for platform_handle, file_name in mapping_files.items():
+                obs_map = JSONObsMap()
+                obs_map.load_json_mapping(file_name)
+                obs_map.build_db_mappings(platform_handle=platform_handle, db=db,
+                                          add_missing=kwargs.get('add_missing', False))
+                self[platform_handle] = obs_map
+
+            if cache is not None:
+                # Fingerprint after resolving since adding missing sensors changes it.
+                db_fingerprint = db.get_sensor_fingerprint()
+                if db_fingerprint is not None:
+                    cache.save(self, source_signature, db_fingerprint)
+                else:
+                    self.logger.error("Unable to read the sensor fingerprint, obs map cache: %s not saved.",
+                                      cache.file_path)
+        finally:
+            db.disconnect()
+        return True
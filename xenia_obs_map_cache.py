@@ -0,0 +1,135 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+
+from .xenia_obs_map import JSONObsMap, ObsMap, PlatformObsMap
+
+# Bump whenever the layout of the cache tables or the meaning of a column changes. A cache written
+# with a different version is discarded and rebuilt.
+CACHE_VERSION = 1
+
+OBS_MAP_COLUMNS = ('target_obs', 'target_uom', 'source_obs', 'source_uom', 'source_index',
+                   's_order', 'sensor_id', 'm_type_id')
+
+
+def mapping_files_signature(mapping_files):
+    """
+    Signature of the JSON mapping files a PlatformObsMap was built from. mapping_files is a dictionary
+    keyed on platform handle with the JSON mapping file as the value. A change to the set of platforms or
+    to any file's size or modification time changes the signature.
+    """
+    signature = hashlib.sha1()
+    for platform_handle in sorted(mapping_files):
+        file_name = mapping_files[platform_handle]
+        file_stat = os.stat(file_name)
+        signature.update(("%s|%s|%d|%d\n" % (platform_handle, os.path.abspath(file_name),
+                                             file_stat.st_size, file_stat.st_mtime_ns)).encode('utf-8'))
+    return signature.hexdigest()
+
+
+class ObsMapCache:
+    """
+    Versioned on-disk SQLite cache of fully resolved PlatformObsMap contents(sensor_id, m_type_id included).
+    The cache is stored along with the source signature of the mapping files and the database fingerprint
+    from xeniaAlchemy.get_sensor_fingerprint() it was resolved against, a load only succeeds when both match.
+    """
+    def __init__(self, file_path, metrics=None):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.file_path = file_path
+        # Optional xenia_metrics.XeniaMetrics, load() records a hit or miss in it.
+        self.metrics = metrics
+
+    def _connect(self):
+        connection = sqlite3.connect(self.file_path)
+        connection.execute("CREATE TABLE IF NOT EXISTS cache_info (key TEXT PRIMARY KEY, value TEXT)")
+        version = connection.execute("SELECT value FROM cache_info WHERE key = 'version'").fetchone()
+        if version is None or int(version[0]) != CACHE_VERSION:
+            if version is not None:
+                self.logger.info("Obs map cache: %s version %s does not match %d, rebuilding.",
+                                 self.file_path, version[0], CACHE_VERSION)
+            with connection:
+                connection.execute("DROP TABLE IF EXISTS obs_map")
+                connection.execute("DELETE FROM cache_info")
+                connection.execute("CREATE TABLE obs_map (platform_handle TEXT NOT NULL, %s)" % (
+                    ", ".join(OBS_MAP_COLUMNS)))
+                connection.execute("INSERT INTO cache_info (key, value) VALUES ('version', ?)", (str(CACHE_VERSION),))
+        return connection
+
+    def _get_info(self, connection, key):
+        rec = connection.execute("SELECT value FROM cache_info WHERE key = ?", (key,)).fetchone()
+        if rec is not None:
+            return json.loads(rec[0])
+        return None
+
+    def is_valid(self, source_signature, db_fingerprint=None, check_db=True):
+        """
+        Returns True if the cache was built from the given mapping files signature and against the same
+        database fingerprint. A None db_fingerprint, the database couldn't be read, is a miss. Only with
+        check_db=False is the database fingerprint not compared.
+        """
+        if not os.path.exists(self.file_path):
+            return False
+        if check_db and db_fingerprint is None:
+            return False
+        connection = self._connect()
+        try:
+            if self._get_info(connection, 'source_signature') != source_signature:
+                return False
+            if check_db and self._get_info(connection, 'db_fingerprint') != list(db_fingerprint):
+                return False
+            return True
+        finally:
+            connection.close()
+
+    def load(self, source_signature, db_fingerprint=None, check_db=True):
+        """
+        Returns a PlatformObsMap populated from the cache, or None if the cache is missing or stale. See
+        is_valid() for db_fingerprint and check_db.
+        """
+        if not self.is_valid(source_signature, db_fingerprint, check_db):
+            self.logger.debug("Obs map cache: %s is missing or stale.", self.file_path)
+            if self.metrics is not None:
+                self.metrics.record_cache('obs_map', False)
+            return None
+        if self.metrics is not None:
+            self.metrics.record_cache('obs_map', True)
+
+        platform_obs_map = PlatformObsMap()
+        connection = self._connect()
+        try:
+            cursor = connection.execute("SELECT platform_handle, %s FROM obs_map ORDER BY rowid" % (
+                ", ".join(OBS_MAP_COLUMNS)))
+            for rec in cursor:
+                obs_map = platform_obs_map.get(rec[0])
+                if obs_map is None:
+                    obs_map = JSONObsMap()
+                    platform_obs_map[rec[0]] = obs_map
+                obs_map.add_obs(ObsMap(*rec[1:]))
+        finally:
+            connection.close()
+        self.logger.debug("Obs map cache: %s loaded %d platforms.", self.file_path, len(platform_obs_map))
+        return platform_obs_map
+
+    def save(self, platform_obs_map, source_signature, db_fingerprint):
+        """
+        Replaces the cache contents with the given PlatformObsMap.
+        """
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute("DELETE FROM obs_map")
+                connection.executemany(
+                    "INSERT INTO obs_map (platform_handle, %s) VALUES (?, %s)" % (
+                        ", ".join(OBS_MAP_COLUMNS), ", ".join("?" * len(OBS_MAP_COLUMNS))),
+                    ((platform_handle,) + tuple(getattr(obs_rec, column) for column in OBS_MAP_COLUMNS)
+                     for platform_handle, obs_map in platform_obs_map.items()
+                     for obs_rec in obs_map))
+                connection.execute("INSERT OR REPLACE INTO cache_info (key, value) VALUES ('source_signature', ?)",
+                                   (json.dumps(source_signature),))
+                connection.execute("INSERT OR REPLACE INTO cache_info (key, value) VALUES ('db_fingerprint', ?)",
+                                   (json.dumps(list(db_fingerprint) if db_fingerprint is not None else None),))
+        finally:
+            connection.close()
+        self.logger.debug("Obs map cache: %s saved %d platforms.", self.file_path, len(platform_obs_map))
@@ -0,0 +1,136 @@
+import logging
+import math
+
+from .xenia_spatial import EARTH_RADIUS_KM, haversine_km
+
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+
+
+class PlatformSpatialIndex:
+    """
+    In-process grid index of active platform locations for radius and k-nearest lookups without a database
+    round trip. Platforms are bucketed into cell_size degree lon/lat cells, a query only measures the
+    haversine distance to platforms in the cells that can contain a match.
+    Load once with load(), then call refresh() periodically to pick up platforms added, moved or deactivated
+    since the last load(based on row_update_date, or row_entry_date for rows never updated).
+    """
+    def __init__(self, cell_size=1.0):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.cell_size = cell_size
+        self._lon_cells = int(math.ceil(360.0 / cell_size))
+        self._lat_cells = int(math.ceil(180.0 / cell_size))
+        # platform_handle -> (row_id, lon, lat)
+        self._platforms = {}
+        # (lon cell, lat cell) -> set of platform handles
+        self._grid = {}
+        self._last_change_date = None
+
+    def __len__(self):
+        return len(self._platforms)
+
+    def __contains__(self, platform_handle):
+        return platform_handle in self._platforms
+
+    def _cell(self, lon, lat):
+        lon_cell = int(math.floor((lon + 180.0) / self.cell_size)) % self._lon_cells
+        lat_cell = min(int(math.floor((lat + 90.0) / self.cell_size)), self._lat_cells - 1)
+        return lon_cell, lat_cell
+
+    def add(self, platform_handle, row_id, lon, lat):
+        self.remove(platform_handle)
+        self._platforms[platform_handle] = (row_id, lon, lat)
+        self._grid.setdefault(self._cell(lon, lat), set()).add(platform_handle)
+
+    def remove(self, platform_handle):
+        entry = self._platforms.pop(platform_handle, None)
+        if entry is not None:
+            cell = self._cell(entry[1], entry[2])
+            cell_platforms = self._grid[cell]
+            cell_platforms.discard(platform_handle)
+            if not cell_platforms:
+                del self._grid[cell]
+
+    def _apply(self, platform_recs):
+        for rec in platform_recs:
+            if rec.active == 1 and rec.fixed_longitude is not None and rec.fixed_latitude is not None:
+                self.add(rec.platform_handle, rec.row_id, rec.fixed_longitude, rec.fixed_latitude)
+            else:
+                self.remove(rec.platform_handle)
+            if rec.changed_date is not None and \
+                    (self._last_change_date is None or rec.changed_date > self._last_change_date):
+                self._last_change_date = rec.changed_date
+
+    def load(self, db):
+        """
+        (Re)builds the index from all platforms in the database. db is a connected xeniaAlchemy object.
+        Returns True if successful.
+        """
+        platform_recs = db.get_platform_locations()
+        if platform_recs is None:
+            return False
+        self._platforms = {}
+        self._grid = {}
+        self._last_change_date = None
+        self._apply(platform_recs)
+        self.logger.debug("Platform index loaded %d active platforms.", len(self._platforms))
+        return True
+
+    def refresh(self, db):
+        """
+        Applies the platforms added or changed since the last load/refresh. Returns the number of platform rows
+        applied, or None if the query failed.
+        """
+        if self._last_change_date is None:
+            return len(self) if self.load(db) else None
+        platform_recs = db.get_platform_locations(self._last_change_date)
+        if platform_recs is None:
+            return None
+        self._apply(platform_recs)
+        return len(platform_recs)
+
+    def within_radius(self, lon, lat, radius_km):
+        """
+        Returns a list of (platform_handle, row_id, distance_km) for the platforms within radius_km of the
+        point, ordered by distance.
+        """
+        # Bounding box of the search circle, the longitude span widens towards the poles and covers every
+        # longitude once the circle contains a pole.
+        angular_radius = radius_km / EARTH_RADIUS_KM
+        lat_span = math.degrees(angular_radius)
+        cos_lat = math.cos(math.radians(lat))
+        if abs(lat) + lat_span >= 90.0 or math.sin(angular_radius) >= cos_lat:
+            lon_span = 180.0
+        else:
+            lon_span = math.degrees(math.asin(math.sin(angular_radius) / cos_lat))
+        center_lon_cell, center_lat_cell = self._cell(lon, lat)
+        lon_cell_span = int(math.ceil(lon_span / self.cell_size))
+        lat_cell_span = int(math.ceil(lat_span / self.cell_size))
+        if 2 * lon_cell_span + 1 >= self._lon_cells:
+            lon_cells = range(self._lon_cells)
+        else:
+            lon_cells = [(center_lon_cell + ndx) % self._lon_cells for ndx in range(-lon_cell_span, lon_cell_span + 1)]
+
+        matches = []
+        for lat_ndx in range(max(0, center_lat_cell - lat_cell_span),
+                             min(self._lat_cells, center_lat_cell + lat_cell_span + 1)):
+            for lon_ndx in lon_cells:
+                for platform_handle in self._grid.get((lon_ndx, lat_ndx), ()):
+                    row_id, platform_lon, platform_lat = self._platforms[platform_handle]
+                    distance = haversine_km(lon, lat, platform_lon, platform_lat)
+                    if distance <= radius_km:
+                        matches.append((platform_handle, row_id, distance))
+        matches.sort(key=lambda match: match[2])
+        return matches
+
+    def nearest(self, lon, lat, count=1):
+        """
+        Returns a list of (platform_handle, row_id, distance_km) for the count platforms nearest the point,
+        ordered by distance.
+        """
+        # Grow the search radius until it holds enough platforms, starting at about one grid cell.
+        radius_km = self.cell_size * KM_PER_DEGREE
+        while True:
+            matches = self.within_radius(lon, lat, radius_km)
+            if len(matches) >= count or radius_km >= math.pi * EARTH_RADIUS_KM:
+                return matches[:count]
+            radius_km *= 2
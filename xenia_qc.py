@@ -0,0 +1,492 @@
+"""
+Quality control for multi_obs: range, spike, rate of change(gradient) and flat line tests run vectorized
+with NumPy over each sensor's time window, the results written back to qc_flag and qc_level in bulk.
+
+Each test produces a QARTOD style flag per observation:
+    1 pass, 2 not evaluated, 3 suspect, 4 fail, 9 missing value.
+qc_flag holds the four test flags as a string in QC_TESTS order, e.g. "1131" is a suspect gradient.
+qc_level is the Xenia summary of the worst flag, see QC_LEVEL_*.
+
+Limits are looked up per sensor first, then per m_type. They can be built in code or read from an ini file,
+one section per m_type or sensor:
+    [QC m_type 12]
+    range_min = -5
+    range_max = 40
+    spike_suspect = 2
+    spike_fail = 5
+    [QC sensor 1034]
+    flat_line_tolerance = 0.001
+    flat_line_suspect_count = 6
+    flat_line_fail_count = 12
+
+QCEngine runs the tests over data already in the database. StreamingQC runs them record by record as the
+saver writes, from a small rolling window kept per sensor, it needs no numpy.
+
+numpy is an optional dependency, needed when QCEngine runs.
+"""
+import argparse
+import collections
+import logging
+import math
+import time
+from configparser import ConfigParser
+from datetime import datetime, timedelta
+
+from sqlalchemy import (
+    Integer,
+    String,
+    bindparam,
+    column,
+    exc,
+    or_,
+    select,
+    update,
+    values,
+)
+
+from .database_settings import DatabaseConfiguration
+from .xeniaAlchemy import xeniaAlchemy
+from .XeniaTables import multi_obs
+
+logger = logging.getLogger(__name__)
+
+QC_TESTS = ('range', 'spike', 'gradient', 'flat_line')
+
+FLAG_PASS = 1
+FLAG_NOT_EVALUATED = 2
+FLAG_SUSPECT = 3
+FLAG_FAIL = 4
+FLAG_MISSING = 9
+
+QC_LEVEL_NO_DATA = -9
+QC_LEVEL_NOT_EVALUATED = 0
+QC_LEVEL_BAD = 1
+QC_LEVEL_SUSPECT = 2
+QC_LEVEL_GOOD = 3
+
+LIMIT_NAMES = ('range_min', 'range_max', 'suspect_min', 'suspect_max', 'spike_suspect', 'spike_fail',
+               'gradient_suspect', 'gradient_fail', 'flat_line_tolerance', 'flat_line_suspect_count',
+               'flat_line_fail_count', 'sigma_suspect', 'sigma_fail')
+
+QC_SECTION_PREFIX = 'QC '
+
+# Rows per UPDATE ... FROM (VALUES ...) statement, 3 bound parameters each.
+UPDATE_CHUNK_SIZE = 5000
+
+
+def require_numpy():
+    try:
+        import numpy
+    except ImportError as e:
+        raise ImportError("numpy is required for the QC tests: pip install numpy") from e
+    return numpy
+
+
+class QCLimits:
+    """
+    Test limits for one m_type or sensor, a test runs only if its limits are set.
+      range_min, range_max: values outside fail. suspect_min, suspect_max: values outside are suspect.
+      spike_suspect, spike_fail: height of a value above the mean of its neighbours, less half their difference.
+      gradient_suspect, gradient_fail: absolute change per second from the previous value.
+      flat_line_tolerance with flat_line_suspect_count/flat_line_fail_count: the number of consecutive values
+      within the tolerance of the previous one that is suspect/fails.
+      sigma_suspect, sigma_fail: StreamingQC only, standard deviations from the rolling mean, reported with
+      the spike test.
+    """
+    def __init__(self, **limits):
+        for name in LIMIT_NAMES:
+            setattr(self, name, limits.pop(name, None))
+        if limits:
+            raise ValueError("Unsupported QC limits: %s" % (', '.join(limits)))
+
+    def __repr__(self):
+        return "QCLimits(%s)" % (', '.join("%s=%s" % (name, getattr(self, name)) for name in LIMIT_NAMES
+                                           if getattr(self, name) is not None))
+
+
+class QCLimitsTable:
+    """
+    QCLimits keyed by sensor_id and m_type_id, a sensor's own limits take precedence over its m_type's.
+    """
+    def __init__(self, by_m_type=None, by_sensor=None):
+        self.by_m_type = dict(by_m_type or {})
+        self.by_sensor = dict(by_sensor or {})
+
+    def __bool__(self):
+        return bool(self.by_m_type or self.by_sensor)
+
+    def limits_for(self, sensor_id, m_type_id):
+        limits = self.by_sensor.get(sensor_id)
+        if limits is None:
+            limits = self.by_m_type.get(m_type_id)
+        return limits
+
+    @classmethod
+    def from_config(cls, config_file):
+        """
+        Builds the table from the "QC m_type <id>" and "QC sensor <id>" sections of a ConfigParser.
+        """
+        table = cls()
+        for section in config_file.sections():
+            if not section.startswith(QC_SECTION_PREFIX):
+                continue
+            key_type, _, key = section[len(QC_SECTION_PREFIX):].strip().partition(' ')
+            limits = QCLimits(**{name: config_file.getfloat(section, name) for name in config_file.options(section)})
+            if key_type == 'm_type':
+                table.by_m_type[int(key)] = limits
+            elif key_type == 'sensor':
+                table.by_sensor[int(key)] = limits
+            else:
+                raise ValueError("Unsupported QC section: %s, use [QC m_type <id>] or [QC sensor <id>]" % (section))
+        return table
+
+
+def run_qc_tests(times, values, limits):
+    """
+    Runs the QC tests over one sensor's observations in time order.
+    Parameters:
+      times is a numpy datetime64 array, values a float array with NaN for missing values.
+      limits is the sensor's QCLimits.
+    Returns:
+      (flags, qc_levels): an (n, len(QC_TESTS)) uint8 array of test flags and an int array of qc_level.
+    """
+    np = require_numpy()
+    count = len(values)
+    flags = np.full((count, len(QC_TESTS)), FLAG_NOT_EVALUATED, dtype=np.uint8)
+    missing = np.isnan(values)
+    # Comparisons with NaN are False, missing values are flagged once at the end.
+    with np.errstate(invalid='ignore'):
+        range_flags = flags[:, 0]
+        if limits.suspect_min is not None or limits.suspect_max is not None or \
+                limits.range_min is not None or limits.range_max is not None:
+            range_flags[:] = FLAG_PASS
+            if limits.suspect_min is not None:
+                range_flags[values < limits.suspect_min] = FLAG_SUSPECT
+            if limits.suspect_max is not None:
+                range_flags[values > limits.suspect_max] = FLAG_SUSPECT
+            if limits.range_min is not None:
+                range_flags[values < limits.range_min] = FLAG_FAIL
+            if limits.range_max is not None:
+                range_flags[values > limits.range_max] = FLAG_FAIL
+
+        if count >= 3 and (limits.spike_suspect is not None or limits.spike_fail is not None):
+            previous_values = values[:-2]
+            next_values = values[2:]
+            spike = np.abs(values[1:-1] - (previous_values + next_values) / 2.0) - \
+                np.abs((next_values - previous_values) / 2.0)
+            spike_flags = flags[1:-1, 1]
+            spike_flags[~np.isnan(spike)] = FLAG_PASS
+            if limits.spike_suspect is not None:
+                spike_flags[spike > limits.spike_suspect] = FLAG_SUSPECT
+            if limits.spike_fail is not None:
+                spike_flags[spike > limits.spike_fail] = FLAG_FAIL
+
+        if count >= 2 and (limits.gradient_suspect is not None or limits.gradient_fail is not None):
+            seconds = np.diff(times) / np.timedelta64(1, 's')
+            rate = np.where(seconds > 0, np.abs(np.diff(values)) / np.where(seconds > 0, seconds, 1.0), np.nan)
+            gradient_flags = flags[1:, 2]
+            gradient_flags[~np.isnan(rate)] = FLAG_PASS
+            if limits.gradient_suspect is not None:
+                gradient_flags[rate > limits.gradient_suspect] = FLAG_SUSPECT
+            if limits.gradient_fail is not None:
+                gradient_flags[rate > limits.gradient_fail] = FLAG_FAIL
+
+        if limits.flat_line_tolerance is not None and \
+                (limits.flat_line_suspect_count is not None or limits.flat_line_fail_count is not None):
+            same = np.concatenate(([False], np.abs(np.diff(values)) <= limits.flat_line_tolerance))
+            # Length of the run of repeated values ending at each observation, counting the first one.
+            positions = np.arange(count)
+            run_length = positions - np.maximum.accumulate(np.where(same, 0, positions)) + 1
+            flags[:, 3] = FLAG_PASS
+            if limits.flat_line_suspect_count is not None:
+                flags[run_length >= limits.flat_line_suspect_count, 3] = FLAG_SUSPECT
+            if limits.flat_line_fail_count is not None:
+                flags[run_length >= limits.flat_line_fail_count, 3] = FLAG_FAIL
+
+    flags[missing] = FLAG_MISSING
+    worst = np.where(flags == FLAG_NOT_EVALUATED, 0, flags).max(axis=1)
+    qc_levels = np.select([missing, worst == FLAG_FAIL, worst == FLAG_SUSPECT, worst == FLAG_PASS],
+                          [QC_LEVEL_NO_DATA, QC_LEVEL_BAD, QC_LEVEL_SUSPECT, QC_LEVEL_GOOD],
+                          QC_LEVEL_NOT_EVALUATED)
+    return flags, qc_levels
+
+
+def flag_strings(flags):
+    """
+    Returns the qc_flag strings, one digit per test, for an (n, len(QC_TESTS)) array of flags.
+    """
+    np = require_numpy()
+    digits = np.ascontiguousarray(flags + ord('0'), dtype=np.uint8)
+    return digits.view('S%d' % (len(QC_TESTS))).ravel().astype(str)
+
+
+class StreamingQC:
+    """
+    Record at a time QC for the MultiProcessDataSaver pipeline, sets qc_flag and qc_level on multi_obs objects
+    or dictionaries before they are written. Each sensor keeps its last value and date, the length of its
+    current flat line and a rolling window of its last window_size values with their running sum and sum of
+    squares for the mean and variance. Since the next value isn't known yet the spike test measures the
+    distance from the rolling mean(and, with sigma limits, in standard deviations) instead of from the mean
+    of the two neighbours.
+    """
+    def __init__(self, limits_table, window_size=30):
+        self.limits_table = limits_table
+        self.window_size = window_size
+        # sensor_id -> [deque of values, sum, sum of squares, last value, last date, flat line length]
+        self._sensors = {}
+
+    def _sensor_state(self, sensor_id):
+        state = self._sensors.get(sensor_id)
+        if state is None:
+            state = [collections.deque(), 0.0, 0.0, None, None, 0]
+            self._sensors[sensor_id] = state
+        return state
+
+    @staticmethod
+    def _check(flag, value, suspect, fail):
+        if fail is not None and value > fail:
+            return FLAG_FAIL
+        if suspect is not None and value > suspect:
+            return max(flag, FLAG_SUSPECT)
+        return flag
+
+    def flags_for(self, sensor_id, m_date, value, limits):
+        """
+        Returns the list of test flags for the value and adds it to the sensor's state, unless the value is no
+        newer than the sensor's last one.
+        """
+        if value is None or math.isnan(value):
+            return [FLAG_MISSING] * len(QC_TESTS)
+        state = self._sensor_state(sensor_id)
+        window, total, total_squares, last_value, last_date, flat_length = state
+        flags = [FLAG_NOT_EVALUATED] * len(QC_TESTS)
+
+        if limits.range_min is not None or limits.range_max is not None or \
+                limits.suspect_min is not None or limits.suspect_max is not None:
+            flags[0] = FLAG_PASS
+            if (limits.suspect_min is not None and value < limits.suspect_min) or \
+                    (limits.suspect_max is not None and value > limits.suspect_max):
+                flags[0] = FLAG_SUSPECT
+            if (limits.range_min is not None and value < limits.range_min) or \
+                    (limits.range_max is not None and value > limits.range_max):
+                flags[0] = FLAG_FAIL
+
+        if window and (limits.spike_suspect is not None or limits.spike_fail is not None or
+                       limits.sigma_suspect is not None or limits.sigma_fail is not None):
+            mean = total / len(window)
+            flags[1] = self._check(FLAG_PASS, abs(value - mean), limits.spike_suspect, limits.spike_fail)
+            if len(window) > 1 and (limits.sigma_suspect is not None or limits.sigma_fail is not None):
+                variance = max(0.0, total_squares / len(window) - mean * mean)
+                if variance > 0.0:
+                    flags[1] = self._check(flags[1], abs(value - mean) / math.sqrt(variance), limits.sigma_suspect,
+                                           limits.sigma_fail)
+
+        if last_date is not None and m_date is not None and m_date > last_date and \
+                (limits.gradient_suspect is not None or limits.gradient_fail is not None):
+            rate = abs(value - last_value) / (m_date - last_date).total_seconds()
+            flags[2] = self._check(FLAG_PASS, rate, limits.gradient_suspect, limits.gradient_fail)
+
+        if last_value is not None and limits.flat_line_tolerance is not None and \
+                abs(value - last_value) <= limits.flat_line_tolerance:
+            flat_length += 1
+        else:
+            flat_length = 1
+        if limits.flat_line_tolerance is not None and \
+                (limits.flat_line_suspect_count is not None or limits.flat_line_fail_count is not None):
+            flags[3] = FLAG_PASS
+            if limits.flat_line_suspect_count is not None and flat_length >= limits.flat_line_suspect_count:
+                flags[3] = FLAG_SUSPECT
+            if limits.flat_line_fail_count is not None and flat_length >= limits.flat_line_fail_count:
+                flags[3] = FLAG_FAIL
+
+        # A duplicate or late value is flagged but not added, a repeat would count twice in the window and the
+        # flat line.
+        if last_date is not None and m_date is not None and m_date <= last_date:
+            return flags
+        window.append(value)
+        total += value
+        total_squares += value * value
+        if len(window) > self.window_size:
+            oldest = window.popleft()
+            total -= oldest
+            total_squares -= oldest * oldest
+        state[1:] = [total, total_squares, value, m_date if m_date is not None else last_date, flat_length]
+        return flags
+
+    def apply(self, rec):
+        """
+        Sets qc_flag and qc_level on rec, a multi_obs object or dictionary, if its sensor or m_type has limits.
+        Returns True if the record was QCed.
+        """
+        is_dict = isinstance(rec, dict)
+        get = rec.get if is_dict else lambda name: getattr(rec, name, None)
+        sensor_id = get('sensor_id')
+        limits = self.limits_table.limits_for(sensor_id, get('m_type_id'))
+        if limits is None:
+            return False
+        flags = self.flags_for(sensor_id, get('m_date'), get('m_value'), limits)
+        if flags[0] == FLAG_MISSING:
+            qc_level = QC_LEVEL_NO_DATA
+        else:
+            worst = max((flag for flag in flags if flag != FLAG_NOT_EVALUATED), default=None)
+            qc_level = {FLAG_FAIL: QC_LEVEL_BAD, FLAG_SUSPECT: QC_LEVEL_SUSPECT, FLAG_PASS: QC_LEVEL_GOOD}\
+                .get(worst, QC_LEVEL_NOT_EVALUATED)
+        qc_flag = ''.join(str(flag) for flag in flags)
+        if is_dict:
+            rec['qc_flag'] = qc_flag
+            rec['qc_level'] = qc_level
+        else:
+            rec.qc_flag = qc_flag
+            rec.qc_level = qc_level
+        return True
+
+
+class QCEngine:
+    """
+    Runs the QC tests on multi_obs through a connected xeniaAlchemy with the limits in limits_table, a
+    QCLimitsTable. context is the time read before and after the window so the spike, gradient and flat
+    line tests see the neighbours of the window's first and last observations.
+    """
+    def __init__(self, db, limits_table, context=timedelta(hours=1)):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.db = db
+        self.limits_table = limits_table
+        self.context = context
+
+    def _read_window(self, start_date, end_date, sensor_ids):
+        np = require_numpy()
+        table = multi_obs.__table__
+        stmt = select(table.c.row_id, table.c.sensor_id, table.c.m_type_id, table.c.m_date, table.c.m_value) \
+            .where(table.c.m_date >= start_date - self.context) \
+            .where(table.c.m_date < end_date + self.context) \
+            .order_by(table.c.sensor_id, table.c.m_date)
+        if sensor_ids is not None:
+            stmt = stmt.where(table.c.sensor_id.in_(sensor_ids))
+        else:
+            stmt = stmt.where(or_(table.c.sensor_id.in_(list(self.limits_table.by_sensor)),
+                                  table.c.m_type_id.in_(list(self.limits_table.by_m_type))))
+        # A connection of its own, so the read neither commits nor rolls back work pending on db.session.
+        with self.db.dbEngine.connect() as connection:
+            rows = connection.execute(stmt).all()
+        if not rows:
+            return None
+        row_ids, sensor_column, m_type_column, dates, observations = zip(*rows)
+        return (np.array(row_ids, dtype=np.int64),
+                np.array(sensor_column, dtype=np.int64),
+                np.array([m_type_id if m_type_id is not None else -1 for m_type_id in m_type_column],
+                         dtype=np.int64),
+                np.array(dates, dtype='datetime64[us]'),
+                np.array(observations, dtype=np.float64))
+
+    def _write_flags(self, row_ids, qc_levels, qc_flags):
+        """
+        Writes qc_level/qc_flag with UPDATE ... FROM (VALUES ...) on PostgreSQL, an executemany UPDATE keyed on
+        row_id elsewhere. Each chunk is committed.
+        """
+        table = multi_obs.__table__
+        postgresql = self.db.dbEngine.dialect.name == 'postgresql'
+        for start_ndx in range(0, len(row_ids), UPDATE_CHUNK_SIZE):
+            chunk = list(zip(row_ids[start_ndx:start_ndx + UPDATE_CHUNK_SIZE].tolist(),
+                             qc_levels[start_ndx:start_ndx + UPDATE_CHUNK_SIZE].tolist(),
+                             qc_flags[start_ndx:start_ndx + UPDATE_CHUNK_SIZE].tolist()))
+            if postgresql:
+                qc_values = values(column('row_id', Integer), column('qc_level', Integer),
+                                   column('qc_flag', String), name='qc_values').data(chunk)
+                self.db.session.execute(update(table)
+                                        .where(table.c.row_id == qc_values.c.row_id)
+                                        .values(qc_level=qc_values.c.qc_level, qc_flag=qc_values.c.qc_flag))
+            else:
+                self.db.session.execute(update(table)
+                                        .where(table.c.row_id == bindparam('qc_row_id'))
+                                        .values(qc_level=bindparam('qc_level_value'),
+                                                qc_flag=bindparam('qc_flag_value')),
+                                        [{'qc_row_id': row_id, 'qc_level_value': qc_level, 'qc_flag_value': qc_flag}
+                                         for row_id, qc_level, qc_flag in chunk])
+            self.db.session.commit()
+
+    """
+    Function: run
+    Purpose: QCs every observation in [start_date, end_date) of the sensors that have limits and writes
+    qc_level and qc_flag.
+    Parameters:
+      start_date, end_date bound the window, start_date inclusive and end_date exclusive.
+      sensor_ids, if given, limits the run to those sensors.
+    Returns:
+      A dictionary with the sensors and rows evaluated, the count per qc_level and elapsed seconds, or None if
+      an error occurred.
+    """
+
+
+    def run(self, start_date, end_date, sensor_ids=None):
+        np = require_numpy()
+        start_time = time.perf_counter()
+        stats = {'sensors': 0, 'rows': 0, 'qc_levels': {}}
+        try:
+            with self.db.primary():
+                window = self._read_window(start_date, end_date, sensor_ids)
+                if window is not None:
+                    row_ids, sensor_column, m_type_column, dates, observations = window
+                    in_window = (dates >= np.datetime64(start_date, 'us')) & (dates < np.datetime64(end_date, 'us'))
+                    # Rows are ordered by sensor, split them into one segment per sensor.
+                    boundaries = np.flatnonzero(np.diff(sensor_column)) + 1
+                    update_ids, update_levels, update_flags = [], [], []
+                    for start_ndx, end_ndx in zip(np.concatenate(([0], boundaries)),
+                                                  np.concatenate((boundaries, [len(sensor_column)]))):
+                        sensor_id = int(sensor_column[start_ndx])
+                        limits = self.limits_table.limits_for(sensor_id, int(m_type_column[start_ndx]))
+                        if limits is None:
+                            continue
+                        flags, qc_levels = run_qc_tests(dates[start_ndx:end_ndx], observations[start_ndx:end_ndx],
+                                                        limits)
+                        core = in_window[start_ndx:end_ndx]
+                        update_ids.append(row_ids[start_ndx:end_ndx][core])
+                        update_levels.append(qc_levels[core])
+                        update_flags.append(flag_strings(flags[core]))
+                        stats['sensors'] += 1
+                    if update_ids:
+                        update_ids = np.concatenate(update_ids)
+                        update_levels = np.concatenate(update_levels)
+                        self._write_flags(update_ids, update_levels, np.concatenate(update_flags))
+                        stats['rows'] = len(update_ids)
+                        levels, counts = np.unique(update_levels, return_counts=True)
+                        stats['qc_levels'] = dict(zip(levels.tolist(), counts.tolist()))
+        except exc.SQLAlchemyError as e:
+            self.db.session.rollback()
+            self.logger.exception(e)
+            return None
+        stats['elapsed'] = time.perf_counter() - start_time
+        self.logger.info("QC: %d sensors, %d rows from %s to %s in %.2f seconds.", stats['sensors'], stats['rows'],
+                         start_date, end_date, stats['elapsed'])
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the QC tests on multi_obs and write qc_flag/qc_level.")
+    parser.add_argument("--ini", required=True, help="ini file with the [Database] section and the QC limits.")
+    parser.add_argument("--start", required=True, help="Start date, ISO 8601.")
+    parser.add_argument("--end", required=True, help="End date(exclusive), ISO 8601.")
+    parser.add_argument("--sensor-id", type=int, action="append", default=None, help="Sensor id, may be repeated.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    config_file = ConfigParser()
+    config_file.read(args.ini)
+    limits_table = QCLimitsTable.from_config(config_file)
+    if not limits_table:
+        logger.error("No [QC m_type <id>] or [QC sensor <id>] sections in: %s", args.ini)
+        return 1
+    config = DatabaseConfiguration(None, ini_file=args.ini)
+    db = xeniaAlchemy()
+    if not db.connect_db(config.get_connection_string(), False, sqlite_pragmas=config.sqlite_pragmas,
+                         spatialite=config.spatialite):
+        return 1
+    try:
+        stats = QCEngine(db, limits_table).run(datetime.fromisoformat(args.start), datetime.fromisoformat(args.end),
+                                               sensor_ids=args.sensor_id)
+    finally:
+        db.disconnect()
+    return 0 if stats is not None else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
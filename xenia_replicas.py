@@ -0,0 +1,103 @@
+import itertools
+import logging
+import time
+
+from sqlalchemy import create_engine, event, exc, text
+from sqlalchemy.orm import sessionmaker
+
+
+class ReadReplica:
+    """
+    One read-only endpoint: an engine in AUTOCOMMIT mode, so a long lived session never leaves an idle
+    transaction open on the replica, and the session xeniaAlchemy reads through.
+    """
+    def __init__(self, connection_string, echo=False):
+        self.connection_string = connection_string
+        self.engine = create_engine(connection_string, echo=echo, pool_pre_ping=True, isolation_level='AUTOCOMMIT')
+        self.session = sessionmaker(bind=self.engine)()
+        # While time.monotonic() is before this the replica is skipped.
+        self.down_until = 0.0
+        self.failure_count = 0
+
+    @property
+    def name(self):
+        return self.engine.url.render_as_string(hide_password=True)
+
+    def dispose(self):
+        self.session.close()
+        self.engine.dispose()
+
+
+class ReadReplicaPool:
+    """
+    Round-robin selection over read replicas with passive and active health checks. A replica whose
+    connection fails(disconnect or OperationalError) is taken out of rotation for retry_interval seconds and
+    tried again after that. check() actively probes every replica with SELECT 1.
+    When every replica is down, next_session() returns None and the caller falls back to the primary.
+    """
+    def __init__(self, connection_strings, retry_interval=30, echo=False):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.retry_interval = retry_interval
+        self.replicas = [ReadReplica(connection_string, echo) for connection_string in connection_strings]
+        for replica in self.replicas:
+            event.listen(replica.engine, 'handle_error', self._make_error_handler(replica))
+        self._rotation = itertools.cycle(self.replicas)
+        # Total number of replica failures, lets a caller tell if a replica failed during a call.
+        self.failure_count = 0
+
+    def __len__(self):
+        return len(self.replicas)
+
+    def _make_error_handler(self, replica):
+        def handle_error(context):
+            if context.is_disconnect or isinstance(context.sqlalchemy_exception, exc.OperationalError):
+                self.mark_down(replica, context.original_exception)
+        return handle_error
+
+    def mark_down(self, replica, reason=None):
+        replica.down_until = time.monotonic() + self.retry_interval
+        replica.failure_count += 1
+        self.failure_count += 1
+        self.logger.error("Read replica: %s marked down for %d seconds: %s", replica.name, self.retry_interval,
+                          reason)
+
+    def next_session(self):
+        """
+        Returns the session of the next healthy replica in the rotation, or None if none are available.
+        """
+        now = time.monotonic()
+        for _ in range(len(self.replicas)):
+            replica = next(self._rotation)
+            if replica.down_until <= now:
+                if replica.down_until:
+                    # Back in rotation, start from a clean session after the failure.
+                    replica.down_until = 0.0
+                    replica.session.close()
+                    self.logger.info("Read replica: %s back in rotation.", replica.name)
+                return replica.session
+        return None
+
+    def check(self):
+        """
+        Probes every replica with SELECT 1 and updates its health. Returns a dictionary of replica name to True
+        if it is healthy.
+        """
+        health = {}
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+                if replica.down_until:
+                    replica.down_until = 0.0
+                    replica.session.close()
+                health[replica.name] = True
+            except exc.SQLAlchemyError as e:
+                # The handle_error listener already marked the replica down for connection failures.
+                if replica.down_until <= time.monotonic():
+                    self.mark_down(replica, e)
+                health[replica.name] = False
+        return health
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.dispose()
@@ -0,0 +1,301 @@
+"""
+Retention and downsampling for multi_obs.
+
+Policies select sensors by m_type and/or platform and give the number of days of full resolution data to
+keep. Older rows are replaced by hourly aggregates(one row per sensor and hour, m_date at the start of the
+hour, aggregate_period = 3600 marking it as an aggregate) or, for policies without downsampling, just deleted.
+
+Each sensor is processed one window(default a day) at a time, oldest first, through the multi_obs
+(sensor_id, m_date) index. A window's aggregates are inserted and its raw rows deleted in the same
+transaction, so the job can be stopped at any point and rerun: finished windows have no raw rows left and
+the next run starts at the oldest raw row still before the cutoff. The aggregates are computed set-wise in
+the database with INSERT ... SELECT ... GROUP BY into a temporary staging table, no rows are loaded into
+Python. They are moved into multi_obs only after the raw rows are deleted, since a raw reading taken exactly
+on the hour has the same sensor_id, m_date and m_type_id as its hour's aggregate.
+
+Aggregating with avg is wrong for circular quantities such as wind_from_direction, give those m_types their
+own policy with downsample off or aggregate min/max.
+
+Policies can be read from an ini file, one section per policy named "Retention <name>":
+    [Retention wave]
+    keep_days = 30
+    m_type_ids = 41, 42
+    platforms = carocoops.CAP2.buoy
+                carocoops.SUN2.buoy
+    downsample = true
+    aggregate = avg
+"""
+import argparse
+import logging
+import time
+from configparser import ConfigParser
+from datetime import datetime, timedelta
+
+from sqlalchemy import (
+    Column,
+    MetaData,
+    Table,
+    and_,
+    delete,
+    exc,
+    func,
+    insert,
+    literal,
+    select,
+)
+from sqlalchemy.schema import CreateTable
+
+from .database_settings import DatabaseConfiguration
+from .xeniaAlchemy import xeniaAlchemy
+from .XeniaTables import multi_obs
+
+logger = logging.getLogger(__name__)
+
+# multi_obs.aggregate_period, the seconds an aggregate row written by the retention job covers. Raw
+# observations have NULL. d_top_of_hour isn't used as the marker since ingest already sets it on raw rows.
+AGGREGATE_PERIOD = 3600
+
+AGGREGATES = ('avg', 'min', 'max')
+
+VALUE_COLUMNS = ('m_lon', 'm_lat', 'm_z', 'm_value', 'm_value_2', 'm_value_3', 'm_value_4', 'm_value_5',
+                 'm_value_6', 'm_value_7', 'm_value_8')
+
+AGGREGATE_COLUMNS = ('row_entry_date', 'platform_handle', 'sensor_id', 'm_type_id', 'm_date', 'aggregate_period') \
+    + VALUE_COLUMNS
+
+POLICY_SECTION_PREFIX = 'Retention '
+
+
+def _build_stage_table():
+    stage_metadata = MetaData()
+    return Table('xenia_retention_stage', stage_metadata,
+                 *[Column(name, multi_obs.__table__.c[name].type) for name in AGGREGATE_COLUMNS],
+                 prefixes=['TEMPORARY'])
+
+
+def floor_hour(date):
+    return date.replace(minute=0, second=0, microsecond=0)
+
+
+class RetentionPolicy:
+    """
+    keep_days of full resolution data for the sensors matching m_type_ids and platform_handles(None matches
+    any). If downsample is True, older rows are replaced by hourly aggregates computed with aggregate, one of
+    AGGREGATES, otherwise they are deleted.
+    """
+    def __init__(self, name, keep_days, m_type_ids=None, platform_handles=None, downsample=True, aggregate='avg'):
+        if aggregate not in AGGREGATES:
+            raise ValueError("Unsupported aggregate: %s. Use one of: %s" % (aggregate, ', '.join(AGGREGATES)))
+        self.name = name
+        self.keep_days = keep_days
+        self.m_type_ids = set(m_type_ids) if m_type_ids is not None else None
+        self.platform_handles = set(platform_handles) if platform_handles is not None else None
+        self.downsample = downsample
+        self.aggregate = aggregate
+
+    def __repr__(self):
+        return "RetentionPolicy(%r, keep_days=%s, downsample=%s)" % (self.name, self.keep_days, self.downsample)
+
+    def matches(self, platform_handle, m_type_id):
+        return (self.m_type_ids is None or m_type_id in self.m_type_ids) and \
+            (self.platform_handles is None or platform_handle in self.platform_handles)
+
+    def cutoff(self, now=None):
+        """
+        Rows before the returned date are past retention. It's on an hour boundary so only whole hours are
+        aggregated.
+        """
+        return floor_hour((now or datetime.now()) - timedelta(days=self.keep_days))
+
+
+def policies_from_config(config_file):
+    """
+    Returns the RetentionPolicy list from the "Retention <name>" sections of a ConfigParser, in file order.
+    """
+    policies = []
+    for section in config_file.sections():
+        if not section.startswith(POLICY_SECTION_PREFIX):
+            continue
+        m_type_ids = config_file.get(section, 'm_type_ids', fallback=None)
+        platforms = config_file.get(section, 'platforms', fallback=None)
+        policies.append(RetentionPolicy(
+            section[len(POLICY_SECTION_PREFIX):].strip(),
+            config_file.getfloat(section, 'keep_days'),
+            m_type_ids=[int(m_type_id) for m_type_id in m_type_ids.split(',')] if m_type_ids else None,
+            platform_handles=[handle.strip() for handle in platforms.splitlines() if handle.strip()]
+            if platforms else None,
+            downsample=config_file.getboolean(section, 'downsample', fallback=True),
+            aggregate=config_file.get(section, 'aggregate', fallback='avg')))
+    return policies
+
+
+class RetentionEngine:
+    """
+    Applies policies to a connected xeniaAlchemy. Each sensor is handled by the first policy that matches it,
+    so list specific policies before general ones. window is the m_date span committed at a time.
+    progress_callback, if given, is called after every window with a dictionary of the policy name, sensor_id,
+    window end and the running totals.
+    """
+    def __init__(self, db, policies, window=timedelta(days=1), progress_callback=None):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.db = db
+        self.policies = policies
+        self.window = window
+        self.progress_callback = progress_callback
+        self._stage = _build_stage_table()
+
+    def _hour_bucket(self, date_column):
+        # Same text format SQLAlchemy stores SQLite DateTime values in, so the aggregates compare correctly
+        # with bound datetimes.
+        if self.db.dbEngine.dialect.name == 'postgresql':
+            return func.date_trunc('hour', date_column)
+        return func.strftime('%Y-%m-%d %H:00:00.000000', date_column)
+
+    def assign_sensors(self):
+        """
+        Returns a list of (policy, [sensor_id...]) for the policies matching at least one sensor.
+        """
+        with self.db.primary():
+            catalog = self.db.get_sensor_catalog()
+        if catalog is None:
+            raise RuntimeError("Unable to read the sensor catalog.")
+        assigned = {}
+        for sensor_id, platform_handle, _, _, _, m_type_id, _ in catalog:
+            for ndx, policy in enumerate(self.policies):
+                if policy.matches(platform_handle, m_type_id):
+                    assigned.setdefault(ndx, []).append(sensor_id)
+                    break
+        return [(self.policies[ndx], sorted(sensor_ids)) for ndx, sensor_ids in sorted(assigned.items())]
+
+    def _next_raw_date(self, sensor_id, start_date, cutoff):
+        table = multi_obs.__table__
+        stmt = select(func.min(table.c.m_date)).where(table.c.sensor_id == sensor_id,
+                                                      table.c.m_date < cutoff,
+                                                      self._raw_rows())
+        if start_date is not None:
+            stmt = stmt.where(table.c.m_date >= start_date)
+        return self.db.session.execute(stmt).scalar()
+
+    @staticmethod
+    def _raw_rows():
+        return multi_obs.__table__.c.aggregate_period.is_(None)
+
+    def _process_window(self, policy, sensor_id, start_date, end_date):
+        """
+        Writes the window's hourly aggregates, if the policy downsamples, and deletes its raw rows in one
+        transaction. The aggregates are staged first and inserted after the delete, so an aggregate never
+        collides with a raw row stored on the hour. Returns (rows written, rows deleted).
+        """
+        table = multi_obs.__table__
+        in_window = and_(table.c.sensor_id == sensor_id, table.c.m_date >= start_date, table.c.m_date < end_date,
+                         self._raw_rows())
+        session = self.db.session
+        if policy.downsample:
+            connection = session.connection()
+            connection.execute(CreateTable(self._stage, if_not_exists=True))
+            aggregate = getattr(func, policy.aggregate)
+            bucket = self._hour_bucket(table.c.m_date)
+            aggregates = select(literal(datetime.now(), table.c.row_entry_date.type),
+                                func.min(table.c.platform_handle),
+                                table.c.sensor_id,
+                                func.min(table.c.m_type_id),
+                                bucket,
+                                literal(AGGREGATE_PERIOD),
+                                *[aggregate(table.c[name]) for name in VALUE_COLUMNS]) \
+                .where(in_window) \
+                .group_by(table.c.sensor_id, bucket)
+            connection.execute(insert(self._stage).from_select(list(AGGREGATE_COLUMNS), aggregates))
+        deleted_count = session.execute(table.delete().where(in_window)).rowcount
+        written_count = 0
+        if policy.downsample:
+            stage = self._stage.c
+            written_count = connection.execute(insert(table).from_select(
+                list(AGGREGATE_COLUMNS) + ['the_geom'],
+                select(*[stage[name] for name in AGGREGATE_COLUMNS],
+                       self.db._point_expression(stage.m_lon, stage.m_lat)))).rowcount
+            connection.execute(delete(self._stage))
+        session.commit()
+        return written_count, deleted_count
+
+    """
+    Function: run
+    Purpose: Applies every policy, sensor by sensor and window by window, oldest first.
+    Parameters:
+      now, if given, is the date the retention periods are counted back from.
+    Returns:
+      A dictionary with the sensors and windows processed and the rows written and deleted per policy name,
+      or None if an error occurred. Windows committed before an error stay processed.
+    """
+
+
+    def run(self, now=None):
+        stats = {}
+        start_time = time.perf_counter()
+        try:
+            with self.db.primary():
+                for policy, sensor_ids in self.assign_sensors():
+                    cutoff = policy.cutoff(now)
+                    policy_stats = stats.setdefault(policy.name, {'sensors': 0, 'windows': 0, 'rows_written': 0,
+                                                                  'rows_deleted': 0, 'cutoff': cutoff})
+                    self.logger.info("Retention policy: %s %d sensors, cutoff: %s", policy.name, len(sensor_ids),
+                                     cutoff)
+                    for sensor_id in sensor_ids:
+                        raw_date = self._next_raw_date(sensor_id, None, cutoff)
+                        if raw_date is None:
+                            continue
+                        policy_stats['sensors'] += 1
+                        while raw_date is not None:
+                            start_date = floor_hour(raw_date)
+                            end_date = min(start_date + self.window, cutoff)
+                            written_count, deleted_count = self._process_window(policy, sensor_id, start_date,
+                                                                                end_date)
+                            policy_stats['windows'] += 1
+                            policy_stats['rows_written'] += written_count
+                            policy_stats['rows_deleted'] += deleted_count
+                            self.logger.debug("Retention policy: %s sensor: %d window: %s - %s written: %d "
+                                              "deleted: %d", policy.name, sensor_id, start_date, end_date,
+                                              written_count, deleted_count)
+                            if self.progress_callback is not None:
+                                self.progress_callback(dict(policy_stats, policy=policy.name, sensor_id=sensor_id,
+                                                            window_end=end_date))
+                            # Jumps over gaps in the data instead of stepping through empty windows.
+                            raw_date = self._next_raw_date(sensor_id, end_date, cutoff)
+                    self.logger.info("Retention policy: %s finished, %d sensors, %d rows deleted, %d written.",
+                                     policy.name, policy_stats['sensors'], policy_stats['rows_deleted'],
+                                     policy_stats['rows_written'])
+        except (exc.SQLAlchemyError, RuntimeError) as e:
+            self.db.session.rollback()
+            self.logger.exception(e)
+            return None
+        self.logger.info("Retention run finished in %.2f seconds.", time.perf_counter() - start_time)
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply multi_obs retention and downsampling policies.")
+    parser.add_argument("--ini", required=True,
+                        help="ini file with the [Database] section and the [Retention <name>] policies.")
+    parser.add_argument("--window-hours", type=float, default=24, help="m_date span committed at a time.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    config_file = ConfigParser()
+    config_file.read(args.ini)
+    policies = policies_from_config(config_file)
+    if not policies:
+        logger.error("No [Retention <name>] sections in: %s", args.ini)
+        return 1
+    config = DatabaseConfiguration(None, ini_file=args.ini)
+    db = xeniaAlchemy()
+    if not db.connect_db(config.get_connection_string(), False, sqlite_pragmas=config.sqlite_pragmas,
+                         spatialite=config.spatialite):
+        return 1
+    try:
+        stats = RetentionEngine(db, policies, window=timedelta(hours=args.window_hours)).run()
+    finally:
+        db.disconnect()
+    return 0 if stats is not None else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
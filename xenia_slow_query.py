@@ -0,0 +1,191 @@
+import collections
+import json
+import logging
+import logging.handlers
+import os
+import time
+import traceback
+from datetime import datetime
+
+# Frames from these files are skipped when looking for the code that issued a statement.
+_INTERNAL_PATHS = (os.sep + 'sqlalchemy' + os.sep, os.sep + 'geoalchemy2' + os.sep,
+                   os.path.abspath(__file__), os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           'xenia_metrics.py'))
+
+# Statements that are worth an EXPLAIN, anything else(DDL, COMMIT, SAVEPOINT...) is only logged.
+_EXPLAIN_STATEMENTS = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+
+def _in_transaction(dbapi_connection):
+    """
+    True if the DBAPI connection has a transaction open: not in autocommit and, where the driver reports it
+    (psycopg2 get_transaction_status(), psycopg info.transaction_status), not idle.
+    """
+    if getattr(dbapi_connection, 'autocommit', False):
+        return False
+    if hasattr(dbapi_connection, 'get_transaction_status'):
+        transaction_status = dbapi_connection.get_transaction_status()
+    elif hasattr(dbapi_connection, 'info') and hasattr(dbapi_connection.info, 'transaction_status'):
+        transaction_status = dbapi_connection.info.transaction_status
+    else:
+        return True
+    # Both drivers use 0 for idle, outside a transaction.
+    return int(transaction_status) != 0
+
+
+class SlowQueryRecorder:
+    """
+    Records SQL statements slower than threshold_seconds to a rotating local file, one JSON object per line
+    with the statement, its parameters, the elapsed time, the call site and, on PostgreSQL, the plan from
+    EXPLAIN (ANALYZE off). Attach it with xeniaAlchemy.connect_db(slow_query_recorder=...).
+    Plans are captured at most once per explain_interval seconds for the same statement text, so a degraded
+    lookup running in a tight loop does not double the load on the database. The last EXPLAIN time is kept for
+    the max_explained_statements most recently explained statements.
+    """
+    def __init__(self, file_path, threshold_seconds=0.5, explain=True, explain_interval=300,
+                 max_bytes=10 * 1024 * 1024, backup_count=5, max_parameter_length=2000, stack_depth=4,
+                 max_explained_statements=1000):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.file_path = file_path
+        self.threshold_seconds = threshold_seconds
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self.max_parameter_length = max_parameter_length
+        self.stack_depth = stack_depth
+        self.max_explained_statements = max_explained_statements
+        # The most recent records, for inspection in process.
+        self.recent = collections.deque(maxlen=100)
+        # Statement -> monotonic time of its last EXPLAIN, least recently explained first.
+        self._last_explain = collections.OrderedDict()
+
+        self._file_logger = logging.getLogger("%s.%s" % (type(self).__name__, os.path.abspath(file_path)))
+        self._file_logger.propagate = False
+        self._file_logger.setLevel(logging.INFO)
+        if not self._file_logger.handlers:
+            handler = logging.handlers.RotatingFileHandler(file_path, maxBytes=max_bytes, backupCount=backup_count)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._file_logger.addHandler(handler)
+
+    def attach(self, engine):
+        from sqlalchemy import event
+
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    def detach(self, engine):
+        from sqlalchemy import event
+
+        if event.contains(engine, 'before_cursor_execute', self._before_cursor_execute):
+            event.remove(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.remove(engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.remove(engine, 'handle_error', self._handle_error)
+
+    def close(self):
+        for handler in list(self._file_logger.handlers):
+            self._file_logger.removeHandler(handler)
+            handler.close()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('xenia_slow_query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['xenia_slow_query_start'].pop()
+        if elapsed < self.threshold_seconds:
+            return
+        try:
+            self.record(conn, cursor, statement, parameters, executemany, elapsed)
+        # Never let the recorder break the statement being executed.
+        except Exception as e:
+            self.logger.exception(e)
+
+    def _handle_error(self, exception_context):
+        # A failed statement never reaches after_cursor_execute, take its start time off here. Without an
+        # execution context the error came before the statement was sent and before_cursor_execute didn't run.
+        conn = exception_context.connection
+        if conn is not None and exception_context.execution_context is not None and \
+                conn.info.get('xenia_slow_query_start'):
+            conn.info['xenia_slow_query_start'].pop()
+
+    def call_site(self):
+        """
+        Returns the innermost stack_depth frames outside SQLAlchemy and this module, innermost first.
+        """
+        frames = []
+        for frame in reversed(traceback.extract_stack()):
+            if any(path in frame.filename for path in _INTERNAL_PATHS):
+                continue
+            frames.append("%s:%d %s" % (frame.filename, frame.lineno, frame.name))
+            if len(frames) == self.stack_depth:
+                break
+        return frames
+
+    def _format_parameters(self, parameters, executemany):
+        if executemany:
+            parameters = {'rows': len(parameters), 'first': parameters[0] if parameters else None}
+        formatted = repr(parameters)
+        if len(formatted) > self.max_parameter_length:
+            formatted = formatted[:self.max_parameter_length] + '...'
+        return formatted
+
+    def _explain(self, conn, cursor, statement, parameters):
+        now = time.monotonic()
+        last_explain = self._last_explain.get(statement)
+        if last_explain is not None and now - last_explain < self.explain_interval:
+            return None
+        self._last_explain[statement] = now
+        self._last_explain.move_to_end(statement)
+        # Statements with literal values inlined are all distinct, only keep the most recently explained ones.
+        while len(self._last_explain) > self.max_explained_statements:
+            self._last_explain.popitem(last=False)
+        # EXPLAIN through the same DBAPI connection. In a transaction it runs inside a savepoint so a failing
+        # EXPLAIN doesn't abort the caller's transaction. An AUTOCOMMIT connection(the read replicas) has no
+        # transaction to protect, and SAVEPOINT would fail outside one, so it runs on its own there.
+        dbapi_connection = cursor.connection
+        use_savepoint = _in_transaction(dbapi_connection)
+        explain_cursor = dbapi_connection.cursor()
+        try:
+            if use_savepoint:
+                explain_cursor.execute("SAVEPOINT xenia_slow_query_explain")
+            explain_cursor.execute("EXPLAIN (ANALYZE off, VERBOSE on) " + statement, parameters)
+            plan = "\n".join(rec[0] for rec in explain_cursor.fetchall())
+            if use_savepoint:
+                explain_cursor.execute("RELEASE SAVEPOINT xenia_slow_query_explain")
+            return plan
+        except Exception:
+            if use_savepoint:
+                try:
+                    explain_cursor.execute("ROLLBACK TO SAVEPOINT xenia_slow_query_explain")
+                # The SAVEPOINT itself failed, there is nothing to roll back to.
+                except Exception as rollback_error:
+                    self.logger.debug(rollback_error)
+            raise
+        finally:
+            explain_cursor.close()
+
+    def record(self, conn, cursor, statement, parameters, executemany, elapsed):
+        plan = None
+        explain_error = None
+        if self.explain and not executemany and conn.dialect.name == 'postgresql' \
+                and statement.lstrip().split(None, 1)[0].upper() in _EXPLAIN_STATEMENTS:
+            # A failed EXPLAIN still records the query, without a plan.
+            try:
+                plan = self._explain(conn, cursor, statement, parameters)
+            except Exception as e:
+                explain_error = str(e)
+        slow_query = {
+            'timestamp': datetime.now().isoformat(),
+            'elapsed_seconds': round(elapsed, 6),
+            'dialect': conn.dialect.name,
+            'statement': statement,
+            'parameters': self._format_parameters(parameters, executemany),
+            'executemany': executemany,
+            'call_site': self.call_site(),
+            'plan': plan,
+            'explain_error': explain_error
+        }
+        self.recent.append(slow_query)
+        self._file_logger.info(json.dumps(slow_query, default=str))
+        self.logger.warning("Slow query %.3fs at %s", elapsed,
+                            slow_query['call_site'][0] if slow_query['call_site'] else 'unknown')
+        return slow_query
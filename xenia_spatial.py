@@ -0,0 +1,65 @@
+"""
+Dialect specific helpers for building the_geom point geometries in SQL, so geometries can be computed
+set-wise by the database instead of building a WKTElement per ORM object.
+"""
+import math
+
+from sqlalchemy import String, cast, exc, func, literal, text
+
+# The platform and multi_obs longitude/latitude columns are WGS84.
+DEFAULT_SRID = 4326
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def has_spatialite(connection):
+    """
+    Returns True if the SQLite connection has the SpatiaLite extension loaded.
+    """
+    if connection.dialect.name != 'sqlite':
+        return False
+    try:
+        connection.execute(text("SELECT spatialite_version()")).scalar()
+        return True
+    except exc.OperationalError:
+        return False
+
+
+def point_expression(dialect_name, lon, lat, srid=DEFAULT_SRID, spatialite=False):
+    """
+    Builds a SQL expression creating a point geometry from the lon/lat expressions, which can be columns
+    or bindparams.
+      PostgreSQL: ST_SetSRID(ST_MakePoint(lon, lat), srid)
+      SpatiaLite: MakePoint(lon, lat, srid)
+      SQLite without SpatiaLite: the EWKT text 'SRID=srid;POINT(lon lat)', which SpatiaLite's GeomFromEWKT
+      can convert if the database is later loaded with the extension.
+    In all cases the result is NULL if lon or lat is NULL.
+    """
+    if dialect_name == 'postgresql':
+        return func.ST_SetSRID(func.ST_MakePoint(lon, lat), srid)
+    if dialect_name == 'sqlite':
+        if spatialite:
+            return func.MakePoint(lon, lat, srid)
+        return literal("SRID=%d;POINT(" % (srid)) + cast(lon, String) + literal(" ") + cast(lat, String) + literal(")")
+    raise ValueError("Unsupported dialect: %s for point geometries." % (dialect_name))
+
+
+def envelope_expression(dialect_name, min_lon, min_lat, max_lon, max_lat, srid=DEFAULT_SRID):
+    """
+    Builds a SQL expression for the bounding box polygon. Only PostgreSQL and SpatiaLite are supported.
+    """
+    if dialect_name == 'postgresql':
+        return func.ST_MakeEnvelope(min_lon, min_lat, max_lon, max_lat, srid)
+    if dialect_name == 'sqlite':
+        return func.BuildMbr(min_lon, min_lat, max_lon, max_lat, srid)
+    raise ValueError("Unsupported dialect: %s for envelopes." % (dialect_name))
+
+
+def haversine_km(lon_1, lat_1, lon_2, lat_2):
+    """
+    Great circle distance in kilometers between two lon/lat points.
+    """
+    lon_1, lat_1, lon_2, lat_2 = map(math.radians, (lon_1, lat_1, lon_2, lat_2))
+    a = math.sin((lat_2 - lat_1) / 2) ** 2 + \
+        math.cos(lat_1) * math.cos(lat_2) * math.sin((lon_2 - lon_1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
@@ -0,0 +1,99 @@
+"""
+SQLite tuning for edge collectors: pragmas applied to every new connection through the engine "connect"
+event, and optional SpatiaLite loading.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Defaults for a collector with one saver process writing and other processes reading:
+#   journal_mode WAL lets readers and the writer run concurrently instead of failing with "database is locked".
+#   synchronous NORMAL only syncs at checkpoints in WAL mode, a crash may lose the last commits but never
+#   corrupts the database.
+#   busy_timeout makes a second writer wait for the lock rather than fail immediately.
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 10000,
+    # Negative cache_size is in KiB, so 64MB.
+    'cache_size': -65536,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+
+# Pragmas accepted from configuration files, anything else is rejected so a typo doesn't go unnoticed.
+SQLITE_PRAGMA_NAMES = ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size', 'temp_store',
+                       'wal_autocheckpoint', 'journal_size_limit', 'foreign_keys', 'locking_mode')
+
+DEFAULT_SPATIALITE_LIBRARY = 'mod_spatialite'
+
+
+def validate_pragmas(pragmas):
+    """
+    Returns pragmas with the names checked against SQLITE_PRAGMA_NAMES and the values checked to be a plain
+    word or integer, since they are formatted into the PRAGMA statement.
+    """
+    validated = {}
+    for name, value in pragmas.items():
+        name = name.lower()
+        if name not in SQLITE_PRAGMA_NAMES:
+            raise ValueError("Unsupported SQLite pragma: %s" % (name))
+        if not str(value).lstrip('-').isalnum():
+            raise ValueError("Invalid value for SQLite pragma %s: %s" % (name, value))
+        validated[name] = value
+    return validated
+
+
+def apply_sqlite_profile(engine, pragmas=None, spatialite=None):
+    """
+    Registers a "connect" listener on a SQLite engine that sets pragmas(DEFAULT_SQLITE_PRAGMAS if None) on every
+    new connection and, if spatialite is set, loads the SpatiaLite extension. spatialite is True for the default
+    library name or the path of the library. A missing SpatiaLite library is logged and the connection is
+    used without it.
+    """
+    from sqlalchemy import event
+
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = validate_pragmas(DEFAULT_SQLITE_PRAGMAS if pragmas is None else pragmas)
+    spatialite_library = DEFAULT_SPATIALITE_LIBRARY if spatialite is True else spatialite
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if spatialite_library:
+            try:
+                dbapi_connection.enable_load_extension(True)
+                try:
+                    dbapi_connection.load_extension(spatialite_library)
+                finally:
+                    dbapi_connection.enable_load_extension(False)
+            # AttributeError if Python's sqlite3 was built without extension loading.
+            except Exception as e:
+                logger.error("Unable to load SpatiaLite: %s: %s", spatialite_library, e)
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute("PRAGMA %s = %s" % (name, value))
+        finally:
+            cursor.close()
+
+
+def sqlite_pragmas_from_config(config_file, section='SQLite'):
+    """
+    Reads pragmas and the SpatiaLite setting from an ini file section. Pragmas not in the section keep their
+    DEFAULT_SQLITE_PRAGMAS value, "profile = none" starts from no pragmas at all. Returns (pragmas, spatialite).
+    """
+    if not config_file.has_section(section):
+        return dict(DEFAULT_SQLITE_PRAGMAS), None
+    pragmas = {} if config_file.get(section, 'profile', fallback='default').lower() == 'none' \
+        else dict(DEFAULT_SQLITE_PRAGMAS)
+    for name in SQLITE_PRAGMA_NAMES:
+        if config_file.has_option(section, name):
+            pragmas[name] = config_file.get(section, name)
+    spatialite = config_file.get(section, 'spatialite', fallback=None)
+    if spatialite is not None:
+        if spatialite.lower() in ('true', 'yes', '1'):
+            spatialite = True
+        elif spatialite.lower() in ('false', 'no', '0', ''):
+            spatialite = None
+    return validate_pragmas(pragmas), spatialite
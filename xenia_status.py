@@ -0,0 +1,105 @@
+"""
+Cached current status view of the whole network.
+
+CurrentStatusView keeps the current platform and sensor statuses, read with the bulk
+xeniaAlchemy.get_current_platform_statuses()/get_current_sensor_statuses() queries, in memory. After max_age
+seconds it checks xeniaAlchemy.get_status_fingerprint() and only reloads when a status row was added or
+updated, or a status began or ended since the last load. A status page is served from memory, with at most
+three small queries per max_age instead of one query per platform and sensor.
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+
+
+class CurrentStatusView:
+    """
+    Current platform and sensor statuses of a connected xeniaAlchemy, refreshed at most every max_age seconds.
+    Safe to share between threads.
+    """
+    def __init__(self, db, max_age=30):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.db = db
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._platform_statuses = {}
+        self._sensor_statuses = {}
+        self._sensors_by_platform = {}
+        self._fingerprint = None
+        self._next_change = None
+        self._checked = None
+
+    def _load(self, now):
+        # get_status_fingerprint() reads the primary, so the statuses do too. A lagging replica would otherwise
+        # be loaded under the primary's newer fingerprint and kept until the next change.
+        with self.db.primary():
+            platform_statuses = self.db.get_current_platform_statuses(at=now)
+            sensor_statuses = self.db.get_current_sensor_statuses(at=now)
+        if platform_statuses is None or sensor_statuses is None:
+            return False
+        sensors_by_platform = {}
+        for row in sensor_statuses.values():
+            sensors_by_platform.setdefault(row.platform_handle, []).append(row)
+        self._platform_statuses = platform_statuses
+        self._sensor_statuses = sensor_statuses
+        self._sensors_by_platform = sensors_by_platform
+        return True
+
+    def refresh(self, force=False):
+        """
+        Reloads the statuses if they may have changed. Returns True if they were reloaded. If the database
+        can't be read the previous statuses are kept.
+        """
+        with self._lock:
+            monotonic_now = time.monotonic()
+            if not force and self._checked is not None and monotonic_now - self._checked < self.max_age:
+                return False
+            now = datetime.now()
+            result = self.db.get_status_fingerprint(at=now)
+            if result is None:
+                return False
+            fingerprint, next_change = result
+            self._checked = monotonic_now
+            if not force and fingerprint == self._fingerprint and \
+                    (self._next_change is None or now < self._next_change):
+                return False
+            if not self._load(now):
+                return False
+            self._fingerprint = fingerprint
+            self._next_change = next_change
+            self.logger.debug("Current status view loaded: %d platform and %d sensor statuses.",
+                              len(self._platform_statuses), len(self._sensor_statuses))
+            return True
+
+    def platform_status(self, platform_handle):
+        """
+        The current platform_status row of a platform, None if it has no current status.
+        """
+        self.refresh()
+        return self._platform_statuses.get(platform_handle)
+
+    def sensor_status(self, sensor_id):
+        """
+        The current sensor_status row of a sensor, None if it has no current status.
+        """
+        self.refresh()
+        return self._sensor_statuses.get(sensor_id)
+
+    def sensor_statuses(self, platform_handle):
+        """
+        The current sensor_status rows of a platform's sensors.
+        """
+        self.refresh()
+        return list(self._sensors_by_platform.get(platform_handle, []))
+
+    def network(self):
+        """
+        The whole network's current statuses: a dictionary keyed on platform_handle, for every platform with
+        a current status or a sensor with one, of (platform_status row or None, [sensor_status rows]).
+        """
+        self.refresh()
+        platform_handles = set(self._platform_statuses).union(self._sensors_by_platform)
+        return {platform_handle: (self._platform_statuses.get(platform_handle),
+                                  list(self._sensors_by_platform.get(platform_handle, [])))
+                for platform_handle in sorted(platform_handles)}
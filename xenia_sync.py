@@ -0,0 +1,370 @@
+"""
+Incremental multi_obs replication from an edge collector database(usually SQLite) into a central Xenia
+database.
+
+Each source has a high-water mark, the last multi_obs.row_id copied, in the central sync_state table. A run
+reads the source in row_id order after that mark, one chunk at a time through the primary key, so the work
+and the bytes moved scale with the new rows only. Source sensor ids are remapped to the central ids through
+(platform_handle, obs_type, uom_type, s_order), missing platforms and sensors are provisioned on the central
+database. Every chunk is loaded into a temporary staging table(COPY on PostgreSQL), inserted into multi_obs
+skipping rows the central database already has, and the high-water mark is moved in the same transaction,
+so an interrupted run resumes from the last committed chunk without duplicating or losing rows.
+
+Row ids must be assigned in commit order on the source, which holds for SQLite's single writer. Rows
+updated in place on the source after they were synced are not copied again.
+"""
+import argparse
+import csv
+import io
+import logging
+import time
+from datetime import datetime
+
+from sqlalchemy import (
+    Column,
+    MetaData,
+    Table,
+    and_,
+    delete,
+    exc,
+    exists,
+    insert,
+    select,
+)
+from sqlalchemy.schema import CreateTable
+
+from .database_settings import DatabaseConfiguration
+from .xeniaAlchemy import MULTI_OBS_BULK_COLUMNS, xeniaAlchemy
+from .XeniaTables import multi_obs, sync_state
+
+logger = logging.getLogger(__name__)
+
+# COPY ... WITH (FORMAT csv) NULL marker, the empty string is left to mean an empty qc_flag.
+COPY_NULL = '\\N'
+
+
+def _build_stage_table():
+    stage_metadata = MetaData()
+    return Table('xenia_sync_stage', stage_metadata,
+                 *[Column(name, multi_obs.__table__.c[name].type) for name in MULTI_OBS_BULK_COLUMNS],
+                 prefixes=['TEMPORARY'])
+
+
+class MultiObsSync:
+    """
+    Copies new multi_obs rows from source_config to target_config, both DatabaseConfiguration objects.
+    source_name keys the high-water mark in the target's sync_state table and must be unique per source.
+    chunk_size rows are read, written and committed at a time. If add_missing_sensors is False, rows for
+    sensors the central database doesn't have are skipped(and counted) instead of provisioning them.
+    metrics is an optional xenia_metrics.XeniaMetrics for the central database connection.
+    """
+    def __init__(self, source_config, target_config, source_name, chunk_size=10000, add_missing_sensors=True,
+                 metrics=None):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.source_config = source_config
+        self.target_config = target_config
+        self.source_name = source_name
+        self.chunk_size = chunk_size
+        self.add_missing_sensors = add_missing_sensors
+        self.metrics = metrics
+        self.source = None
+        self.target = None
+        # Source sensor_id -> (central sensor_id, central m_type_id), None for sensors skipped because the central
+        # database lacks them and add_missing_sensors is off.
+        self._sensor_map = {}
+        self._stage = _build_stage_table()
+
+    def connect(self):
+        self.source = self._connect(self.source_config)
+        self.target = self._connect(self.target_config, self.metrics)
+        return self.source is not None and self.target is not None
+
+    def _connect(self, config, metrics=None):
+        db = xeniaAlchemy()
+        if db.connect_db(config.get_connection_string(), False, metrics=metrics,
+                         sqlite_pragmas=config.sqlite_pragmas, spatialite=config.spatialite):
+            return db
+        self.logger.error("Unable to connect to: %s", config.get_connection_string())
+        return None
+
+    def disconnect(self):
+        for db in (self.source, self.target):
+            if db is not None:
+                db.disconnect()
+        self.source = None
+        self.target = None
+
+    def __enter__(self):
+        if not self.connect():
+            self.disconnect()
+            raise RuntimeError("Unable to connect to the sync databases.")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disconnect()
+
+    def _map_sensors(self, source_sensor_ids):
+        """
+        Adds the source sensors not in the sensor map yet, provisioning the central platform and sensor if
+        add_missing_sensors is set. Sensors the central database doesn't have with add_missing_sensors off map
+        to None. Sensors that can't be resolved(no source platform/m_type, or provisioning failed) are left out
+        of the map so their rows are retried on the next run.
+        """
+        source_catalog = self.source.get_sensor_catalog(sensor_ids=source_sensor_ids)
+        if source_catalog is None:
+            raise RuntimeError("Unable to read the source sensor catalog.")
+        source_keys = {rec[0]: tuple(rec[1:5]) for rec in source_catalog}
+        source_names = {rec[0]: rec[6] for rec in source_catalog}
+        with self.target.primary():
+            central_ids = self._central_ids()
+            # Everything missing is provisioned platform by platform and the catalog read again once.
+            observations = {}
+            for source_sensor_id in source_sensor_ids:
+                key = source_keys.get(source_sensor_id)
+                if key is not None and key not in central_ids and self.add_missing_sensors:
+                    platform_handle, obs_name, uom, s_order = key
+                    # Keyed on the sensor key, two source sensors can resolve to the same central sensor.
+                    platform_observations = observations.setdefault(platform_handle, {})
+                    platform_observations.setdefault(key, {'obs_name': obs_name, 'uom_name': uom, 's_order': s_order,
+                                                           'sensor_name': source_names[source_sensor_id]})
+            for platform_handle, platform_observations in observations.items():
+                self.logger.info("Provisioning %d sensors on platform: %s", len(platform_observations),
+                                 platform_handle)
+                self.target.build_minimal_platform(platform_handle, list(platform_observations.values()))
+            if observations:
+                central_ids = self._central_ids()
+
+            for source_sensor_id in source_sensor_ids:
+                key = source_keys.get(source_sensor_id)
+                if key is None:
+                    self.logger.error("Source sensor: %s has no platform/m_type, its rows are held back.",
+                                      source_sensor_id)
+                elif key in central_ids:
+                    self._sensor_map[source_sensor_id] = central_ids[key]
+                elif self.add_missing_sensors:
+                    platform_handle, obs_name, uom, s_order = key
+                    self.logger.error("Sensor: %s(%s) s_order: %s on platform: %s was not provisioned, its rows "
+                                      "are held back.", obs_name, uom, s_order, platform_handle)
+                else:
+                    self._sensor_map[source_sensor_id] = None
+
+    def _central_ids(self):
+        """
+        Returns a dictionary of (platform_handle, obs, uom, s_order) -> (sensor_id, m_type_id) for the central
+        database.
+        """
+        catalog = self.target.get_sensor_catalog()
+        if catalog is None:
+            raise RuntimeError("Unable to read the central sensor catalog.")
+        return {tuple(rec[1:5]): (rec[0], rec[5]) for rec in catalog}
+
+    def _lock_state(self):
+        """
+        Returns the sync_state row for the source, created if this is the first run, locked(FOR UPDATE on
+        PostgreSQL) until the chunk transaction commits so two runs for the same source can't interleave.
+        """
+        session = self.target.session
+        state = session.query(sync_state).filter(sync_state.source_name == self.source_name) \
+            .with_for_update().one_or_none()
+        if state is None:
+            state = sync_state(row_entry_date=datetime.now(), source_name=self.source_name, last_row_id=0,
+                               rows_synced=0)
+            session.add(state)
+            session.flush()
+        return state
+
+    def _read_chunk(self, after_row_id):
+        table = multi_obs.__table__
+        stmt = select(table.c.row_id, *[table.c[name] for name in MULTI_OBS_BULK_COLUMNS]) \
+            .where(table.c.row_id > after_row_id) \
+            .order_by(table.c.row_id) \
+            .limit(self.chunk_size)
+        try:
+            return self.source.session.execute(stmt).all()
+        finally:
+            # Ends the read transaction so a SQLite source isn't holding a WAL snapshot between chunks.
+            self.source.session.rollback()
+
+    def _copy_rows(self, connection, rows):
+        """
+        Loads rows into the staging table with COPY. Returns False if the driver has no COPY support.
+        """
+        cursor = connection.connection.cursor()
+        if not hasattr(cursor, 'copy_expert'):
+            cursor.close()
+            return False
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([COPY_NULL if row[name] is None else row[name] for name in MULTI_OBS_BULK_COLUMNS])
+        buffer.seek(0)
+        statement = "COPY %s (%s) FROM STDIN WITH (FORMAT csv, NULL '%s')" % (
+            self._stage.name, ', '.join(MULTI_OBS_BULK_COLUMNS), COPY_NULL)
+        dbapi = connection.dialect.loaded_dbapi
+        try:
+            cursor.copy_expert(statement, buffer)
+        # Errors from the raw cursor aren't wrapped by SQLAlchemy, wrap them as it would so run() rolls back.
+        except dbapi.Error as e:
+            raise exc.DBAPIError.instance(statement, None, e, dbapi.Error, dialect=connection.dialect) from e
+        finally:
+            cursor.close()
+        return True
+
+    def _write_chunk(self, rows):
+        """
+        Stages rows and inserts the ones the central multi_obs doesn't already have(same sensor_id, m_type_id
+        and m_date). Runs in the target session's transaction, the caller commits. Returns the number of rows
+        inserted.
+        """
+        connection = self.target.session.connection()
+        connection.execute(CreateTable(self._stage, if_not_exists=True))
+        if connection.dialect.name != 'postgresql' or not self._copy_rows(connection, rows):
+            connection.execute(insert(self._stage), rows)
+
+        stage = self._stage.c
+        already_synced = exists().where(and_(multi_obs.sensor_id == stage.sensor_id,
+                                             multi_obs.m_date == stage.m_date,
+                                             multi_obs.m_type_id == stage.m_type_id))
+        stmt = insert(multi_obs.__table__).from_select(
+            list(MULTI_OBS_BULK_COLUMNS) + ['the_geom'],
+            select(*[stage[name] for name in MULTI_OBS_BULK_COLUMNS],
+                   self.target._point_expression(stage.m_lon, stage.m_lat)).where(~already_synced))
+        inserted_count = connection.execute(stmt).rowcount
+        connection.execute(delete(self._stage))
+        return inserted_count
+
+    """
+    Function: run
+    Purpose: Copies the source rows after the high-water mark to the central database, one committed chunk
+    at a time.
+    Parameters:
+      max_chunks, if set, stops the run after that many chunks, to bound the time a run takes.
+    Returns:
+      A dictionary with the rows read, written and skipped, the chunk count, the high-water mark and the
+      elapsed seconds, or None if the run failed. Chunks committed before a failure stay synced. A run stops
+      at the first row of a sensor that can't be mapped, the high-water mark is left just before it.
+    """
+
+
+    def run(self, max_chunks=None):
+        stats = {'source_name': self.source_name, 'rows_read': 0, 'rows_written': 0, 'rows_skipped': 0,
+                 'chunks': 0, 'last_row_id': None}
+        start_time = time.perf_counter()
+        # Sensors skipped last run because the central database lacked them are looked up again, they may have
+        # been added since.
+        self._sensor_map = {source_sensor_id: central_ids for source_sensor_id, central_ids
+                            in self._sensor_map.items() if central_ids is not None}
+        try:
+            while max_chunks is None or stats['chunks'] < max_chunks:
+                state = self._lock_state()
+                stats['last_row_id'] = state.last_row_id
+                source_rows = self._read_chunk(state.last_row_id)
+                if not source_rows:
+                    self.target.session.commit()
+                    break
+
+                unmapped = {row.sensor_id for row in source_rows
+                            if row.sensor_id is not None and row.sensor_id not in self._sensor_map}
+                if unmapped:
+                    self._map_sensors(unmapped)
+                    # Provisioning commits on its own, take the state lock again before writing.
+                    state = self._lock_state()
+
+                # The high-water mark stops before the first row of a sensor we couldn't resolve, so the rows
+                # from there on are read again on the next run instead of being lost.
+                held_index = next((ndx for ndx, source_row in enumerate(source_rows)
+                                   if source_row.sensor_id is not None
+                                   and source_row.sensor_id not in self._sensor_map), None)
+                if held_index is not None:
+                    self.logger.error("Sync: %s holding the high-water mark at row_id: %d, source sensor: %s is "
+                                      "not mapped.", self.source_name, source_rows[held_index].row_id,
+                                      source_rows[held_index].sensor_id)
+                    source_rows = source_rows[:held_index]
+                    if not source_rows:
+                        self.target.session.commit()
+                        break
+
+                rows = []
+                for source_row in source_rows:
+                    central_ids = self._sensor_map.get(source_row.sensor_id)
+                    if central_ids is None:
+                        stats['rows_skipped'] += 1
+                        continue
+                    row = {name: source_row._mapping[name] for name in MULTI_OBS_BULK_COLUMNS}
+                    row['sensor_id'], row['m_type_id'] = central_ids
+                    rows.append(row)
+
+                inserted_count = self._write_chunk(rows) if rows else 0
+                state.last_row_id = source_rows[-1].row_id
+                state.last_m_date = max((row.m_date for row in source_rows if row.m_date is not None),
+                                        default=state.last_m_date)
+                state.rows_synced += inserted_count
+                state.row_update_date = datetime.now()
+                self.target.session.commit()
+
+                if self.metrics is not None:
+                    self.metrics.add_rows_written(inserted_count)
+                stats['rows_read'] += len(source_rows)
+                stats['rows_written'] += inserted_count
+                stats['chunks'] += 1
+                stats['last_row_id'] = state.last_row_id
+                self.logger.info("Sync: %s chunk: %d rows read: %d written: %d high-water mark: %d",
+                                 self.source_name, stats['chunks'], len(source_rows), inserted_count,
+                                 state.last_row_id)
+                if held_index is not None or len(source_rows) < self.chunk_size:
+                    break
+        except (exc.SQLAlchemyError, RuntimeError) as e:
+            self.target.session.rollback()
+            self.logger.exception(e)
+            return None
+        stats['elapsed'] = time.perf_counter() - start_time
+        self.logger.info("Sync: %s finished, %d rows read, %d written, %d skipped in %.2f seconds.",
+                         self.source_name, stats['rows_read'], stats['rows_written'], stats['rows_skipped'],
+                         stats['elapsed'])
+        return stats
+
+    """
+    Function: status
+    Purpose: The sync_state row for the source.
+    Returns:
+      A dictionary of the sync_state columns, an empty dictionary if the source was never synced, or None if
+      an error occurred.
+    """
+
+
+    def status(self):
+        try:
+            state = self.target.session.query(sync_state) \
+                .filter(sync_state.source_name == self.source_name).one_or_none()
+            if state is None:
+                return {}
+            return {column.name: getattr(state, column.name) for column in sync_state.__table__.columns}
+        except exc.SQLAlchemyError as e:
+            self.logger.exception(e)
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync new multi_obs rows from a collector to a central database.")
+    parser.add_argument("--source-ini", required=True, help="ini file with the source [Database] section.")
+    parser.add_argument("--target-ini", required=True, help="ini file with the central [Database] section.")
+    parser.add_argument("--source-name", required=True, help="Unique name of the source, keys its high-water mark.")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--max-chunks", type=int, default=None)
+    parser.add_argument("--skip-missing-sensors", action="store_true",
+                        help="Skip rows of sensors the central database doesn't have instead of adding them.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    sync = MultiObsSync(DatabaseConfiguration(None, ini_file=args.source_ini),
+                        DatabaseConfiguration(None, ini_file=args.target_ini),
+                        args.source_name,
+                        chunk_size=args.chunk_size,
+                        add_missing_sensors=not args.skip_missing_sensors)
+    with sync:
+        stats = sync.run(args.max_chunks)
+    return 0 if stats is not None else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())